@@ -0,0 +1,156 @@
+"""
+Micro-benchmark for decoding GPGNet frames as FA sends them to the relay.
+
+Compares fa.gpgnet.GPGNetDecoder with the QDataStream state machine that
+Relayer.readData used before it, fed from a QBuffer in socket-sized reads.
+
+    python2 bench/gpgnet_decode.py [frames] [read size]
+"""
+import os
+import struct
+import sys
+import time
+
+from PyQt4 import QtCore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fa.gpgnet import GPGNetDecoder
+
+
+def pack_frame(action, chunks):
+    data = struct.pack("<I", len(action)) + action + struct.pack("<i", len(chunks))
+    for chunk in chunks:
+        if isinstance(chunk, int):
+            data += struct.pack("<bi", 0, chunk)
+        else:
+            data += struct.pack("<bi", 1, len(chunk)) + chunk
+    return data
+
+
+def lobby_traffic(frames):
+    """ What a 12 player lobby looks like: mostly options and state spam """
+    sample = [
+        pack_frame("GameState", ["Lobby"]),
+        pack_frame("GameOption", ["ScenarioFile", "/maps/scmp_007/scmp_007_scenario.lua"]),
+        pack_frame("GameOption", ["Slots", 12]),
+        pack_frame("PlayerOption", [7, "Faction", 2]),
+        pack_frame("PlayerOption", [7, "Team", 3]),
+        pack_frame("PlayerOption", [7, "StartSpot", 7]),
+        pack_frame("GameMods", ["activated", 1]),
+        pack_frame("Chat", ["gl/thf/n"]),
+    ]
+    return "".join(sample[i % len(sample)] for i in range(frames))
+
+
+def bench_decoder(data, read_size):
+    decoder = GPGNetDecoder()
+    count = 0
+    start = time.time()
+    for offset in range(0, len(data), read_size):
+        decoder.feed(data[offset:offset + read_size])
+        for _ in decoder.frames():
+            count += 1
+    return count, time.time() - start
+
+
+class LegacyReader(object):
+    """ Relayer.readData as it was, reading from a QBuffer instead of a socket """
+    def __init__(self, device):
+        self.inputSocket = device
+        self.headerSizeRead = False
+        self.headerRead = False
+        self.chunkSizeRead = False
+        self.fieldTypeRead = False
+        self.fieldSizeRead = False
+        self.blockSize = 0
+        self.fieldSize = 0
+        self.chunkSize = 0
+        self.fieldType = 0
+        self.chunks = []
+        self.count = 0
+
+    def readData(self):
+        ins = QtCore.QDataStream(self.inputSocket)
+        ins.setByteOrder(QtCore.QDataStream.LittleEndian)
+
+        while not ins.atEnd():
+            if not self.headerSizeRead:
+                if self.inputSocket.bytesAvailable() < 4:
+                    return
+                self.blockSize = ins.readUInt32()
+                self.headerSizeRead = True
+            if not self.headerRead:
+                if self.inputSocket.bytesAvailable() < self.blockSize:
+                    return
+                self.action = ins.readRawData(self.blockSize)
+                self.headerRead = True
+            if not self.chunkSizeRead:
+                if self.inputSocket.bytesAvailable() < 4:
+                    return
+                self.chunkSize = ins.readInt32()
+                self.chunks = []
+                self.chunkSizeRead = True
+            for _ in range(len(self.chunks), self.chunkSize):
+                if not self.fieldTypeRead:
+                    if self.inputSocket.bytesAvailable() < 1:
+                        return
+                    self.fieldType = ins.readBool()
+                    self.fieldTypeRead = True
+                if not self.fieldType:
+                    if self.inputSocket.bytesAvailable() < 4:
+                        return
+                    self.chunks.append(ins.readInt32())
+                    self.fieldTypeRead = False
+                else:
+                    if not self.fieldSizeRead:
+                        if self.inputSocket.bytesAvailable() < 4:
+                            return
+                        self.fieldSize = ins.readInt32()
+                        self.fieldSizeRead = True
+                    if self.inputSocket.bytesAvailable() < self.fieldSize:
+                        return
+                    datatring = ins.readRawData(self.fieldSize)
+                    self.chunks.append(datatring.replace("/t", "\t").replace("/n", "\n"))
+                    self.fieldTypeRead = False
+                    self.fieldSizeRead = False
+            self.count += 1
+            self.action = None
+            self.chunks = []
+            self.headerSizeRead = False
+            self.headerRead = False
+            self.chunkSizeRead = False
+            self.fieldTypeRead = False
+            self.fieldSizeRead = False
+
+
+def bench_legacy(data, read_size):
+    buf = QtCore.QByteArray()
+    device = QtCore.QBuffer(buf)
+    device.open(QtCore.QIODevice.ReadWrite)
+    reader = LegacyReader(device)
+    start = time.time()
+    for offset in range(0, len(data), read_size):
+        # Append behind the read position, like bytes arriving on a socket
+        pos = device.pos()
+        device.seek(device.size())
+        device.write(data[offset:offset + read_size])
+        device.seek(pos)
+        reader.readData()
+    return reader.count, time.time() - start
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    read_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    data = lobby_traffic(frames)
+    print "%i frames, %i bytes, %i byte reads" % (frames, len(data), read_size)
+
+    count, elapsed = bench_decoder(data, read_size)
+    print "GPGNetDecoder: %10.0f frames/s" % (count / elapsed)
+    count, elapsed = bench_legacy(data, read_size)
+    print "legacy QDataStream reader: %10.0f frames/s" % (count / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark for vault.luaparser on generated _save.lua files.
+
+Writes a save file with the given number of mass, hydrocarbon and army markers
+and times the marker query the map vault runs before uploading a map, both as
+a streaming query and as a full parse, along with how much the peak memory use
+of the process grew. Pass the path of another luaparser.py (e.g. one checked
+out from an older revision) to time its parse on the same file.
+
+    python2 bench/luaparser.py [markers] [other_luaparser.py]
+"""
+import imp
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+MARKER = """                ['%(name)s'] = {
+                    ['size'] = FLOAT( 1.000000 ),
+                    ['resource'] = BOOLEAN( true ),
+                    ['amount'] = FLOAT( 100.000000 ),
+                    ['color'] = STRING( 'ff808080' ),
+                    ['editorIcon'] = STRING( '/textures/editor/marker_mass.bmp' ),
+                    ['type'] = STRING( '%(type)s' ),
+                    ['prop'] = STRING( '/env/common/props/markers/M_Mass_prop.bp' ),
+                    ['orientation'] = VECTOR3( 0, -0, 0 ),
+                    ['position'] = VECTOR3( %(x).4f, %(y).4f, %(z).4f ),
+                },
+"""
+
+SEARCH = {'markers>mass*>position': 'mass:__parent__',
+          'markers>hydro*>position': 'hydro:__parent__',
+          'markers>army*>position': 'army:__parent__'}
+
+
+def write_save(filename, count):
+    kinds = [("Mass %02i", "Mass"), ("Hydrocarbon %02i", "Hydrocarbon"), ("ARMY_%i", "Blank Marker"),
+             ("Path Node %i", "Land Path Node")]
+    with open(filename, "w") as save:
+        save.write("Scenario = {\n    next_area_id = '1',\n    Props = {\n    },\n")
+        save.write("    MasterChain = {\n        ['_MASTERCHAIN_'] = {\n            Markers = {\n")
+        for i in range(count):
+            name, kind = kinds[i % len(kinds)]
+            save.write(MARKER % dict(name=name % i, type=kind, x=random.uniform(0, 4096),
+                                     y=random.uniform(0, 200), z=random.uniform(0, 4096)))
+        save.write("            },\n        },\n    },\n    Chains = {\n    },\n}\n")
+
+
+def bench(module, filename, method="parse"):
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    parser = module.luaParser(filename)
+    result = getattr(parser, method)(dict(SEARCH))
+    elapsed = time.time() - start
+    grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak
+    return elapsed, grown, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    fd, filename = tempfile.mkstemp(suffix="_save.lua")
+    os.close(fd)
+    try:
+        write_save(filename, count)
+        print "%i markers, %.1f MB" % (count, os.path.getsize(filename) / 1024.0 / 1024)
+
+        from vault import luaparser
+        # The query goes first, the peak only grows
+        elapsed, grown, result = bench(luaparser, filename, "query")
+        print "query:           %7.2f s, peak +%i MB" % (elapsed, grown / 1024)
+        elapsed, grown, parsed = bench(luaparser, filename)
+        print "parse:           %7.2f s, peak +%i MB (%s result)" % (elapsed, grown / 1024,
+                                                                 "same" if parsed == result else "different")
+
+        if len(sys.argv) > 2:
+            other = imp.load_source("other_luaparser", sys.argv[2])
+            elapsed, grown, other_result = bench(other, filename)
+            print "other parse:     %7.2f s, peak +%i MB (%s result)" % (elapsed, grown / 1024,
+                                                                     "same" if other_result == result else "different")
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
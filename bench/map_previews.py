@@ -0,0 +1,99 @@
+"""
+Benchmark for generating map previews from the DDS embedded in .scmap files.
+
+Builds a corpus of synthetic maps with 256x256 BGRA previews, extracts each
+DDS the way fa.maps does, then times fa.maps.genPrevFromDDS against the
+per-pixel bytearray conversion it replaced.
+
+    python2 bench/map_previews.py [maps]
+"""
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+from PyQt4 import QtCore, QtGui
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fa import maps
+
+PREVIEW_SIZE = 256
+
+
+def make_dds(size):
+    header = bytearray(maps.DDS_HEADER_SIZE)
+    header[0:4] = "DDS "
+    header[12:20] = struct.pack("<II", size, size)
+    pixels = bytearray(random.getrandbits(8) for _ in range(size * 4)) * size
+    return str(header) + str(pixels)
+
+
+def make_corpus(folder, count):
+    dds = make_dds(PREVIEW_SIZE)
+    for i in range(count):
+        with open(os.path.join(folder, "map_%i.scmap" % i), "wb") as scmap:
+            scmap.write("\x00" * 30)
+            scmap.write(struct.pack("i", len(dds)))
+            scmap.write(dds)
+            scmap.write("\x00" * 1024)  # heightmap etc. follow in real maps
+
+
+def extract_dds(scmapname, ddsname):
+    with open(scmapname, "rb") as mapfile:
+        mapfile.seek(30)
+        size = struct.unpack('i', mapfile.read(4))[0]
+        data = mapfile.read(size)
+    with open(ddsname, "wb") as ddsfile:
+        ddsfile.write(data)
+
+
+def legacy_gen_prev_from_dds(sourcename, destname, small=False):
+    """ fa.maps.genPrevFromDDS as it was """
+    img = bytearray()
+    buf = bytearray(16)
+    file = open(sourcename, "rb")
+    file.seek(128)
+    while file.readinto(buf):
+        img += buf[:3] + buf[4:7] + buf[8:11] + buf[12:15]
+    file.close()
+
+    size = int((len(img)/3) ** (1.0/2))
+    if small:
+        imageFile = QtGui.QImage(img, size, size, QtGui.QImage.Format_RGB888).rgbSwapped().scaled(100, 100, transformMode=QtCore.Qt.SmoothTransformation)
+    else:
+        imageFile = QtGui.QImage(img, size, size, QtGui.QImage.Format_RGB888).rgbSwapped()
+    imageFile.save(destname)
+
+
+def bench(folder, count, convert):
+    start = time.time()
+    for i in range(count):
+        base = os.path.join(folder, "map_%i" % i)
+        extract_dds(base + ".scmap", base + ".dds")
+        convert(base + ".dds", base + ".small.png", small=True)
+        convert(base + ".dds", base + ".large.png", small=False)
+    return time.time() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    app = QtGui.QApplication([])
+    folder = tempfile.mkdtemp()
+    try:
+        make_corpus(folder, count)
+        print "%i maps with %ix%i previews" % (count, PREVIEW_SIZE, PREVIEW_SIZE)
+        elapsed = bench(folder, count, maps.genPrevFromDDS)
+        print "genPrevFromDDS:        %7.2f ms per map" % (elapsed * 1000 / count)
+        elapsed = bench(folder, count, legacy_gen_prev_from_dds)
+        print "legacy genPrevFromDDS: %7.2f ms per map" % (elapsed * 1000 / count)
+    finally:
+        shutil.rmtree(folder)
+        del app
+
+
+if __name__ == '__main__':
+    main()
@@ -81,6 +81,11 @@ if __name__ == '__main__':
         myappid = 'com.faforever.lobby'
         ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
 
+    if "--verify" in sys.argv:
+        # Hash all game files again instead of trusting the checksum manifest
+        sys.argv.remove("--verify")
+        util.checksums.verify = True
+
     if len(sys.argv) == 1:
         #Do the magic   
         sys.path += ['.'] 
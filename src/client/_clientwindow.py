@@ -21,6 +21,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 import util
+from util.trafficlog import TrafficLog
 import secondaryServer
 
 import json
@@ -144,6 +145,7 @@ class ClientWindow(FormClass, BaseClass):
         self.socket.disconnected.connect(self.disconnectedFromServer)
         self.socket.error.connect(self.socketError)
         self.blockSize = 0
+        self.trafficLog = TrafficLog(logger, sample=Settings.get('TRAFFIC_SAMPLE', 'LOG'))
 
         self.uniqueId = None
         try:
@@ -1273,7 +1275,7 @@ class ClientWindow(FormClass, BaseClass):
                 return
 
             action = ins.readQString()
-            logger.info("Server: '%s'" % action)
+            self.trafficLog.log("Server: '%s'", action, size=self.blockSize)
 
             if action == "PING":
                 self.writeToServer("PONG")
@@ -1282,7 +1284,7 @@ class ClientWindow(FormClass, BaseClass):
             try:
                 self.dispatch(json.loads(action))
             except:
-                logger.error("Error dispatching JSON: " + action, exc_info=sys.exc_info())
+                logger.error("Error dispatching JSON: %s", action, exc_info=sys.exc_info())
 
             self.blockSize = 0
 
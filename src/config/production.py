@@ -17,7 +17,9 @@ defaults = {
     'LOG': {
         'DIR': join(APPDATA_DIR, 'logs'),
         'LEVEL': logging.WARNING,
-        'MAX_SIZE': 256*1024
+        'MAX_SIZE': 256*1024,
+        # Only log every Nth message in network traffic logs, see util.trafficlog
+        'TRAFFIC_SAMPLE': 1
     },
     'FA': {
         "BIN": join(APPDATA_DIR, "bin"),
@@ -25,6 +27,29 @@ defaults = {
         "MODS_PATH": join(join(APPDATA_DIR, "repo"), "mods"),
         "MAPS_PATH": join(join(APPDATA_DIR, "repo"), "maps"),
     },
+    'CACHE': {
+        # Budgets for the downloaded and generated previews, see util.cache
+        'MAX_DISK_SIZE': 256*1024*1024,
+        'MAX_MEMORY_SIZE': 64*1024*1024,
+        # Number of lua parser results kept, see util.cache.ResultCache
+        'MAX_LUA_RESULTS': 4096
+    },
+    'MOD_SCAN': {
+        # Installed mods read at the same time
+        'PARALLEL': 4
+    },
+    'UPDATER': {
+        # Files downloaded at the same time
+        'PARALLEL': 3,
+        # Ranges of a large file downloaded at the same time
+        'DOWNLOAD_SEGMENTS': 4,
+        # Game files checked and patched at the same time
+        'PATCH_PARALLEL': 4
+    },
+    'MAP_PREFETCH': {
+        # Maps of open games downloaded at the same time, 0 turns prefetching off
+        'PARALLEL': 2
+    },
     'PROXY': {
         'HOST': 'proxy.faforever.com',
         'PORT': 9134
@@ -48,10 +73,16 @@ defaults = {
     'USE_CHAT': True,
     'ONLINE_REPLAY_SERVER': {
         'HOST': 'lobby.faforever.com',
-        'PORT': 15000
+        'PORT': 15000,
+        # Replay data kept while the server can't take it, see fa.replayupload
+        'BUFFER_SIZE': 16*1024*1024,
+        # Milliseconds to wait for the rest of the replay to be sent at the end of a game
+        'FLUSH_TIMEOUT': 30000
     },
     'RELAY_SERVER': {
         'HOST': 'lobby.faforever.com',
-        'PORT': 8000
+        'PORT': 8000,
+        # qstring, json or msgpack, see fa.framing
+        'FRAMING': 'qstring'
     }
 }
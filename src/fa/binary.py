@@ -2,14 +2,130 @@ from PyQt4 import QtGui, QtCore
 from fa.patchspec import RETAIL, STEAM
 from util import BIN_DIR
 import os
-import bsdiff4
+import bsdiff4.core
+import bz2
 import shutil
 import logging
 import hashlib
+import multiprocessing
+import tempfile
+from multiprocessing.pool import ThreadPool
 
 logger = logging.getLogger(__name__)
 
-from util import settings
+from config import Settings
+from util import settings, checksums, replaceFile
+
+PATCH_DIR = "/res/patches"
+
+# Bytes of the source, diff and extra data handled at a time
+PATCH_BLOCK_SIZE = 1024 * 1024
+
+# Compressed bytes of the patch fed to bz2 at a time
+COMPRESSED_BLOCK_SIZE = 64 * 1024
+
+
+class _Bz2Block(object):
+    """
+    Reads the bz2 compressed block of a bsdiff patch that starts at offset and is length bytes long
+    (None for the rest of the file), decompressing only as much as was asked for.
+    """
+    def __init__(self, patch_path, offset, length=None):
+        self.file = open(patch_path, "rb")
+        self.file.seek(offset)
+        self.left = length
+        self.decompressor = bz2.BZ2Decompressor()
+        self.buffer = ""
+        self.position = 0
+
+    def read(self, count):
+        if len(self.buffer) - self.position < count:
+            pieces = [self.buffer[self.position:]]
+            available = len(pieces[0])
+            while available < count:
+                size = COMPRESSED_BLOCK_SIZE if self.left is None else min(COMPRESSED_BLOCK_SIZE, self.left)
+                data = self.file.read(size) if size else ""
+                if not data:
+                    raise ValueError("corrupt patch (truncated)")
+                if self.left is not None:
+                    self.left -= len(data)
+                piece = self.decompressor.decompress(data)
+                pieces.append(piece)
+                available += len(piece)
+            self.buffer = "".join(pieces)
+            self.position = 0
+        data = self.buffer[self.position:self.position + count]
+        self.position += count
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _read_source(source, size, offset, count):
+    """
+    Returns count bytes of the file source from offset on. Bytes outside of the file read as zeros, which leaves
+    the diff data they're added to as it is.
+    """
+    start = min(max(offset, 0), size)
+    end = min(offset + count, size)
+    source.seek(start)
+    data = source.read(max(0, end - start))
+    return ("\0" * min(count, max(0, -offset)) + data).ljust(count, "\0")
+
+
+def patch_stream(source, patch_path, output):
+    """
+    Applies the bsdiff patch in the file patch_path to the open file source, writing the result to the open file
+    output a block at a time. Returns the md5 of the result.
+
+    Unlike bsdiff4.patch, this doesn't hold the source, the result or the patch in memory as a whole.
+    """
+    with open(patch_path, "rb") as patch:
+        header = patch.read(32)
+    if len(header) != 32 or header[:8] != "BSDIFF40":
+        raise ValueError("not a bsdiff patch: " + patch_path)
+    control_length, diff_length, new_size = [bsdiff4.core.decode_int64(header[i:i + 8]) for i in (8, 16, 24)]
+
+    source_size = os.fstat(source.fileno()).st_size
+    blocks = [_Bz2Block(patch_path, 32, control_length),
+              _Bz2Block(patch_path, 32 + control_length, diff_length),
+              _Bz2Block(patch_path, 32 + control_length + diff_length)]
+    control, diff, extra = blocks
+    md5 = hashlib.md5()
+    try:
+        old_position = new_position = 0
+        while new_position < new_size:
+            entry = control.read(24)
+            add, insert, seek = [bsdiff4.core.decode_int64(entry[i:i + 8]) for i in (0, 8, 16)]
+            if add < 0 or insert < 0 or new_position + add + insert > new_size:
+                raise ValueError("corrupt patch (overflow)")
+
+            # Diff bytes are added to source bytes, the C extension does that for a block at a time
+            while add > 0:
+                count = min(add, PATCH_BLOCK_SIZE)
+                data = bsdiff4.core.patch(_read_source(source, source_size, old_position, count), count,
+                                          [(count, 0, 0)], diff.read(count), "")
+                output.write(data)
+                md5.update(data)
+                old_position += count
+                new_position += count
+                add -= count
+
+            # Extra bytes are taken as they are
+            while insert > 0:
+                data = extra.read(min(insert, PATCH_BLOCK_SIZE))
+                output.write(data)
+                md5.update(data)
+                new_position += len(data)
+                insert -= len(data)
+
+            old_position += seek
+    finally:
+        for block in blocks:
+            block.close()
+    return md5.hexdigest()
+
 
 class Updater(QtCore.QObject):
     progress_reset = QtCore.pyqtSignal()
@@ -43,76 +159,95 @@ class Updater(QtCore.QObject):
         """
         Apply the patch identified by the given checksum to the given file in FAF's bin directory.
         The input file's md5sum must be equal to the given checksum for this to end nonterribly.
-        """
-        with open(os.path.join(BIN_DIR, file_name), "rb+") as source_file:
-            file_data = source_file.read()
-
-            # Workaround, 2014-10-02
-            # We cannot use file_patch_inplace here because it has a bug
-            # See: https://github.com/ilanschnell/bsdiff4/pull/5
-
-            # bsdiff4.file_patch_inplace(file_name, patch_name)
-
-            with open("/res/patches/%s" % checksum, "rb") as patch_file:
-                patched_data = bsdiff4.patch(file_data, patch_file.read())
-                new_md5 = hashlib.md5(patched_data).hexdigest()
 
-            source_file.seek(0)
-            source_file.write(patched_data)
-
-            source_file.truncate()
+        The result is written to a temporary file next to it, synced to disk and then moved over the
+        original, so an interrupted patch leaves the original as it was.
+        """
+        file_path = os.path.join(BIN_DIR, file_name)
+        fd, temp_path = tempfile.mkstemp(dir=BIN_DIR, prefix=file_name + ".")
+        try:
+            with os.fdopen(fd, "wb") as output, open(file_path, "rb") as source_file:
+                new_md5 = patch_stream(source_file, os.path.join(PATCH_DIR, checksum), output)
+                output.flush()
+                os.fsync(output.fileno())
+            replaceFile(temp_path, file_path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
+        checksums.record(file_path, new_md5)
         return new_md5
 
     def md5sum(self, file_path):
-        with open(file_path, "rb+") as source_file:
-            file_data = source_file.read()
-            return hashlib.md5(file_data).hexdigest()
+        return checksums.md5(file_path)
 
     def verify_checksum(self, file_name):
         file_md5 = self.md5sum(os.path.join(BIN_DIR, file_name))
         return file_md5 == self.expected_patched_checksums[file_name]
 
-    def refresh_bin_dir(self, game_path):
+    def refresh_file(self, game_path, file_name):
         """
+        Makes sure the given file in FAF's bin directory has the right checksum, copying it from the game
+        directory and patching it if it doesn't. Returns an error message if that fails, None otherwise.
+        Runs on the worker threads of refresh_bin_dir.
+        """
+        try:
+            if self.verify_checksum(file_name):
+                return None
+
+            # Copy the original from the game directory, renaming if configured to do so.
+            original = dict((new, old) for old, new in self.needed_renames.items()).get(file_name, file_name)
+            dest_path = os.path.join(BIN_DIR, file_name)
+            shutil.copyfile(os.path.join(game_path, original), dest_path)
 
+            # If the configuration has a patch for this file, apply it.
+            checksum = self.md5sum(dest_path)
+            if os.path.isfile(os.path.join(PATCH_DIR, checksum)):
+                checksum = self.patch_file(file_name, checksum)
+
+            if checksum != self.expected_patched_checksums[file_name]:
+                return "Patching failed for: %s" % file_name
+        except (IOError, OSError, ValueError), e:
+            logger.error("Refreshing %s failed" % file_name, exc_info=True)
+            return "Patching failed for: %s (%s)" % (file_name, e)
+        return None
+
+    def refresh_bin_dir(self, game_path):
+        """
+        Checks the files we care about in FAF's bin directory, copying and patching those that fail the checksum
+        test or do not exist. Files are handled on worker threads, a few at a time, while the GUI keeps running.
         """
         if not os.path.exists(BIN_DIR):
             os.makedirs(BIN_DIR)
 
-        # Files that fail the checksum test, or do not exist, are added here. These are re-copied
-        # from the install directory, patched, and the test repeated.
-        broken_files = []
-
-        # For each file we care about, check it exists and has the right checksum.
         self.prepare_progress("Validating installation...", len(self.expected_patched_checksums))
         progress_counter = 0
-        for file in self.expected_patched_checksums:
-            file_path = os.path.join(file, BIN_DIR)
-            if not os.path.isfile(file_path) \
-                or not self.verify_checksum(file):
-                broken_files.append(file)
-
-            # Show a nice progress bar.
-            progress_counter += 1
-            self.progress_value.emit(progress_counter)
-            QtGui.QApplication.processEvents()
+        broken_files = []
 
-        logger.info("Broken files: %s", ", ".join(broken_files))
+        pool = ThreadPool(max(1, int(Settings.get('PATCH_PARALLEL', 'UPDATER'))))
+        try:
+            results = pool.imap_unordered(lambda file_name: (file_name, self.refresh_file(game_path, file_name)),
+                                          sorted(self.expected_patched_checksums))
+            while progress_counter < len(self.expected_patched_checksums):
+                try:
+                    file_name, error = results.next(0.05)
+                except multiprocessing.TimeoutError:
+                    QtGui.QApplication.processEvents()
+                    continue
 
-        for broken in broken_files:
-            # Copy the original from the game directory, renaming if configured to do so.
-            dest_path = os.path.join(BIN_DIR, self.needed_renames[broken] or broken)
-            shutil.copyfile(os.path.join(game_path, broken), dest_path)
+                if error is not None:
+                    broken_files.append(file_name)
+                    # Halt and catch fire.
+                    self.failed.emit(error)
 
-            # If the configuration has a patch for this file, apply it.
-            checksum = self.md5sum(dest_path)
-            if self.expected_patched_checksums[checksum]:
-                checksum = self.patch_file(broken, checksum)
+                # Show a nice progress bar.
+                progress_counter += 1
+                self.progress_value.emit(progress_counter)
+        finally:
+            pool.terminate()
 
-            if checksum != self.expected_patched_checksums[broken]:
-                # Halt and catch fire.
-                self.failed.emit("Patching failed for: %s" % broken)
+        logger.info("Broken files: %s", ", ".join(broken_files))
 
     @QtCore.pyqtSlot()
     def run(self):
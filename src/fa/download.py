@@ -0,0 +1,357 @@
+"""
+HTTP downloads in large chunks that survive interruptions.
+
+A file is downloaded into destination + ".part" and only moved to its
+destination once it's complete. An interrupted download is continued with a
+Range request the next time, as long as the server reports the same size and
+ETag or Last-Modified for the url. Large files can be downloaded in several
+ranges at once, each into its own part file.
+"""
+import collections
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import urllib2
+
+from PyQt4 import QtCore
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+
+# Smallest range worth a connection of its own
+SEGMENT_MIN_SIZE = 4 * 1024 * 1024
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 0.25
+
+TIMEOUT = 30
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class _HeadRequest(urllib2.Request):
+    def get_method(self):
+        return "HEAD"
+
+
+def _open(url, headers=None, head=False):
+    headers = dict(headers or {})
+    headers['User-Agent'] = "FAF Client"
+    request = (_HeadRequest if head else urllib2.Request)(url, headers=headers)
+    return urllib2.urlopen(request, timeout=TIMEOUT)
+
+
+def _probe(url):
+    '''
+    Returns the size of url or None, its ETag or Last-Modified, and whether
+    the server takes Range requests for it.
+    '''
+    try:
+        response = _open(url, head=True)
+    except urllib2.HTTPError, e:
+        if e.code in (405, 501):
+            return None, None, False
+        raise
+    try:
+        info = response.info()
+        length = info.getheader("Content-Length")
+        validator = info.getheader("ETag") or info.getheader("Last-Modified")
+        ranges = (info.getheader("Accept-Ranges") or "").strip().lower() == "bytes"
+        return (int(length) if length else None), validator, ranges
+    finally:
+        response.close()
+
+
+class _Progress(object):
+    '''
+    Adds up what the segments downloaded and reports it at most every
+    PROGRESS_INTERVAL seconds.
+    '''
+    def __init__(self, done, total, callback):
+        self.done = done
+        self.total = total
+        self.callback = callback
+        self._last = 0
+        self._lock = threading.Lock()
+
+    def add(self, count, force=False):
+        with self._lock:
+            self.done += count
+            now = time.time()
+            if self.callback is None or (not force and now - self._last < PROGRESS_INTERVAL):
+                return
+            self._last = now
+            done = self.done
+        self.callback(done, self.total)
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+
+def _remove(filename):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def _fetchRange(url, partname, start, end, progress, cancelled, total=None):
+    '''
+    Downloads the bytes start to end (inclusive, None for all that follow) of
+    url into the file partname, continuing after what it holds already. total
+    is the size of url if known.
+    '''
+    have = _size(partname)
+    if end is not None and start + have > end:
+        return
+    if have and total is not None and start + have >= total:
+        # Complete already, there's nothing left to ask the server for
+        return
+    headers = {}
+    if start + have > 0 or end is not None:
+        headers["Range"] = "bytes=%i-%s" % (start + have, "" if end is None else end)
+    response = _open(url, headers)
+    try:
+        mode = "ab"
+        if headers and response.getcode() != 206:
+            if start > 0:
+                raise IOError("The server ignored the range requested from " + url)
+            # It sent the whole file instead, start over
+            progress.add(-have)
+            mode = "wb"
+        with open(partname, mode) as part:
+            while True:
+                if cancelled():
+                    raise DownloadCancelled(url)
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                part.write(chunk)
+                progress.add(len(chunk))
+    finally:
+        response.close()
+
+
+def _fetchSegments(url, names, bounds, progress, cancelled):
+    '''
+    Runs _fetchRange for every segment on a thread of its own. If one fails,
+    the others are stopped and its error is raised.
+    '''
+    errors = []
+    stop = []
+
+    def stopped():
+        return bool(stop) or cancelled()
+
+    def fetch(name, (start, end)):
+        try:
+            _fetchRange(url, name, start, end, progress, stopped)
+        except Exception:
+            errors.append(sys.exc_info())
+            stop.append(True)
+
+    threads = [threading.Thread(target=fetch, args=(name, bound), name="Download segment " + name)
+               for name, bound in zip(names, bounds)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        # Prefer the error that stopped the others over their cancellations
+        errors.sort(key=lambda exc_info: issubclass(exc_info[0], DownloadCancelled))
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+
+def download(url, destination, segments=1, progress=None, cancelled=None):
+    '''
+    Downloads url to the file destination, continuing an interrupted earlier
+    download of it if possible. Files large enough are downloaded in up to
+    segments ranges at once.
+
+    progress(done, total) is called at most every PROGRESS_INTERVAL seconds,
+    total is 0 if unknown. Raises DownloadCancelled once cancelled() returns
+    true and IOError if the server sends less than it announced, leaving
+    what was downloaded for the next attempt.
+    '''
+    cancelled = cancelled or (lambda: False)
+    total, validator, ranges = _probe(url)
+    resumable = ranges and total is not None
+
+    count = 1
+    if resumable and segments > 1:
+        count = max(1, min(segments, total // SEGMENT_MIN_SIZE))
+    partname = destination + ".part"
+    statename = partname + ".json"
+    names = [partname] if count == 1 else ["%s%i" % (partname, i) for i in range(count)]
+
+    # The parts are only any good for the same version of the file, split the same way
+    state = dict(url=url, size=total, validator=validator, segments=count)
+    try:
+        with open(statename) as f:
+            previous = json.load(f)
+    except (IOError, ValueError):
+        previous = None
+    if not resumable or previous != state:
+        for name in [partname, statename] + ["%s%i" % (partname, i) for i in range(max(count, segments))]:
+            _remove(name)
+    if resumable:
+        with open(statename, "w") as f:
+            json.dump(state, f)
+
+    if count == 1:
+        bounds = [(0, None)]
+    else:
+        starts = [i * (total // count) for i in range(count)]
+        bounds = zip(starts, [start - 1 for start in starts[1:]] + [total - 1])
+
+    done = sum(_size(name) for name in names)
+    if done:
+        logger.info("Resuming download of %s at %i of %s bytes" % (url, done, total))
+    tracker = _Progress(done, total or 0, progress)
+    tracker.add(0, force=True)
+
+    if count == 1:
+        _fetchRange(url, partname, 0, None, tracker, cancelled, total)
+    else:
+        _fetchSegments(url, names, bounds, tracker, cancelled)
+        for name, (start, end) in zip(names, bounds):
+            if _size(name) != end - start + 1:
+                raise IOError("Got %i of %i bytes of %s from %s" % (_size(name), end - start + 1, name, url))
+        with open(partname, "wb") as part:
+            for name in names:
+                with open(name, "rb") as segment:
+                    shutil.copyfileobj(segment, part, CHUNK_SIZE)
+        _remove(statename)
+        for name in names:
+            _remove(name)
+
+    size = _size(partname)
+    if total is not None and size != total:
+        if size > total:
+            _remove(partname)
+            _remove(statename)
+        raise IOError("Got %i of %i bytes from %s" % (size, total, url))
+
+    if os.path.exists(destination):
+        os.remove(destination)
+    os.rename(partname, destination)
+    _remove(statename)
+    tracker.add(0, force=True)
+    return size
+
+
+class Download(QtCore.QObject):
+    '''
+    Runs download on a worker thread. The signals arrive in the thread this
+    lives in.
+    '''
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, url, destination, segments=1, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.url = url
+        self.destination = destination
+        self.segments = segments
+        self.cancelled = False
+        self.error = None
+        self.thread = None
+
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        try:
+            download(self.url, self.destination, self.segments, self.progress.emit, lambda: self.cancelled)
+        except DownloadCancelled:
+            logger.warn("Download cancelled for: " + self.url)
+            self.failed.emit("Download cancelled")
+        except Exception, e:
+            logger.error("Download failed for: " + self.url, exc_info=sys.exc_info())
+            self.error = e
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit()
+
+    @QtCore.pyqtSlot()
+    def abort(self):
+        self.cancelled = True
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="Download " + self.url)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+class DownloadQueue(QtCore.QObject):
+    '''
+    Runs Downloads with at most parallel of them at once, in the order they
+    were added. Files are known by a name of the caller's choosing.
+    '''
+    fetched = QtCore.pyqtSignal(str)
+    failed = QtCore.pyqtSignal(str, str)
+    progress = QtCore.pyqtSignal(int, int)
+
+    def __init__(self, parallel, segments=1, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.parallel = max(1, parallel)
+        self.segments = segments
+        self.queued = collections.deque()
+        self.running = {}
+        self.sizes = {}
+
+    def __len__(self):
+        return len(self.queued) + len(self.running)
+
+    def add(self, name, url, destination):
+        self.queued.append((name, url, destination))
+        self._startNext()
+
+    def _startNext(self):
+        while self.queued and len(self.running) < self.parallel:
+            name, url, destination = self.queued.popleft()
+            download = Download(url, destination, self.segments)
+            download.progress.connect(self._progress)
+            download.finished.connect(self._finished)
+            download.failed.connect(self._failed)
+            self.running[download] = name
+            download.start()
+
+    def _done(self, download):
+        self.sizes.pop(download, None)
+        name = self.running.pop(download)
+        self._startNext()
+        return name
+
+    @QtCore.pyqtSlot(int, int)
+    def _progress(self, done, total):
+        if self.sender() in self.running:
+            self.sizes[self.sender()] = (done, total)
+            self.progress.emit(sum(size[0] for size in self.sizes.values()),
+                               sum(size[1] for size in self.sizes.values()))
+
+    @QtCore.pyqtSlot()
+    def _finished(self):
+        self.fetched.emit(self._done(self.sender()))
+
+    @QtCore.pyqtSlot(str)
+    def _failed(self, error):
+        self.failed.emit(self._done(self.sender()), error)
+
+    @QtCore.pyqtSlot()
+    def abort(self):
+        self.queued.clear()
+        for download in self.running:
+            download.abort()
@@ -0,0 +1,91 @@
+"""
+Framings for the messages exchanged with the FAF relay server.
+
+Every message is a dict sent as a block: a uint32 big endian size followed by
+the encoded message. Only the encoding of the block differs between framings,
+so the same BlockReader splits the stream whatever framing is in use.
+
+The relay server historically takes the json dump of a message serialized as
+a QString (UTF-16). A client may offer a compact framing with a SetFraming
+message; a server that supports it answers with a Framing message after which
+it sends in the new framing. The client in turn sends a Framing message, its
+last one in the old framing. Servers that don't know SetFraming just ignore it
+and everything stays in the QString framing.
+"""
+
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_UINT32 = struct.Struct(">I")
+
+# QDataStream writes a null QString with this size
+_NULL_QSTRING = 0xFFFFFFFF
+
+
+class QStringFraming(object):
+    """
+    The legacy framing, the json dump written as a QString.
+    """
+    name = "qstring"
+
+    def encode(self, message):
+        data = json.dumps(message).encode("utf-16-be")
+        return _UINT32.pack(len(data) + 4) + _UINT32.pack(len(data)) + data
+
+    def decode(self, block):
+        size, = _UINT32.unpack_from(block)
+        if size == _NULL_QSTRING:
+            size = 0
+        return json.loads(block[4:4 + size].decode("utf-16-be"))
+
+
+class JsonFraming(object):
+    """
+    The json dump as UTF-8.
+    """
+    name = "json"
+
+    def encode(self, message):
+        data = json.dumps(message, separators=(",", ":"))
+        return _UINT32.pack(len(data)) + data
+
+    def decode(self, block):
+        return json.loads(block)
+
+
+class MsgpackFraming(object):
+    """
+    The message packed with msgpack, only offered if msgpack is installed.
+    Strings are all sent as msgpack strings, so both ends see the same types
+    as they would with json.
+    """
+    name = "msgpack"
+
+    def encode(self, message):
+        data = msgpack.packb(message, use_bin_type=False)
+        return _UINT32.pack(len(data)) + data
+
+    def decode(self, block):
+        return msgpack.unpackb(block, raw=False)
+
+
+LEGACY = QStringFraming()
+
+FRAMINGS = {
+    LEGACY.name: LEGACY,
+    JsonFraming.name: JsonFraming(),
+}
+if msgpack is not None:
+    FRAMINGS[MsgpackFraming.name] = MsgpackFraming()
+
+
+def get_framing(name):
+    """
+    Returns the framing called name, or the legacy framing if it isn't available.
+    """
+    return FRAMINGS.get(name, LEGACY)
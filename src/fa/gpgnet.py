@@ -0,0 +1,199 @@
+"""
+Qt-free streaming codec for the GPGNet protocol spoken by Forged Alliance on
+its local relay socket.
+
+A GPGNet frame is laid out as (all integers little endian):
+
+    uint32 header size | header | int32 chunk count | chunk*
+
+and every chunk is either
+
+    byte 0 | int32 value                      (number)
+    byte 1 | int32 size | size bytes           (string)
+
+Strings have their tabs and newlines escaped as "/t" and "/n" on the wire.
+"""
+
+import struct
+
+_UINT32 = struct.Struct("<I")
+_INT32 = struct.Struct("<i")
+_TYPED_INT32 = struct.Struct("<bi")
+
+_NUMBER_CHUNK = 0
+_STRING_CHUNK = 1
+_UDP_CHUNK = 2
+
+# FA never sends anything close to this, a bigger chunk count means we lost sync
+MAX_CHUNKS = 100
+
+
+class GPGNetError(ValueError):
+    pass
+
+
+def escape(field):
+    return field.replace("\t", "/t").replace("\n", "/n")
+
+
+def unescape(field):
+    if "/" not in field:
+        return field
+    return field.replace("/t", "\t").replace("/n", "\n")
+
+
+def _pack_string(field_type, field):
+    # The size is taken before escaping and the escaped field is cut to it,
+    # which is what the "<bi%ds" format always did.
+    size = len(field)
+    return _TYPED_INT32.pack(field_type, size) + escape(str(field))[:size]
+
+
+def _pack_header(action, chunk_count):
+    action = str(action)
+    size = len(action)
+    return _INT32.pack(size) + escape(action)[:size] + _INT32.pack(chunk_count)
+
+
+def encode(action, chunks):
+    """
+    Builds a GPGNet frame for FA.
+    """
+    parts = [_pack_header(action, len(chunks))]
+    for field in chunks:
+        if type(field) is int:
+            parts.append(_TYPED_INT32.pack(_NUMBER_CHUNK, field))
+        else:
+            parts.append(_pack_string(_STRING_CHUNK, field))
+    return "".join(parts)
+
+
+def encode_udp(action, chunks):
+    """
+    Builds a SendNatPacket frame for FA: strings after the first one are sent
+    as udp chunks, prefixed with "\x08".
+
+    This reproduces Packet.PackUdp byte for byte, including it restarting the
+    frame with a bare "\x08" at every string chunk.
+    """
+    parts = [_pack_header(action, len(chunks))]
+    for i, field in enumerate(chunks):
+        if type(field) is int:
+            parts.append(_TYPED_INT32.pack(_NUMBER_CHUNK, field))
+        elif i == 0:
+            parts = ["\x08", _pack_string(_STRING_CHUNK, field)]
+        else:
+            parts = ["\x08", _pack_string(_UDP_CHUNK, "\x08" + field)]
+    return "".join(parts)
+
+
+class FrameBuffer(object):
+    """
+    A growable receive buffer with a read cursor.
+
+    Bytes are appended with feed(); consumers parse complete frames out of
+    self._buffer starting at self._offset and advance the cursor. Consumed
+    bytes are only dropped once they make up the larger part of the buffer,
+    so a burst of small frames costs one compaction instead of one per frame.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def __len__(self):
+        return len(self._buffer) - self._offset
+
+    def feed(self, data):
+        if self._offset and self._offset * 2 >= len(self._buffer):
+            del self._buffer[:self._offset]
+            self._offset = 0
+        self._buffer += data
+
+    def clear(self):
+        self._buffer = bytearray()
+        self._offset = 0
+
+
+class BlockReader(FrameBuffer):
+    """
+    Splits a stream into blocks prefixed with a uint32 size, as written by
+    QDataStream in the FAF server protocols (big endian by default).
+    """
+    def __init__(self, byte_order=">"):
+        FrameBuffer.__init__(self)
+        self._size = struct.Struct(byte_order + "I")
+
+    def blocks(self):
+        buf = self._buffer
+        end = len(buf)
+        while end - self._offset >= 4:
+            size, = self._size.unpack_from(buf, self._offset)
+            start = self._offset + 4
+            if end - start < size:
+                return
+            self._offset = start + size
+            yield bytes(buf[start:self._offset])
+
+
+class GPGNetDecoder(FrameBuffer):
+    """
+    Incremental GPGNet frame decoder.
+
+    Feed it whatever arrived on the socket and iterate frames() to get the
+    complete (action, chunks) tuples; partial frames stay buffered until the
+    rest of their bytes are fed.
+
+    Raises GPGNetError if the stream is out of sync, after which the decoder
+    should be clear()ed.
+    """
+    def frames(self):
+        while True:
+            frame = self._decode_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def decode(self, data):
+        self.feed(data)
+        return list(self.frames())
+
+    def _decode_frame(self):
+        buf = self._buffer
+        end = len(buf)
+        pos = self._offset
+
+        if end - pos < 4:
+            return None
+        header_size, = _UINT32.unpack_from(buf, pos)
+        pos += 4
+        if end - pos < header_size + 4:
+            return None
+        view = memoryview(buf)
+        try:
+            action = view[pos:pos + header_size].tobytes()
+            pos += header_size
+            chunk_count, = _INT32.unpack_from(buf, pos)
+            pos += 4
+            if chunk_count > MAX_CHUNKS:
+                raise GPGNetError("Frame %r claims %i chunks" % (action, chunk_count))
+
+            chunks = []
+            for _ in range(chunk_count):
+                if end - pos < 5:
+                    return None
+                field_type, value = _TYPED_INT32.unpack_from(buf, pos)
+                pos += 5
+                if field_type:
+                    if value < 0:
+                        raise GPGNetError("Negative field size in frame %r" % action)
+                    if end - pos < value:
+                        return None
+                    chunks.append(unescape(view[pos:pos + value].tobytes()))
+                    pos += value
+                else:
+                    chunks.append(value)
+        finally:
+            del view
+
+        self._offset = pos
+        return action, chunks
@@ -6,16 +6,21 @@ import fa
 
 logger= logging.getLogger(__name__)
 
-from PyQt4 import QtCore, QtGui, QtNetwork
-import cStringIO
+from PyQt4 import QtCore, QtGui
+from config import Settings
 import util
 import os, stat
 import struct
+import math
 import shutil
 import urllib2
 import zipfile
 import tempfile
+import threading
 import re
+import functools
+import heapq
+import itertools
 
 VAULT_PREVIEW_ROOT = "http://content.faforever.com/faf/vault/map_previews/small/" 
 VAULT_DOWNLOAD_ROOT = "http://content.faforever.com/faf/vault/"
@@ -78,8 +83,6 @@ maps = { # A Lookup table for info (names, sizes, players) of the official Forge
                  "x1mp_017" : ["Eye Of The Storm", "512x512", 4],
                  }
 
-__exist_maps = None
-
 
 
 def isBase(mapname):
@@ -89,10 +92,7 @@ def isBase(mapname):
     return mapname in maps
 
 def getUserMaps():
-    maps = []
-    if os.path.isdir(getUserMapsFolder()) :
-            maps = os.listdir(getUserMapsFolder())
-    return maps
+    return catalogue.userMaps()
 
 def getDisplayName(filename):
     '''
@@ -158,47 +158,20 @@ def isMapFolderValid(folder):
 
 
 def existMaps(force = False):
-    global __exist_maps
-    if force or __exist_maps == None:
-        
-        __exist_maps = getUserMaps()
-
-        if os.path.isdir(getBaseMapsFolder()) :
-            if __exist_maps == None :
-                __exist_maps = os.listdir(getBaseMapsFolder())
-            else : 
-                __exist_maps.extend(os.listdir(getBaseMapsFolder()))
-    return __exist_maps        
-    
+    return catalogue.allMaps(force)
 
 
 def isMapAvailable(mapname):
     '''
     Returns true if the map with the given name is available on the client
     '''
-    if isBase(mapname):
-        return True
-    
-    if os.path.isdir(getUserMapsFolder()):
-        for infile in os.listdir(getUserMapsFolder()) :
-            if infile.lower() == mapname.lower(): 
-                return True
-
-    return False    
+    return catalogue.isAvailable(mapname)
 
 def folderForMap(mapname):
     '''
     Returns the folder where the application could find the map
     '''
-    if isBase(mapname):
-        return os.path.join(getBaseMapsFolder(), mapname)
-    
-    if os.path.isdir(getUserMapsFolder()):
-        for infile in os.listdir(getUserMapsFolder()) :
-            if infile.lower() == mapname.lower(): 
-                return os.path.join(getUserMapsFolder(), mapname)
-
-    return None
+    return catalogue.folderFor(mapname)
 
 def getBaseMapsFolder():
     '''
@@ -218,26 +191,95 @@ def getUserMapsFolder():
     return os.path.join(util.PERSONAL_DIR, "My Games", "Gas Powered Games", "Supreme Commander Forged Alliance", "Maps") 
 
 
+class MapCatalogue(object):
+    '''
+    An index of the map folders on disk, by lowercase name.
+
+    The index is rebuilt when the modification time of one of the maps folders
+    changes, which it does whenever a map folder is added, removed or renamed.
+    Lookups in between cost a stat() per folder instead of a listdir().
+    '''
+    def __init__(self, userFolder, baseFolder):
+        self._userFolder = userFolder
+        self._baseFolder = baseFolder
+        self._stamps = None
+        self._userIndex = {}
+        self._userMaps = []
+        self._allMaps = []
+
+    @staticmethod
+    def _stamp(folder):
+        try:
+            return folder, os.stat(folder).st_mtime
+        except OSError:
+            return folder, None
+
+    def invalidate(self):
+        self._stamps = None
+
+    def refresh(self, force=False):
+        stamps = [self._stamp(self._userFolder()), self._stamp(self._baseFolder())]
+        if not force and stamps == self._stamps:
+            return
+        listings = []
+        for folder, mtime in stamps:
+            listings.append(os.listdir(folder) if mtime is not None and os.path.isdir(folder) else [])
+
+        userFolder = stamps[0][0]
+        self._userIndex = dict((name.lower(), os.path.join(userFolder, name)) for name in listings[0])
+        self._userMaps = listings[0]
+        self._allMaps = listings[0] + listings[1]
+        self._stamps = stamps
+
+    def userMaps(self):
+        self.refresh()
+        return list(self._userMaps)
+
+    def allMaps(self, force=False):
+        self.refresh(force)
+        return list(self._allMaps)
+
+    def isAvailable(self, mapname):
+        if isBase(mapname):
+            return True
+        self.refresh()
+        return mapname.lower() in self._userIndex
+
+    def folderFor(self, mapname):
+        if isBase(mapname):
+            return os.path.join(self._baseFolder(), mapname)
+        self.refresh()
+        return self._userIndex.get(mapname.lower())
+
+
+catalogue = MapCatalogue(getUserMapsFolder, getBaseMapsFolder)
+
+
+DDS_HEADER_SIZE = 128
+DDS_DIMENSIONS = struct.Struct("<II")  # height, width at offset 12 of the header
+
+
 def genPrevFromDDS(sourcename, destname,small=False):
     '''
     this opens supcom's dds file (format: bgra8888) and saves to png
     '''
     try:
-        img = bytearray()
-        buf = bytearray(16)
-        file = open(sourcename,"rb")
-        file.seek(128) # skip header
-        while file.readinto(buf):
-            img += buf[:3] + buf[4:7] + buf[8:11] + buf[12:15]
-        file.close()
-
-        size = int((len(img)/3) ** (1.0/2))
+        with open(sourcename, "rb") as ddsfile:
+            header = ddsfile.read(DDS_HEADER_SIZE)
+            img = ddsfile.read()
+
+        height, width = DDS_DIMENSIONS.unpack_from(header, 12)
+        if width * height * 4 > len(img):
+            # Broken header, previews are square
+            width = height = int(math.sqrt(len(img) // 4))
+
+        # On little endian, Format_RGB32 is laid out as BGRA in memory with the alpha ignored,
+        # so QImage can use the pixel data as it is.
+        imageFile = QtGui.QImage(img, width, height, QtGui.QImage.Format_RGB32)
         if small:
-            imageFile = QtGui.QImage(img,size,size,QtGui.QImage.Format_RGB888).rgbSwapped().scaled(100,100,transformMode = QtCore.Qt.SmoothTransformation)
-        else:
-            imageFile = QtGui.QImage(img,size,size,QtGui.QImage.Format_RGB888).rgbSwapped()
+            imageFile = imageFile.scaled(100,100,transformMode = QtCore.Qt.SmoothTransformation)
         imageFile.save(destname)
-    except IOError:
+    except (IOError, struct.error):
         pass # cant open the
 
 def __exportPreviewFromMap(mapname, positions=None):
@@ -294,6 +336,7 @@ def __exportPreviewFromMap(mapname, positions=None):
         shutil.copyfile(previewsmallname, cachepngname)
         #checking if file was copied correctly, just in case
         if os.path.isfile(cachepngname):
+            util.previewCache.added(mapname + ".png")
             previews["cache"] = cachepngname
         else:
             logger.debug("Couldn't copy preview into cache folder")
@@ -356,6 +399,7 @@ def __exportPreviewFromMap(mapname, positions=None):
         shutil.copyfile(previewsmallname, cachepngname)
         #checking if file was copied correctly, just in case
         if os.path.isfile(cachepngname):
+            util.previewCache.added(mapname + ".png")
             previews["cache"] = cachepngname
         else:
             logger.debug("Failed to write in cache folder")
@@ -416,59 +460,280 @@ def __downloadPreviewFromWeb(name):
     logger.debug("Searching web preview for: " + name)
         
     for extension in iconExtensions:
+        img = os.path.join(util.CACHE_DIR, name + "." + extension)
+        fd = temp = None
         try:
+            # Written next to the cache and moved into place once complete, so a half written preview is never used
+            fd, temp = tempfile.mkstemp(dir=util.CACHE_DIR, prefix=name + ".", suffix=".tmp")
             header = urllib2.Request(VAULT_PREVIEW_ROOT + urllib2.quote(name) + "." + extension, headers={'User-Agent' : "FAF Client"})   
             req = urllib2.urlopen(header)
-            img = os.path.join(util.CACHE_DIR, name + "." + extension)
-            with open(img, 'wb') as fp:
-                shutil.copyfileobj(req, fp)
-                fp.flush()
-                os.fsync(fp.fileno())       #probably works fine without the flush and fsync
-                fp.close()
-                
-                #Create alpha-mapped preview image
-                im = QtGui.QImage(img) #.scaled(100,100)
-                im.save(img)
-                logger.debug("Web Preview " + extension + " used for: " + name)
-                return img
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fd = None
+                    shutil.copyfileobj(req, fp)
+            finally:
+                req.close()
+
+            #Create alpha-mapped preview image
+            im = QtGui.QImage(temp) #.scaled(100,100)
+            if im.isNull() or not im.save(temp, extension.upper()):
+                raise IOError("Not a valid preview image")
+            util.replaceFile(temp, img)
+            util.previewCache.added(name + "." + extension)
+            logger.debug("Web Preview " + extension + " used for: " + name)
+            return img
         except:
             logger.debug("Web preview download failed for " + name)
+        finally:
+            if fd is not None:
+                os.close(fd)
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
         
     logger.debug("Web Preview not found for: " + name)
     return None
      
+def cachedPreviewFile(mapname):
+    '''
+    Returns the path of the cached preview image for mapname, if there is one
+    '''
+    for extension in iconExtensions:
+        img = util.previewCache.file(mapname + "." + extension)
+        if img:
+            return img
+    return None
+
+
+def previewFile(mapname, force=False):
+    '''
+    Returns the path of a preview image for mapname, extracting or downloading it if needed.
+    This doesn't touch any widgets or pixmaps, so it can run outside the GUI thread.
+    '''
+    # Try to load directly from cache
+    img = cachedPreviewFile(mapname)
+    if img:
+        logger.debug("Using cached preview image for: " + mapname)
+        return img
+
+    if force :
+        # Try to download from web
+        img = __downloadPreviewFromWeb(mapname)
+        if img and os.path.isfile(img):
+            logger.debug("Using web preview image for: " + mapname)
+            return img
+
+    # Try to find in local map folder
+    previews = __exportPreviewFromMap(mapname)
+    if previews:
+        img = previews["cache"]
+        if img and os.path.isfile(img):
+            logger.debug("Using fresh preview image for: " + mapname)
+            return img
+
+    return None
+
+
 def preview(mapname, pixmap = False, force=False):
     try:
-        # Try to load directly from cache
-        for extension in iconExtensions:
-            img = os.path.join(util.CACHE_DIR, mapname + "." + extension)
-            if os.path.isfile(img):
-                logger.debug("Using cached preview image for: " + mapname)
-                return util.icon(img, False, pixmap)
-        if force :
-        # Try to download from web
-            img = __downloadPreviewFromWeb(mapname)
-            if img and os.path.isfile(img):
-                logger.debug("Using web preview image for: " + mapname)
-                return util.icon(img, False, pixmap)
-    
-        # Try to find in local map folder    
-        img = __exportPreviewFromMap(mapname)
-       
-        if img :
-            img = __exportPreviewFromMap(mapname)["cache"]
-            if img and os.path.isfile(img):
-                logger.debug("Using fresh preview image for: " + mapname)
-                return util.icon(img, False, pixmap)
-        
+        img = previewFile(mapname, force)
+        if img:
+            return util.cachedIcon(img, pixmap)
         return None
     except:
         logger.error("Error raised in maps.preview(...) for " + mapname)
         logger.error("Map Preview Exception", exc_info=sys.exc_info())
 
 
+class PreviewJob(QtCore.QRunnable):
+    def __init__(self, service, mapname, force):
+        QtCore.QRunnable.__init__(self)
+        self.service = service
+        self.mapname = mapname
+        self.force = force
+
+    def run(self):
+        try:
+            img = previewFile(self.mapname, self.force)
+        except:
+            logger.error("Map Preview Exception", exc_info=sys.exc_info())
+            img = None
+        self.service.jobFinished.emit(self.mapname, img or "")
+
+
+class PreviewService(QtCore.QObject):
+    '''
+    Hands out map previews without blocking the GUI thread.
+
+    Previews that aren't in the cache yet are extracted from the local map or
+    downloaded from the vault by a small thread pool. Concurrent requests for
+    the same map share one job, and all their callbacks are called in the GUI
+    thread once it's done.
+    '''
+    previewReady = QtCore.pyqtSignal(str)
+    jobFinished = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, threads=2, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(threads)
+        self.waiting = {}
+        self.forced = set()
+        self.jobFinished.connect(self._jobFinished)
+
+    def request(self, mapname, callback=None, force=False, pixmap=False):
+        '''
+        Returns the preview of mapname right away if it's cached. Otherwise
+        returns the unknown map placeholder and calls callback with the preview
+        (or None if there is none) once it's ready.
+        '''
+        img = cachedPreviewFile(mapname)
+        if img:
+            return util.cachedIcon(img, pixmap)
+
+        key = mapname.lower()
+        if key in self.waiting:
+            if force:
+                self.forced.add(key)
+        else:
+            self.waiting[key] = []
+            self.pool.start(PreviewJob(self, mapname, force))
+        if callback:
+            self.waiting[key].append((callback, pixmap))
+
+        return util.icon("games/unknown_map.png", True, pixmap)
+
+    @QtCore.pyqtSlot(str, str)
+    def _jobFinished(self, mapname, img):
+        key = mapname.lower()
+        if not img and key in self.forced:
+            # Someone asked to look on the web too while the job was running
+            self.forced.discard(key)
+            self.pool.start(PreviewJob(self, mapname, True))
+            return
+
+        self.forced.discard(key)
+        callbacks = self.waiting.pop(key, [])
+        for callback, pixmap in callbacks:
+            try:
+                callback(util.cachedIcon(img, pixmap) if img else None)
+            except RuntimeError:
+                pass # The item asking for it is gone
+        self.previewReady.emit(mapname)
+
+
+_previewService = None
+
+
+def previewService():
+    global _previewService
+    if _previewService is None:
+        _previewService = PreviewService()
+    return _previewService
+
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+def fetchFile(url, destfile, progress=None, cancelled=None):
+    '''
+    Streams url into the open file destfile, calling progress(done, total) after every chunk.
+    Raises DownloadCancelled once cancelled() returns true, and IOError if the download is cut short.
+    '''
+    req = urllib2.Request(url, headers={'User-Agent' : "FAF Client"})
+    response = urllib2.urlopen(req)
+    try:
+        length = response.info().getheader("Content-Length")
+        total = int(length) if length else 0
+        done = 0
+        if progress:
+            progress(done, total)
+        while True:
+            if cancelled and cancelled():
+                raise DownloadCancelled(url)
+            chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            destfile.write(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+    finally:
+        response.close()
+
+    if length and done != total:
+        raise IOError("Got %i of %i bytes from %s" % (done, total, url))
+    return done
+
+
+def installMap(zipname, cancelled=None):
+    '''
+    Extracts the map archive zipname into the user maps folder, one member at a time.
+    Anything in the sounds folder of a map goes to util.SOUND_DIR right away.
+    If the extraction fails, the map folders it created are removed again.
+    '''
+    mapsFolder = getUserMapsFolder()
+    created = set()
+    try:
+        with zipfile.ZipFile(zipname) as zfile:
+            for member in zfile.infolist():
+                if cancelled and cancelled():
+                    raise DownloadCancelled(zipname)
+
+                parts = [part for part in member.filename.replace("\\", "/").split("/") if part not in ("", ".")]
+                if not parts or ".." in parts or os.path.isabs(member.filename):
+                    logger.warn("Skipping suspicious member of map archive: " + member.filename)
+                    continue
+
+                if len(parts) > 1 and parts[1] == "sounds":
+                    dest = os.path.join(util.SOUND_DIR, *parts[2:])
+                else:
+                    dest = os.path.join(mapsFolder, *parts)
+                    if not os.path.exists(os.path.join(mapsFolder, parts[0])):
+                        created.add(os.path.join(mapsFolder, parts[0]))
+
+                if member.filename.endswith("/"):
+                    if not os.path.isdir(dest):
+                        os.makedirs(dest)
+                    continue
+
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                with zfile.open(member) as source, open(dest, "wb") as target:
+                    shutil.copyfileobj(source, target, DOWNLOAD_CHUNK_SIZE)
+    except:
+        for folder in created:
+            shutil.rmtree(folder, ignore_errors=True)
+        raise
+    finally:
+        catalogue.invalidate()
+
+
+def countDownload(name):
+    '''
+    Counts the map download on the vault.
+    '''
+    url = VAULT_COUNTER_ROOT + "?map=" + urllib2.quote(name2link(name))
+    try:
+        req = urllib2.Request(url, headers={'User-Agent' : "FAF Client"})
+        urllib2.urlopen(req).close()
+        logger.debug("Successfully sent download counter request for: " + url)
+    except:
+        logger.warn("Request to map download counter failed for: " + url)
+        logger.error("Download Count Exception", exc_info=sys.exc_info())
+
 
 class Downloader(QtCore.QObject):
+    '''
+    Downloads and installs a map on a worker thread.
+
+    The archive is streamed to a temporary file in large chunks and extracted
+    from there, so the map is never held in memory. Progress and the outcome
+    are reported through the signals, which arrive in the thread this lives in.
+    '''
     progress_reset = QtCore.pyqtSignal()
     progress_value = QtCore.pyqtSignal(int)
     progress_maximum = QtCore.pyqtSignal(int)
@@ -476,51 +741,241 @@ class Downloader(QtCore.QObject):
     failed = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal()
 
-    def __init__(self, map_name, download_root=VAULT_DOWNLOAD_ROOT, parent=None):
+    def __init__(self, map_name, download_root=VAULT_DOWNLOAD_ROOT, parent=None, count=True):
         QtCore.QObject.__init__(self, parent)
         self.map_name = map_name
-        self.url = QtCore.QUrl(download_root + name2link(map_name))
-        self.data = QtCore.QByteArray()
-        self.reply = None
+        self.url = download_root + name2link(map_name)
+        self.count = count
+        self.cancelled = False
+        self.error = None
+        self.thread = None
+        self.maximum = None
+        # An aborted download of the same map that has to be out of the way first
+        self.previous = None
+
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
 
-    @QtCore.pyqtSlot(int, int)
     def _propagate_progress(self, value, maximum):
+        if maximum != self.maximum:
+            self.maximum = maximum
+            self.progress_maximum.emit(maximum)
         self.progress_value.emit(value)
-        self.progress_maximum.emit(maximum)
-
-    @QtCore.pyqtSlot()
-    def _read_data(self):
-        self.data.append(self.reply.readAll())
 
-    @QtCore.pyqtSlot()
-    def _save_data(self):
+    def download(self):
+        '''
+        Downloads and installs the map in the calling thread.
+        '''
+        logger.debug("Getting map from: " + self.url)
+        fd, zipname = tempfile.mkstemp(suffix=".zip")
+        try:
+            with os.fdopen(fd, "wb") as archive:
+                fetchFile(self.url, archive, self._propagate_progress, lambda: self.cancelled)
+            installMap(zipname, lambda: self.cancelled)
+        finally:
+            os.remove(zipname)
+        logger.debug("Successfully downloaded and extracted map from: " + self.url)
+        if self.count:
+            countDownload(self.map_name)
 
-        self.finished.emit()
+    def _run(self):
+        if self.previous is not None and self.previous.thread is not None:
+            self.previous.thread.join()
+        self.previous = None
+        try:
+            self.download()
+        except DownloadCancelled:
+            logger.warn("Map download cancelled for: " + self.url)
+            self.failed.emit("Download of " + self.map_name + " cancelled")
+        except Exception, e:
+            logger.warn("Map download or extraction failed for: " + self.url)
+            if not isinstance(e, HTTPError):
+                logger.error("Download Exception", exc_info=sys.exc_info())
+            self.error = e
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit()
 
     @QtCore.pyqtSlot()
     def abort(self):
-        self.reply.close()
-        self.failed.emit()
+        self.cancelled = True
 
     @QtCore.pyqtSlot()
     def run(self):
         self.progress_reset.emit()
         self.progress_log.emit("Downloading map " + self.map_name)
-        self.reply = util.network.get(QtNetwork.QNetworkRequest(self.url))
-        self.reply.readyRead.connect(self._read_data)
-        self.reply.finished.connect(self._save_data)
-        self.reply.downloadProgress.connect(self._propagate_progress)
+        self.thread = threading.Thread(target=self._run, name="Downloader " + self.map_name)
+        self.thread.daemon = True
+        self.thread.start()
+
+PRIORITY_NORMAL = 0
+PRIORITY_FRIEND = 1
+PRIORITY_FOCUSED = 2
+
+# Owner of the request for the game the user hovers or selects
+FOCUS = "focus"
+
 
+class MapPrefetcher(QtCore.QObject):
+    '''
+    Downloads the maps of open games in the background, a few at a time.
+
+    Every request has an owner, usually the uid of the game that needs the map.
+    Requests for the same map are merged and the map is queued with the highest
+    priority among its owners. Once no owner wants a map anymore it's dropped
+    from the queue, or its download is aborted.
+
+    Maps that failed to download aren't tried again, except by download().
+    '''
+    mapReady = QtCore.pyqtSignal(str)
+    mapFailed = QtCore.pyqtSignal(str)
+
+    def __init__(self, parallel=2, download_root=VAULT_DOWNLOAD_ROOT, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.parallel = parallel
+        self.download_root = download_root
+        self.queue = []
+        self.wanted = {}
+        self.names = {}
+        self.running = {}
+        self.urgent = set()
+        self.failedMaps = set()
+        self.focused = None
+        self._order = itertools.count()
+
+    def priority(self, key):
+        return max(self.wanted[key].values())
+
+    def _enqueue(self, key):
+        heapq.heappush(self.queue, (-self.priority(key), next(self._order), key))
+
+    def request(self, mapname, owner, priority=PRIORITY_NORMAL):
+        '''
+        Queues mapname for download on behalf of owner, unless it's there already.
+        '''
+        key = mapname.lower()
+        if self.parallel < 1 or key in self.failedMaps or isMapAvailable(mapname):
+            return False
+
+        owners = self.wanted.setdefault(key, {})
+        if owners.get(owner) == priority:
+            return True
+        before = self.priority(key) if owners else None
+        owners[owner] = priority
+        self.names[key] = mapname
+        if self.priority(key) != before and key not in self.running:
+            self._enqueue(key)
+        self._start()
+        return True
+
+    def focus(self, mapname):
+        '''
+        Moves the map of the game the user is looking at to the front of the queue.
+        '''
+        if self.focused is not None:
+            self.cancel(self.focused, FOCUS)
+        self.focused = mapname
+        if mapname is not None:
+            self.request(mapname, FOCUS, PRIORITY_FOCUSED)
+
+    def cancel(self, mapname, owner=None):
+        '''
+        Withdraws the request of owner for mapname, or all requests for it if owner is None.
+        '''
+        key = mapname.lower()
+        owners = self.wanted.get(key)
+        if owners is None:
+            return
+        if owner is None:
+            owners.clear()
+        else:
+            owners.pop(owner, None)
+
+        if owners:
+            if key not in self.running:
+                self._enqueue(key)
+        else:
+            del self.wanted[key]
+            if key in self.running and key not in self.urgent:
+                logger.debug("Nobody needs " + mapname + " anymore, aborting its download")
+                self.running[key].abort()
+
+    def download(self, mapname, count=True):
+        '''
+        Returns the Downloader for mapname, starting it right away if it isn't running yet.
+        A prefetch that's already running is taken over, unless it was aborted.
+        '''
+        key = mapname.lower()
+        self.urgent.add(key)
+        self.failedMaps.discard(key)
+        downloader = self.running.get(key)
+        if downloader is None or downloader.cancelled:
+            self.names[key] = mapname
+            self._run(key, count, previous=downloader)
+        elif count:
+            downloader.count = True
+        return self.running[key]
+
+    def _run(self, key, count=False, previous=None):
+        downloader = Downloader(self.names[key], self.download_root, parent=self, count=count)
+        downloader.previous = previous
+        downloader.finished.connect(functools.partial(self._finished, key, downloader))
+        downloader.failed.connect(functools.partial(self._failed, key, downloader))
+        self.running[key] = downloader
+        downloader.run()
+
+    def _start(self):
+        while len(self.running) < self.parallel and self.queue:
+            priority, _, key = heapq.heappop(self.queue)
+            if key in self.running or key not in self.wanted or -priority != self.priority(key):
+                continue # Stale entry
+            if isMapAvailable(self.names[key]):
+                del self.wanted[key]
+                continue
+            logger.debug("Prefetching map " + self.names[key])
+            self._run(key)
+
+    def _finished(self, key, downloader):
+        if self.running.get(key) is not downloader:
+            return # An aborted download that was replaced
+        del self.running[key]
+        self.urgent.discard(key)
+        self.wanted.pop(key, None)
+        self._start()
+        self.mapReady.emit(self.names[key])
+
+    def _failed(self, key, downloader, message):
+        if self.running.get(key) is not downloader:
+            return # An aborted download that was replaced
+        del self.running[key]
+        self.urgent.discard(key)
+        if downloader.error is not None:
+            self.failedMaps.add(key)
+            self.wanted.pop(key, None)
+        elif key in self.wanted:
+            # Aborted, but requested again in the meantime
+            self._enqueue(key)
+        self._start()
+        self.mapFailed.emit(self.names[key])
+
+
+_prefetcher = None
+
+
+def prefetcher():
+    global _prefetcher
+    if _prefetcher is None:
+        _prefetcher = MapPrefetcher(int(Settings.get('PARALLEL', 'MAP_PREFETCH')))
+    return _prefetcher
 
 
 def downloadMap(name, silent=False):
     ''' 
-    Download a map from the vault with the given name
-    LATER: This type of method is so common, it could be put into a nice util method.
+    Download a map from the vault with the given name, showing the progress in a dialog.
+    The download runs on a worker thread, an event loop keeps the GUI responsive until it's done.
+    If the map is being prefetched already, that download is shown instead of starting another.
     '''
-    link = name2link(name)
-    url = VAULT_DOWNLOAD_ROOT + link
-    logger.debug("Getting map from: " + url)
+    downloader = prefetcher().download(name)
 
     progress = QtGui.QProgressDialog()
     if not silent:
@@ -531,81 +986,45 @@ def downloadMap(name, silent=False):
     progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
     progress.setAutoClose(False)
     progress.setAutoReset(False)
-       
-    
+    progress.setMinimum(0)
+    progress.setMaximum(downloader.maximum or 0)
+    progress.setModal(1)
+    progress.setWindowTitle("Downloading Map")
+    progress.setLabelText(name)
+
+    downloader.progress_maximum.connect(progress.setMaximum)
+    downloader.progress_value.connect(progress.setValue)
+    progress.canceled.connect(downloader.abort)
+
+    progress.show()
+    # The loop wakes up once the download is over, and every second in case that happened before it ran
+    loop = QtCore.QEventLoop()
+    timer = QtCore.QTimer()
+    timer.timeout.connect(loop.quit)
+    downloader.finished.connect(loop.quit)
+    downloader.failed.connect(loop.quit)
+    timer.start(1000)
     try:
-        req = urllib2.Request(url, headers={'User-Agent' : "FAF Client"})         
-        zipwebfile  = urllib2.urlopen(req)
-        meta = zipwebfile.info()
-        file_size = int(meta.getheaders("Content-Length")[0])
+        while downloader.isRunning():
+            loop.exec_()
+    finally:
+        timer.stop()
+        downloader.finished.disconnect(loop.quit)
+        downloader.failed.disconnect(loop.quit)
+    QtGui.QApplication.processEvents()
+    progress.close()
 
-        
-        progress.setMinimum(0)
-        progress.setMaximum(file_size)
-        progress.setModal(1)
-        progress.setWindowTitle("Downloading Map")
-        progress.setLabelText(name)
-        progress.show()
-    
-        #Download the file as a series of 8 KiB chunks, then uncompress it.
-        output = cStringIO.StringIO()
-        file_size_dl = 0
-        block_sz = 8192       
-
-        while progress.isVisible():
-            read_buffer = zipwebfile.read(block_sz)
-            if not read_buffer:
-                break
-            file_size_dl += len(read_buffer)
-            output.write(read_buffer)
-            progress.setValue(file_size_dl)
-    
-        progress.close()
-        if file_size_dl == file_size:
-            zfile = zipfile.ZipFile(output)
-            zfile.extractall(getUserMapsFolder())
-            zfile.close()
-
-            #check for eventual sound files
-            if folderForMap(name):
-                if "sounds" in os.listdir(folderForMap(name)) :
-                    root_src_dir = os.path.join(folderForMap(name), "sounds")
-                    for src_dir, _, files in os.walk(root_src_dir):
-                        dst_dir = src_dir.replace(root_src_dir, util.SOUND_DIR)
-                        for file_ in files:
-                            src_file = os.path.join(src_dir, file_)
-                            dst_file = os.path.join(dst_dir, file_)
-                            if os.path.exists(dst_file):
-                                os.remove(dst_file)
-                            shutil.move(src_file, dst_dir)
-
-                
-            logger.debug("Successfully downloaded and extracted map from: " + url)
-        else:
-            logger.warn("Map download cancelled for: " + url)
-            return False
+    if downloader.cancelled:
+        return False
 
-    except:
-        logger.warn("Map download or extraction failed for: " + url)
-        if sys.exc_type is HTTPError:
+    if downloader.error is not None:
+        if isinstance(downloader.error, HTTPError):
             logger.warning("Vault download failed with HTTPError, map probably not in vault (or broken).")
             QtGui.QMessageBox.information(None, "Map not downloadable", "<b>This map was not found in the vault (or is broken).</b><br/>You need to get it from somewhere else in order to use it." )
         else:
-            logger.error("Download Exception", exc_info=sys.exc_info())
             QtGui.QMessageBox.information(None, "Map installation failed", "<b>This map could not be installed (please report this map or bug).</b>" )
         return False
 
-    #Count the map downloads
-    try:
-        url = VAULT_COUNTER_ROOT + "?map=" + urllib2.quote(link)
-        req = urllib2.Request(url, headers={'User-Agent' : "FAF Client"})
-        urllib2.urlopen(req)
-        logger.debug("Successfully sent download counter request for: " + url)        
-        
-    except:
-        logger.warn("Request to map download counter failed for: " + url)
-        logger.error("Download Count Exception", exc_info=sys.exc_info())
-
     return True
 
 def processMapFolderForUpload(mapDir, positions):
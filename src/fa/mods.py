@@ -18,10 +18,9 @@ def checkMods(mods):  #mods is a dictionary of uid-name pairs
     """
     logger.info("Updating FA for mods %s" % ", ".join(mods))
     to_download = []
-    inst = modvault.getInstalledMods()
-    uids = [mod.uid for mod in inst]
+    modvault.modIndex.refresh()
     for uid in mods:
-        if uid not in uids:
+        if not modvault.modIndex.is_installed(uid):
             to_download.append(uid)
 
     for uid in to_download:
@@ -39,16 +38,14 @@ def checkMods(mods):  #mods is a dictionary of uid-name pairs
             return False
 
     actual_mods = []
-    inst = modvault.getInstalledMods()
-    uids = {}
-    for mod in inst:
-        uids[mod.uid] = mod
+    modvault.modIndex.refresh()
     for uid in mods:
-        if uid not in uids:
+        mod = modvault.modIndex.get(uid)
+        if mod is None:
             QtGui.QMessageBox.warning(None, "Mod not Found",
                                       "%s was apparently not installed correctly. Please check this." % mods[uid])
             return
-        actual_mods.append(uids[uid])
+        actual_mods.append(mod)
     if not modvault.setActiveMods(actual_mods):
         logger.warn("Couldn't set the active mods in the game.prefs file")
         return False
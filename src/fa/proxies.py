@@ -8,9 +8,12 @@ import functools
 import logging
 
 from config import Settings
+from util.trafficlog import TrafficLog
+from fa.gpgnet import BlockReader
 
 FAF_PROXY_HOST = Settings.get('HOST', 'PROXY')
 FAF_PROXY_PORT = Settings.get('PORT', 'PROXY')
+TRAFFIC_SAMPLE = Settings.get('TRAFFIC_SAMPLE', 'LOG')
 
 UNIT16 = 8
 
@@ -31,10 +34,10 @@ class proxies(QtCore.QObject):
             port = port + 1
             self.proxies[i] = QtNetwork.QUdpSocket(self)
             if not self.proxies[i].bind(QtNetwork.QHostAddress.LocalHost, port) :
-                self.__logger.warn("Can't bind socket %i" % i)
+                self.__logger.warn("Can't bind socket %i", i)
                 errored = True
             else :
-                self.__logger.info("binding socket %i on port %i" % (i, self.proxies[i].localPort()))
+                self.__logger.info("binding socket %i on port %i", i, self.proxies[i].localPort())
                 self.proxies[i].readyRead.connect(functools.partial(self.processPendingDatagrams, i))
                 self.proxiesDestination[i] = None
         if errored:
@@ -45,7 +48,8 @@ class proxies(QtCore.QObject):
         self.proxySocket.readyRead.connect(self.readData)
         self.proxySocket.disconnected.connect(self.disconnectedFromProxy)
         
-        self.blockSize = 0
+        self.blockReader = BlockReader()
+        self.trafficLog = TrafficLog(self.__logger, logging.DEBUG, TRAFFIC_SAMPLE)
         self.uid = None
         self.canClose = False
         self.testedPortsAmount = {}
@@ -80,7 +84,7 @@ class proxies(QtCore.QObject):
     def connectToProxy(self):
         self.proxySocket.connectToHost(FAF_PROXY_HOST, FAF_PROXY_PORT)
         if self.proxySocket.waitForConnected(10000):
-            self.__logger.info("Connected to proxy server " + self.proxySocket.peerName() + ":" + str(self.proxySocket.peerPort()))
+            self.__logger.info("Connected to proxy server %s:%i", self.proxySocket.peerName(), self.proxySocket.peerPort())
         
         self.canClose = False
         self.testedPorts = []
@@ -89,7 +93,7 @@ class proxies(QtCore.QObject):
             
     def bindSocket(self, port, uid):
         self.proxiesDestination[port] = uid
-        self.__logger.debug("Binding socket "+ str(port) +" (local port : "+ str(self.proxies[port].localPort()) +") for uid "+ str(uid))
+        self.__logger.debug("Binding socket %s (local port : %i) for uid %s", port, self.proxies[port].localPort(), uid)
         if not self.proxySocket.state() == QtNetwork.QAbstractSocket.ConnectedState :
             self.connectToProxy()
         return self.proxies[port].localPort()
@@ -105,7 +109,7 @@ class proxies(QtCore.QObject):
                 self.testedLoopbackAmount[port] = self.testedLoopbackAmount[port] + 1
             else:
                 if not port in self.testedLoopback:
-                    self.__logger.info("Testing proxy : Received data from proxy on port %i" % self.proxies[port].localPort())
+                    self.__logger.info("Testing proxy : Received data from proxy on port %i", self.proxies[port].localPort())
                     self.testedLoopback.append(port)
                 
             if len(self.testedLoopback) == len(self.proxies):
@@ -115,47 +119,27 @@ class proxies(QtCore.QObject):
         else:
             if not port in self.testedPorts:
                 self.testedPorts.append(port)
-                self.__logger.debug("Received data from proxy on port %i, forwarding to FA" % self.proxies[port].localPort())
+                self.__logger.debug("Received data from proxy on port %i, forwarding to FA", self.proxies[port].localPort())
 
             self.proxies[port].writeDatagram(packet, QtNetwork.QHostAddress.LocalHost, self.client.gamePort)
 
     def readData(self):
-        if self.proxySocket.isValid() :           
+        if self.proxySocket.isValid() :
             if self.proxySocket.bytesAvailable() == 0 :
                 return
-            ins = QtCore.QDataStream(self.proxySocket)
-            ins.setVersion(QtCore.QDataStream.Qt_4_2)
-            while ins.atEnd() == False :                             
-                if self.proxySocket.isValid() :
-                    if self.blockSize == 0:
-                        if self.proxySocket.isValid() :
-                            if self.proxySocket.bytesAvailable() < 4:
-                                return
-
-                            self.blockSize = ins.readUInt32()
-                        else :
-                            return
-        
-                    if self.proxySocket.isValid() :
-                        if self.proxySocket.bytesAvailable() < self.blockSize:
-                            return
-
-                    else :
-                        return  
-                    port = ins.readUInt16()
-                    packet  = ins.readQVariant()
-                    
-                    self.tranfertToUdp(port, packet)
-                    
-                    self.blockSize = 0
-      
-                else : 
-                    return    
-            return                
+            self.blockReader.feed(self.proxySocket.read(self.proxySocket.bytesAvailable()))
+            for block in self.blockReader.blocks():
+                ins = QtCore.QDataStream(QtCore.QByteArray(block))
+                ins.setVersion(QtCore.QDataStream.Qt_4_2)
+                port = ins.readUInt16()
+                packet = ins.readQVariant()
+                self.trafficLog.log("Datagram from proxy server for socket %i", port, size=len(block))
+
+                self.tranfertToUdp(port, packet)
 
     def sendUid(self, *args, **kwargs) :
         if self.uid:
-            self.__logger.warn("sending our uid (%i) to the server" % self.uid)
+            self.__logger.warn("sending our uid (%i) to the server", self.uid)
             reply = QtCore.QByteArray()
             stream = QtCore.QDataStream(reply, QtCore.QIODevice.WriteOnly)
             stream.setVersion(QtCore.QDataStream.Qt_4_2)
@@ -197,6 +181,7 @@ class proxies(QtCore.QObject):
         udpSocket = self.proxies[i]
         while udpSocket.hasPendingDatagrams():
             datagram, _, _ = udpSocket.readDatagram(udpSocket.pendingDatagramSize())
+            self.trafficLog.log("Datagram from FA on socket %i", i, size=len(datagram))
             if self.testing:
                 if not i in self.testedPortsAmount:
                     self.testedPortsAmount[i] = 0
@@ -205,7 +190,7 @@ class proxies(QtCore.QObject):
                     self.testedPortsAmount[i] = self.testedPortsAmount[i] + 1
                 else:
                     if not i in self.testedPorts:
-                        self.__logger.info("Testing proxy : Received data from FA on port %i" % self.proxies[i].localPort())
+                        self.__logger.info("Testing proxy : Received data from FA on port %i", self.proxies[i].localPort())
                         self.testedPorts.append(i)
                         
                 if len(self.testedPorts) == len(self.proxies):
@@ -213,8 +198,8 @@ class proxies(QtCore.QObject):
                 self.sendReply(i, 1, QtCore.QByteArray(datagram))
                 
             else:
-                if not i in self.testedLoopback:
-                    self.__logger.debug("Received data from FA on port %i" % self.proxies[i].localPort())
+                if not i in self.testedLoopback and self.__logger.isEnabledFor(logging.DEBUG):
+                    self.__logger.debug("Received data from FA on port %i", self.proxies[i].localPort())
                 if self.proxiesDestination[i] != None:
                     if not i in self.testedLoopback:
                         self.testedLoopback.append(i)
@@ -227,6 +212,7 @@ class proxies(QtCore.QObject):
         '''Disconnection'''
         self.testedPorts = []
         self.testedLoopback = []        
+        self.blockReader.clear()
         self.__logger.info("disconnected from proxy server")
         if self.canClose == False:
             self.__logger.info("reconnecting to proxy server")
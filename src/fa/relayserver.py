@@ -2,13 +2,16 @@
 from PyQt4 import QtCore, QtNetwork, QtGui
 
 import logging
-import json
 from config import Settings
+from util.trafficlog import TrafficLog
 
-import struct
+from fa import gpgnet, framing
+from fa.gpgnet import GPGNetDecoder, GPGNetError, BlockReader
 
 FAF_SERVER_HOST = Settings.get('HOST', 'RELAY_SERVER')
 FAF_SERVER_PORT = Settings.get('PORT', 'RELAY_SERVER')
+FAF_SERVER_FRAMING = Settings.get('FRAMING', 'RELAY_SERVER')
+TRAFFIC_SAMPLE = Settings.get('TRAFFIC_SAMPLE', 'LOG')
 
 
 class Packet():
@@ -19,66 +22,10 @@ class Packet():
         self._header = header
     
     def Pack(self):
-
-        data = ""
-        
-        headerSize = len(str(self._header))
-        headerField = str(self._header).replace("\t","/t").replace("\n","/n")
-        chunkSize = len(self._data)
-        headerPackStr = "<i" + str(headerSize) + "si"
-        data += struct.pack(headerPackStr, headerSize, headerField, chunkSize)
-
-        for field in self._data :      
-            fieldType = 0 if type(field) is int else 1
-
-            chunkPackStr = ""
-            fields = []
-            if fieldType is 1:
-                fieldSize = len(field)
-                chunkPackStr += "<bi" + str(fieldSize) + "s"
-                fieldStr = str(field).replace("\t","/t").replace("\n","/n")
-                fields.extend([fieldType, fieldSize, fieldStr])
-            elif fieldType is 0:
-                chunkPackStr += "<bi"
-                fields.extend([fieldType, field])
-            data += struct.pack(chunkPackStr, *fields)
-
-        return data
+        return gpgnet.encode(self._header, self._data)
     
     def PackUdp(self):
-
-        data = ""
-        headerSize = len(str(self._header))
-        headerField = str(self._header).replace("\t","/t").replace("\n","/n")
-        chunkSize = len(self._data)
-        headerPackStr = "<i" + str(headerSize) + "si"
-        data += struct.pack(headerPackStr, headerSize, headerField, chunkSize)
-        i = 0
-        for field in self._data :
-                fieldType = 0 if type(field) is int else 1
-
-                chunkPackStr = ""
-                fields = []
-                if fieldType is 1:
-
-                    data = "\x08"
-                    if i == 1 :
-                        fieldSize = len(field) + len(data)
-                    else :
-                        fieldSize = len(field)
-                        
-                    chunkPackStr += "<bi" + str(fieldSize) + "s"
-                    fieldStr = str(field).replace("\t","/t").replace("\n","/n")
-                    if i == 1 :
-                        fields.extend([2, fieldSize, data+fieldStr])
-                    else :
-                        fields.extend([fieldType, fieldSize, fieldStr])
-                elif fieldType is 0:
-                    chunkPackStr += "<bi"
-                    fields.extend([fieldType, field])
-                data += struct.pack(chunkPackStr, *fields)
-                i = 1
-        return data
+        return gpgnet.encode_udp(self._header, self._data)
 
 
 class Relayer(QtCore.QObject): 
@@ -97,17 +44,15 @@ class Relayer(QtCore.QObject):
         self.testing = testing
 
         # for unpacking FA protocol
-        self.blockSizeFromServer = 0
-        self.headerSizeRead = False
-        self.headerRead = False
-        self.chunkSizeRead = False
-        self.fieldTypeRead = False
-        self.fieldSizeRead = False
-        self.blockSize = 0
-        self.fieldSize = 0
-        self.chunkSize = 0
-        self.fieldType = 0
-        self.chunks = []
+        self.decoder = GPGNetDecoder()
+
+        # for talking to the relay server, see fa.framing
+        self.serverReader = BlockReader()
+        self.framing = framing.LEGACY
+        self.trafficLog = TrafficLog(self.__logger, sample=TRAFFIC_SAMPLE)
+
+        # frames for FA, written out in one go once the current read is handled
+        self.pendingFrames = []
 
         self.pingTimer = None
         self.init_mode = init_mode
@@ -129,12 +74,14 @@ class Relayer(QtCore.QObject):
         self.__logger.error(self.relaySocket.errorString())
 
     def on_connected(self):
-        self.__logger.debug("faf server " + self.relaySocket.peerName() + ":" + str(self.relaySocket.peerPort()))
+        self.__logger.debug("faf server %s:%i", self.relaySocket.peerName(), self.relaySocket.peerPort())
         self.__logger.debug("Initializing ping timer")
         self.pingTimer = QtCore.QTimer(self)
         self.pingTimer.timeout.connect(self.ping)
         self.pingTimer.start(30000)
         self.sendToServer('Authenticate', [self.client.session, self.client.id])
+        if FAF_SERVER_FRAMING != self.framing.name and FAF_SERVER_FRAMING in framing.FRAMINGS:
+            self.sendToServer('SetFraming', [FAF_SERVER_FRAMING])
         self.relaySocket.readyRead.connect(self.readDataFromServer)
 
     def __del__(self):
@@ -144,113 +91,42 @@ class Relayer(QtCore.QObject):
         self.__logger.debug("destructor called")        
            
     def readDataFromServer(self):
-        ins = QtCore.QDataStream(self.relaySocket)        
-        ins.setVersion(QtCore.QDataStream.Qt_4_2)
-        
-        while ins.atEnd() == False :
-            if self.blockSizeFromServer == 0:
-                if self.relaySocket.bytesAvailable() < 4:
-                    return
-                self.blockSizeFromServer = ins.readUInt32()            
-            if self.relaySocket.bytesAvailable() < self.blockSizeFromServer:
-                return
-
-            commands = ins.readQString()
-            self.__logger.info("Command received from server : " + commands)
-            self.handleAction(json.loads(commands))
-            self.blockSizeFromServer = 0
+        self.serverReader.feed(self.relaySocket.read(self.relaySocket.bytesAvailable()))
+        for block in self.serverReader.blocks():
+            commands = self.framing.decode(block)
+            self.trafficLog.log("Command received from server : %s", commands, size=len(block))
+            self.handleAction(commands)
 
+        self.flushToGame()
 
 
     def readData(self):
         if self.inputSocket.bytesAvailable() == 0 :
             self.__logger.info("data reception read done - too or not enough data")
             return
-        
-        ins = QtCore.QDataStream(self.inputSocket)
-        ins.setByteOrder(QtCore.QDataStream.LittleEndian)  
-
-        while ins.atEnd() == False :
-            if self.inputSocket.isValid() :
-                if self.headerSizeRead == False :
-                    if self.inputSocket.bytesAvailable() < 4:
-                        return
-                
-                    self.blockSize = ins.readUInt32()
-                    self.headerSizeRead = True
-                    
-                if self.headerRead == False :
-                
-                    if self.inputSocket.bytesAvailable() < self.blockSize :
-                        return
-                
-                    self.action = ins.readRawData(self.blockSize)
-                    self.headerRead = True
-                    
-                if self.chunkSizeRead == False :
-                    if self.inputSocket.bytesAvailable() < 4:
-                        return
-                
-                    self.chunkSize = ins.readInt32()
-                    self.chunks = []
-                    self.chunkSizeRead = True
-                
-                if self.chunkSize > 100 :
-                    self.__logger.info("Big error reading FA data !")
-                    self.inputSocket.readAll()
-                    self.fieldSize = 0
-                    self.blockSize = 0
-                    self.chunkSize = 0  
-                    self.noSocket = True                         
-                    return
-                
-                for _ in range(len(self.chunks), self.chunkSize):
-                    if self.fieldTypeRead == False :
-                        if self.inputSocket.bytesAvailable() < 1 :
-                            return
-                                
-                        self.fieldType = ins.readBool()
-                        self.fieldTypeRead = True
-                    
-                    if not self.fieldType :
-                     
-                        if self.inputSocket.bytesAvailable() < 4 :
-                            return
-                        number = ins.readInt32()
-                        self.chunks.append(number)
-                        self.fieldTypeRead = False         
-
-                    else :
-                        if self.fieldSizeRead == False :      
-                            if self.inputSocket.bytesAvailable() < 4 :
-                                return  
-                              
-                            self.fieldSize =  ins.readInt32()
-                            self.fieldSizeRead = True
-                
-                        if self.inputSocket.bytesAvailable() < self.fieldSize :
-                            return
-
-                        datatring = ins.readRawData(self.fieldSize)
-                        fixedStr = datatring.replace("/t","\t").replace("/n","\n")
-                        self.chunks.append(fixedStr)               
-                        self.fieldTypeRead = False
-                        self.fieldSizeRead = False  
-      
+
+        self.decoder.feed(self.inputSocket.read(self.inputSocket.bytesAvailable()))
+        try:
+            for action, chunks in self.decoder.frames():
                 if not self.testing:
-                    self.handle_incoming_local(self.action, self.chunks)
+                    self.handle_incoming_local(action, chunks)
                 else:
-                    self.sendToLocal(self.action, self.chunks)
-                self.action = None
-                self.chunks = []
-                self.headerSizeRead = False
-                self.headerRead = False
-                self.chunkSizeRead = False
-                self.fieldTypeRead = False
-                self.fieldSizeRead = False
+                    self.sendToLocal(action, chunks)
+        except GPGNetError, e:
+            self.__logger.info("Big error reading FA data ! (%s)", e)
+            self.decoder.clear()
+        self.flushToGame()
+
+    def writeToGame(self, frame):
+        self.pendingFrames.append(frame)
+
+    def flushToGame(self):
+        if self.pendingFrames:
+            self.inputSocket.write("".join(self.pendingFrames))
+            self.pendingFrames = []
 
     def handle_incoming_local(self, action, chunks):
-        if self.action == 'GameState':
+        if action == 'GameState':
             if chunks[0] == 'Idle':
                 self.__logger.info("Telling game to create lobby")
                 reply = Packet("CreateLobby", [self.init_mode,
@@ -258,7 +134,7 @@ class Relayer(QtCore.QObject):
                                                self.client.login,
                                                self.client.id,
                                                1])
-                self.inputSocket.write(reply.Pack())
+                self.writeToGame(reply.Pack())
         self.sendToServer(action, chunks)
 
     def ping(self):
@@ -269,41 +145,34 @@ class Relayer(QtCore.QObject):
             if chunks[0] == 'Idle':
                 self.client.proxyServer.setUid(1)
                 reply = Packet("CreateLobby", [0, 0, "FAF Local Mode", 0, 1])
-                self.inputSocket.write(reply.Pack())
+                self.writeToGame(reply.Pack())
 
             elif chunks[0] == 'Lobby':
                 reply = Packet("HostGame", ["SCMP_007"])
-                self.inputSocket.write(reply.Pack())
+                self.writeToGame(reply.Pack())
                 if self.testing == True:
                     self.client.proxyServer.testingProxy()
                     for i in range(len(self.client.proxyServer.proxies)):
                         udpport = self.client.proxyServer.bindSocket(i, 1)
-                        self.__logger.info("Asking to send data on proxy port %i" % udpport)
+                        self.__logger.info("Asking to send data on proxy port %i", udpport)
                         acts = [("127.0.0.1:%i" % udpport), "port %i" % udpport, udpport]
                         reply = Packet("ConnectToPeer", acts)
-                        self.inputSocket.write(reply.Pack())
+                        self.writeToGame(reply.Pack())
                 else:
                     self.client.proxyServer.stopTesting()                    
 
                             
     def sendToServer(self, action, chunks):
-        data = json.dumps(dict(action=action, chunks=chunks))
+        message = dict(action=action, chunks=chunks)
         # Relay to faforever.com
         if self.relaySocket.isOpen():
+            data = self.framing.encode(message)
             if action != "ping" and action != "pong" :
-                self.__logger.info("Command transmitted from FA to server : " + data)
-            
-            block = QtCore.QByteArray()
-            out = QtCore.QDataStream(block, QtCore.QIODevice.ReadWrite)
-            out.setVersion(QtCore.QDataStream.Qt_4_2)
-            out.writeUInt32(0)
-            out.writeQString(data)
-            out.device().seek(0)        
-            out.writeUInt32(block.size() - 4)
-            self.bytesToSend = block.size() - 4
-            self.relaySocket.writeData(block)
+                self.trafficLog.log("Command transmitted from FA to server : %s", message, size=len(data))
+
+            self.relaySocket.write(data)
         else :
-            self.__logger.warn("Error transmitting data to server : " + data)
+            self.__logger.warn("Error transmitting data to server : %s", message)
 
     def handleAction(self, commands):    
         key = commands["key"]
@@ -311,15 +180,21 @@ class Relayer(QtCore.QObject):
         
         if key == "ping" :
             self.sendToServer("pong", [])
+
+        elif key == "Framing" :
+            # The server sends in the new framing from here on, we do after this acknowledgement
+            self.sendToServer("Framing", acts)
+            self.framing = framing.get_framing(acts[0])
+            self.__logger.info("Using %s framing with the relay server", self.framing.name)
             
         elif key == "SendNatPacket" :
             reply = Packet(key, acts)
-            self.inputSocket.write(reply.PackUdp())
+            self.writeToGame(reply.PackUdp())
 
         elif key == "CreateLobby":
             uid = int(acts[3])     
             self.client.proxyServer.setUid(uid)
-            self.__logger.info("Setting uid : " + str(uid))
+            self.__logger.info("Setting uid : %i", uid)
 
         elif key == "ConnectToProxy" :
                 port = acts[0]
@@ -330,7 +205,7 @@ class Relayer(QtCore.QObject):
                 newActs = [("127.0.0.1:%i" % udpport), login, uid]
                 
                 reply = Packet("ConnectToPeer", newActs)
-                self.inputSocket.write(reply.Pack())
+                self.writeToGame(reply.Pack())
                 
         elif key == "JoinProxy" :
             port = acts[0]
@@ -341,11 +216,11 @@ class Relayer(QtCore.QObject):
             newActs = [("127.0.0.1:%i" % udpport), login, uid]
             
             reply = Packet("JoinGame", newActs)
-            self.inputSocket.write(reply.Pack())                
+            self.writeToGame(reply.Pack())                
             
         else :
             reply = Packet(key, acts)
-            self.inputSocket.write(reply.Pack())
+            self.writeToGame(reply.Pack())
 
 
     def done(self):
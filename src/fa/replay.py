@@ -1,9 +1,11 @@
-import json
 import os
+import sys
+import threading
 from PyQt4 import QtCore, QtGui
 import fa
 from fa.check import check
-from fa.replayparser import replayParser
+from fa.replayfile import extract
+from fa.replayheader import game_patch, read_version
 import util
 import mods
 
@@ -13,6 +15,56 @@ logger = logging.getLogger(__name__)
 __author__ = 'Thygrrr'
 
 
+def extract_replay(source, destination):
+    '''
+    Extracts the replay data of the .fafreplay source to destination on a worker thread, showing the progress
+    in a dialog meanwhile. Returns the replay info and the size of the replay data (0 if the replay is
+    unreadable), or None if the user cancelled.
+    '''
+    state = dict(done=0, total=0, cancelled=False, result=({}, 0))
+
+    def progress(done, total):
+        state['done'], state['total'] = done, total
+
+    def run():
+        try:
+            state['result'] = extract(source, destination, progress, lambda: state['cancelled'])
+        except (IOError, ValueError), e:
+            logger.error("Couldn't read replay %s: %s", source, e, exc_info=sys.exc_info())
+
+    dialog = QtGui.QProgressDialog("Extracting replay...", "Cancel", 0, 100)
+    dialog.setWindowTitle("FA Forever Replay")
+    dialog.setMinimumDuration(500)
+    dialog.setAutoClose(False)
+    dialog.setAutoReset(False)
+
+    def cancel():
+        state['cancelled'] = True
+    dialog.canceled.connect(cancel)
+
+    thread = threading.Thread(target=run, name="Extract " + source)
+    thread.daemon = True
+    thread.start()
+    while thread.is_alive():
+        QtGui.QApplication.processEvents(QtCore.QEventLoop.AllEvents, 50)
+        if state['total']:
+            dialog.setValue(int(100 * state['done'] / state['total']))
+        thread.join(0.01)
+    dialog.close()
+    return state['result']
+
+
+def replay_patch(filename):
+    '''
+    Returns the game patch the replay filename was recorded with, or None if that can't be told.
+    '''
+    try:
+        return game_patch(read_version(filename))
+    except (IOError, ValueError), e:
+        logger.warn("Couldn't read the version of replay %s: %s", filename, e)
+        return None
+
+
 def replay(source, detach=False):
     '''
     Launches FA streaming the replay from the given location. Source can be a QUrl or a string
@@ -28,32 +80,25 @@ def replay(source, detach=False):
         if isinstance(source, basestring):
             if os.path.isfile(source):
                 if source.endswith(".fafreplay"):  # the new way of doing things
-                    replay = open(source, "rt")
-                    info = json.loads(replay.readline())
-
-                    binary = QtCore.qUncompress(QtCore.QByteArray.fromBase64(replay.read()))
-                    logger.info("Extracted " + str(binary.size()) + " bytes of binary data from .fafreplay.")
-                    replay.close()
+                    arg_string = os.path.join(util.CACHE_DIR, "temp.scfareplay")
+                    extracted = extract_replay(source, arg_string)
+                    if extracted is None:
+                        logger.info("Replay extraction cancelled")
+                        return False
+                    info, size = extracted
+                    logger.info("Extracted " + str(size) + " bytes of binary data from .fafreplay.")
 
-                    if binary.size() == 0:
+                    if size == 0:
                         logger.info("Invalid replay")
                         QtGui.QMessageBox.critical(None, "FA Forever Replay", "Sorry, this replay is corrupted.")
                         return False
 
-                    scfa_replay = QtCore.QFile(os.path.join(util.CACHE_DIR, "temp.scfareplay"))
-                    scfa_replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Truncate)
-                    scfa_replay.write(binary)
-                    scfa_replay.flush()
-                    scfa_replay.close()
-
                     mapname = info.get('mapname', None)
                     mod = info['featured_mod']
                     replay_id = info['uid']
                     featured_mod_versions = info.get('featured_mod_versions', None)
-                    arg_string = scfa_replay.fileName()
 
-                    parser = replayParser(arg_string)
-                    version = parser.getVersion()
+                    version = replay_patch(arg_string)
 
                 elif source.endswith(".scfareplay"):  # compatibility mode
                     filename = os.path.basename(source)
@@ -66,8 +111,7 @@ def replay(source, detach=False):
 
                     mapname = None
                     arg_string = source
-                    parser = replayParser(arg_string)
-                    version = parser.getVersion()
+                    version = replay_patch(arg_string)
                 else:
                     QtGui.QMessageBox.critical(None, "FA Forever Replay",
                                                "Sorry, FAF has no idea how to replay this file:<br/><b>" + source + "</b>")
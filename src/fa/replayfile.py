@@ -0,0 +1,357 @@
+"""
+Reading and writing .fafreplay files.
+
+Version 1 is a line of JSON describing the game, followed by the base64 of
+the replay data as QtCore.qCompress packs it: the 4 byte big endian size of
+the data, then a zlib stream. It can only be read from the start.
+
+Version 2 starts with MAGIC and the version byte, then come the chunks the
+replay data was cut into. Each chunk is a zlib stream of its own, so any part
+of the replay can be read without decompressing what's before it. The JSON
+header and an index of the chunks follow them, and the file ends with the
+length of the header and the number of chunks.
+
+    | "FAFREPLAY" | version | chunks ... | header |
+    | compressed size, size (per chunk) | header length | chunk count |
+
+All numbers are big endian, lengths are 32 bit. Replays are written while the
+game is still running: the chunks go into a spool file next to the replays,
+finishing the replay appends the header and index to it and renames it.
+
+Run as a script to convert the version 1 replays in some folders:
+
+    python2 src/fa/replayfile.py <folder>...
+"""
+import base64
+import bisect
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = "FAFREPLAY"
+VERSION = 2
+
+# Replay data per chunk
+CHUNK_SIZE = 1024 * 1024
+
+# Base64 read at a time from version 1 replays, and the most replay data decompressed from it at once
+BASE64_BLOCK_SIZE = 256 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+_PREAMBLE = struct.Struct(">%isB" % len(MAGIC))
+_CHUNK = struct.Struct(">II")
+_FOOTER = struct.Struct(">II")
+
+
+class ReplayWriter(object):
+    """
+    Compresses replay data chunk by chunk into a spool file in folder as it's
+    written, and turns that into a .fafreplay with finish.
+    """
+    def __init__(self, folder):
+        fd, self.spoolname = tempfile.mkstemp(dir=folder, prefix="recording-", suffix=".tmp")
+        self.spool = os.fdopen(fd, "wb")
+        self.spool.write(_PREAMBLE.pack(MAGIC, VERSION))
+        self.size = 0
+        self.chunks = []
+        self._compressor = zlib.compressobj()
+        self._chunkSize = 0
+        self._chunkCompressed = 0
+
+    def _spool(self, data):
+        self.spool.write(data)
+        self._chunkCompressed += len(data)
+
+    def _endChunk(self):
+        self._spool(self._compressor.flush())
+        self.chunks.append((self._chunkCompressed, self._chunkSize))
+        self._compressor = zlib.compressobj()
+        self._chunkSize = 0
+        self._chunkCompressed = 0
+
+    def write(self, data):
+        self.size += len(data)
+        while data:
+            piece = data[:CHUNK_SIZE - self._chunkSize]
+            data = data[len(piece):]
+            self._spool(self._compressor.compress(piece))
+            self._chunkSize += len(piece)
+            if self._chunkSize == CHUNK_SIZE:
+                self._endChunk()
+
+    def finish(self, filename, info):
+        '''
+        Appends the given info and the chunk index to the spool file and
+        renames it to filename. The spool file is removed if that fails.
+        '''
+        if self._chunkSize:
+            self._endChunk()
+        header = json.dumps(info)
+        try:
+            self.spool.write(header)
+            self.spool.write("".join(_CHUNK.pack(*chunk) for chunk in self.chunks))
+            self.spool.write(_FOOTER.pack(len(header), len(self.chunks)))
+            self.spool.close()
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(self.spoolname, filename)
+        except:
+            self.discard()
+            raise
+
+    def discard(self):
+        self.spool.close()
+        if os.path.exists(self.spoolname):
+            os.remove(self.spoolname)
+
+
+class _BlockStream(object):
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.buffer = ""
+
+    def read(self, count):
+        pieces = [self.buffer]
+        available = len(self.buffer)
+        while available < count:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            pieces.append(block)
+            available += len(block)
+        data = "".join(pieces)
+        self.buffer = data[count:]
+        return data[:count]
+
+
+class ReplayFile(object):
+    """
+    A .fafreplay of either version opened for reading. The JSON header is
+    read right away, the replay data on demand.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        try:
+            self._readHeader()
+        except:
+            self.file.close()
+            raise
+
+    def _readHeader(self):
+        preamble = self.file.read(_PREAMBLE.size)
+        if not preamble.startswith(MAGIC):
+            self.version = 1
+            self.file.seek(0)
+            self.header = self.file.readline().rstrip("\r\n")
+            self.bodyOffset = self.file.tell()
+            self.bodyEnd = os.fstat(self.file.fileno()).st_size
+            return
+
+        if len(preamble) < _PREAMBLE.size:
+            raise ValueError("truncated replay header in " + self.filename)
+        _, self.version = _PREAMBLE.unpack(preamble)
+        if self.version != VERSION:
+            raise ValueError("unsupported replay version %i in %s" % (self.version, self.filename))
+        end = os.fstat(self.file.fileno()).st_size
+        if end < _PREAMBLE.size + _FOOTER.size:
+            raise ValueError("truncated replay header in " + self.filename)
+        self.file.seek(end - _FOOTER.size)
+        length, count = _FOOTER.unpack(self.file.read(_FOOTER.size))
+        self.bodyEnd = end - _FOOTER.size - count * _CHUNK.size - length
+        if self.bodyEnd < _PREAMBLE.size:
+            raise ValueError("truncated replay header in " + self.filename)
+        self.file.seek(self.bodyEnd)
+        self.header = self.file.read(length)
+        index = self.file.read(count * _CHUNK.size)
+
+        # (offset in the file, compressed size, size) of each chunk, and where it starts in the replay data
+        self.chunks = []
+        self.starts = []
+        offset = _PREAMBLE.size
+        start = 0
+        for i in range(count):
+            compressed, size = _CHUNK.unpack_from(index, i * _CHUNK.size)
+            self.chunks.append((offset, compressed, size))
+            self.starts.append(start)
+            offset += compressed
+            start += size
+        if offset != self.bodyEnd:
+            raise ValueError("corrupt chunk index in " + self.filename)
+        self.size = start
+
+    @property
+    def info(self):
+        return json.loads(self.header)
+
+    def chunk(self, i):
+        '''
+        Returns the replay data of chunk i of a version 2 replay.
+        '''
+        offset, compressed, size = self.chunks[i]
+        self.file.seek(offset)
+        try:
+            data = zlib.decompress(self.file.read(compressed))
+        except zlib.error, e:
+            raise ValueError("corrupt chunk %i in %s: %s" % (i, self.filename, e))
+        if len(data) != size:
+            raise ValueError("corrupt chunk %i in %s" % (i, self.filename))
+        return data
+
+    def _v1Blocks(self):
+        # base64 -> the qCompress size prefix and zlib stream -> replay data, a block at a time
+        self.file.seek(self.bodyOffset)
+        decompressor = zlib.decompressobj()
+        pending = ""
+        prefix = ""
+        size = 0
+        while True:
+            text = self.file.read(BASE64_BLOCK_SIZE)
+            if not text:
+                break
+            text = pending + "".join(text.split())
+            usable = len(text) - len(text) % 4
+            pending = text[usable:]
+            data = base64.b64decode(text[:usable])
+            if len(prefix) < 4:
+                take = 4 - len(prefix)
+                prefix += data[:take]
+                data = data[take:]
+            while data:
+                block = decompressor.decompress(data, BLOCK_SIZE)
+                data = decompressor.unconsumed_tail
+                size += len(block)
+                if block:
+                    yield block
+        block = decompressor.flush()
+        size += len(block)
+        if block:
+            yield block
+        if pending or len(prefix) < 4 or size != struct.unpack(">I", prefix)[0]:
+            raise ValueError("truncated replay " + self.filename)
+
+    def blocks(self):
+        '''
+        Yields the replay data a block at a time.
+        '''
+        if self.version == 1:
+            try:
+                for block in self._v1Blocks():
+                    yield block
+            except (TypeError, zlib.error), e:
+                raise ValueError("corrupt replay %s: %s" % (self.filename, e))
+            return
+        for i in range(len(self.chunks)):
+            yield self.chunk(i)
+
+    def stream(self):
+        '''
+        Returns the replay data as a file-like object that's read from the
+        start, decoding only as much as was read.
+        '''
+        return _BlockStream(self.blocks())
+
+    def read(self, offset, count):
+        '''
+        Returns count bytes of the replay data from offset on, decompressing
+        only the chunks they're in.
+        '''
+        if self.version == 1:
+            return "".join(self.blocks())[offset:offset + count]
+        pieces = []
+        i = max(0, bisect.bisect_right(self.starts, offset) - 1)
+        while count > 0 and i < len(self.chunks):
+            data = self.chunk(i)[offset - self.starts[i]:][:count]
+            pieces.append(data)
+            offset += len(data)
+            count -= len(data)
+            i += 1
+        return "".join(pieces)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def extract(filename, destination, progress=None, cancelled=None):
+    '''
+    Writes the replay data of the .fafreplay filename to the file destination
+    a block at a time. progress(done, total) is called after every block with
+    how much of filename was read. Returns the replay info and the size of the
+    replay data, or None once cancelled() returns true.
+    '''
+    size = 0
+    with ReplayFile(filename) as replay, open(destination, "wb") as output:
+        info = replay.info
+        total = replay.bodyEnd
+        for block in replay.blocks():
+            if cancelled is not None and cancelled():
+                return None
+            output.write(block)
+            size += len(block)
+            if progress is not None:
+                progress(replay.file.tell(), total)
+    return info, size
+
+
+def convert(filename):
+    '''
+    Rewrites the .fafreplay filename in the current version, keeping its
+    modification time. Returns False if it already was.
+    '''
+    with ReplayFile(filename) as replay:
+        if replay.version == VERSION:
+            return False
+        info = replay.info
+        writer = ReplayWriter(os.path.dirname(os.path.abspath(filename)))
+        try:
+            for block in replay.blocks():
+                writer.write(block)
+        except:
+            writer.discard()
+            raise
+    st = os.stat(filename)
+    writer.finish(filename, info)
+    os.utime(filename, (st.st_atime, st.st_mtime))
+    return True
+
+
+def convertFolder(folder):
+    '''
+    Converts the .fafreplay files in folder, returns how many were converted
+    and how many couldn't be read.
+    '''
+    converted = failed = 0
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(".fafreplay"):
+            continue
+        try:
+            if convert(os.path.join(folder, name)):
+                converted += 1
+        except (IOError, OSError, ValueError), e:
+            logger.warn("Couldn't convert %s: %s", name, e)
+            failed += 1
+    return converted, failed
+
+
+def main(folders):
+    logging.basicConfig()
+    for folder in folders:
+        converted, failed = convertFolder(folder)
+        print "%s: converted %i replays, %i unreadable" % (folder, converted, failed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
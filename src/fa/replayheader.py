@@ -0,0 +1,228 @@
+"""
+The header Supreme Commander writes at the start of its replays.
+
+    "Supreme Commander v1.50.3599" 0, 3 bytes
+    "Replay v1.9\\r\\n<map path>" 0, 4 bytes
+    uint32 size, lua table of the mods
+    uint32 size, lua table of the scenario
+    uint8 count, (name 0, uint32 player id) per command source
+    uint8 cheats enabled
+    uint8 count, (uint32 size, lua table of the army, uint8 command source,
+                  1 byte unless the source is 255) per army
+    uint32 random seed
+
+Integers are little endian. Lua values are a type byte followed by a float32
+for numbers, a 0 terminated string, a bool byte, a skipped byte for nil, or
+key/value pairs up to an end byte for tables.
+
+Only the header is read, a block at a time, however long the replay is.
+"""
+import struct
+
+from fa.replayfile import ReplayFile
+
+# Bytes read from the replay at a time, and the most a header may take
+READ_SIZE = 4096
+MAX_HEADER_SIZE = 4 * 1024 * 1024
+
+_BYTE = struct.Struct("<B")
+_UINT32 = struct.Struct("<I")
+_FLOAT = struct.Struct("<f")
+
+LUA_NUMBER = 0
+LUA_STRING = 1
+LUA_NIL = 2
+LUA_BOOL = 3
+LUA_TABLE = 4
+LUA_TABLE_END = 5
+
+# Command source of armies no player controls
+NO_SOURCE = 255
+
+
+def game_patch(version):
+    '''
+    The game patch in the replay version string version, e.g. "3599" for
+    "Supreme Commander v1.50.3599", or None if it isn't a v1 version.
+    '''
+    if not version.startswith("Supreme Commander v1"):
+        return None
+    return version.split(".")[-1]
+
+
+class ReplayHeader(object):
+    """
+    What a replay says about its game before the first tick.
+    """
+    def __init__(self, version, replay_version, map_path, mods, scenario, players, cheats_enabled, armies,
+                 random_seed):
+        self.version = version
+        self.replay_version = replay_version
+        self.map_path = map_path
+        # The mods' info tables, in the order they were listed
+        self.mods = mods
+        self.scenario = scenario
+        # Player ids by name, for every command source
+        self.players = players
+        self.cheats_enabled = cheats_enabled
+        # Army tables by command source, NO_SOURCE for armies nobody controls
+        self.armies = armies
+        self.random_seed = random_seed
+
+    @property
+    def patch(self):
+        '''
+        The game patch the replay was recorded with, e.g. "3599", or None if
+        it isn't a Supreme Commander v1 replay.
+        '''
+        return game_patch(self.version)
+
+    @property
+    def player_names(self):
+        return [army.get("PlayerName", "") for source, army in sorted(self.armies.items())
+                if source != NO_SOURCE]
+
+
+class _Reader(object):
+    def __init__(self, f):
+        self.file = f
+        self.buffer = ""
+        self.position = 0
+        self.consumed = 0
+
+    def _more(self):
+        if self.consumed + len(self.buffer) >= MAX_HEADER_SIZE:
+            raise ValueError("replay header too large")
+        data = self.file.read(READ_SIZE)
+        if not data:
+            raise ValueError("truncated replay header")
+        self.consumed += self.position
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+
+    def _fill(self, count):
+        while len(self.buffer) - self.position < count:
+            self._more()
+
+    def skip(self, count):
+        self._fill(count)
+        self.position += count
+
+    def unpack(self, s):
+        self._fill(s.size)
+        value, = s.unpack_from(self.buffer, self.position)
+        self.position += s.size
+        return value
+
+    def peek_byte(self):
+        self._fill(1)
+        return ord(self.buffer[self.position])
+
+    def string(self):
+        start = self.position
+        while True:
+            end = self.buffer.find("\0", start)
+            if end != -1:
+                break
+            start = len(self.buffer) - self.position
+            self._more()
+        value = self.buffer[self.position:end]
+        self.position = end + 1
+        return value.decode("utf-8", "replace")
+
+    def lua(self):
+        kind = self.unpack(_BYTE)
+        if kind == LUA_NUMBER:
+            return self.unpack(_FLOAT)
+        elif kind == LUA_STRING:
+            return self.string()
+        elif kind == LUA_NIL:
+            self.skip(1)
+            return None
+        elif kind == LUA_BOOL:
+            return self.unpack(_BYTE) != 0
+        elif kind == LUA_TABLE:
+            table = {}
+            while self.peek_byte() != LUA_TABLE_END:
+                key = self.lua()
+                table[key] = self.lua()
+            self.skip(1)
+            return table
+        raise ValueError("unknown lua type %i in replay header" % kind)
+
+
+def _version(reader):
+    version = reader.string()
+    if not version.startswith("Supreme Commander"):
+        raise ValueError("not a Supreme Commander replay")
+    return version
+
+
+def parse_version(f):
+    '''
+    Reads just the version string from the start of the replay data in the
+    open file f, so it's known even if the rest of the header is broken.
+    Raises ValueError if there is none.
+    '''
+    return _version(_Reader(f))
+
+
+def parse(f):
+    '''
+    Reads the ReplayHeader from the start of the replay data in the open file
+    f. Raises ValueError if there is none.
+    '''
+    reader = _Reader(f)
+    version = _version(reader)
+    reader.skip(3)
+    replay_version, _, map_path = reader.string().partition("\r\n")
+    reader.skip(4)
+
+    reader.unpack(_UINT32)
+    mods = reader.lua()
+    mods = [mods[key] for key in sorted(mods)] if isinstance(mods, dict) else []
+    reader.unpack(_UINT32)
+    scenario = reader.lua()
+
+    players = {}
+    for _ in range(reader.unpack(_BYTE)):
+        name = reader.string()
+        players[name] = reader.unpack(_UINT32)
+    cheats_enabled = reader.unpack(_BYTE) != 0
+
+    armies = {}
+    for _ in range(reader.unpack(_BYTE)):
+        reader.unpack(_UINT32)
+        army = reader.lua()
+        source = reader.unpack(_BYTE)
+        armies[source] = army
+        if source != NO_SOURCE:
+            reader.skip(1)
+    random_seed = reader.unpack(_UINT32)
+
+    return ReplayHeader(version, replay_version, map_path, mods, scenario, players, cheats_enabled, armies,
+                        random_seed)
+
+
+def _read(filename, parser):
+    if filename.endswith(".fafreplay"):
+        with ReplayFile(filename) as replay:
+            return parser(replay.stream())
+    with open(filename, "rb") as f:
+        return parser(f)
+
+
+def read_header(filename):
+    '''
+    Returns the ReplayHeader of the .scfareplay or .fafreplay filename.
+    Raises ValueError if it can't be read.
+    '''
+    return _read(filename, parse)
+
+
+def read_version(filename):
+    '''
+    Returns the version string of the .scfareplay or .fafreplay filename, see
+    parse_version. Raises ValueError if it can't be read.
+    '''
+    return _read(filename, parse_version)
@@ -8,10 +8,11 @@ import os
 import logging
 import util
 import fa
-import json
 import time
 
 from config import Settings
+from fa.replayfile import ReplayWriter
+from fa.replayupload import ReplayUploader
 
 INTERNET_REPLAY_SERVER_HOST = Settings.get('HOST', 'ONLINE_REPLAY_SERVER')
 INTERNET_REPLAY_SERVER_PORT = Settings.get('PORT', 'ONLINE_REPLAY_SERVER')
@@ -22,7 +23,10 @@ from . import DEFAULT_RECORD_REPLAY
 class ReplayRecorder(QtCore.QObject): 
     """
     This is a simple class that takes all the FA replay data input from its inputSocket, writes it to a file,
-    and relays it to an internet server via its relaySocket.
+    and relays it to an internet server via its uploader unless fa.live_replay is off.
+
+    The replay data is compressed into a spool file as it arrives rather than kept in memory, see ReplayWriter.
+    Relaying never blocks, see ReplayUploader; the recorder is done once the upload is.
     """
     __logger = logging.getLogger(__name__)
 
@@ -37,26 +41,22 @@ class ReplayRecorder(QtCore.QObject):
         
               
         #Create a file to write the replay data into
-        self.replayData = QtCore.QByteArray()
+        self.replayWriter = ReplayWriter(util.REPLAY_DIR)
         self.replayInfo = fa.instance.info
                  
-        # Open the relay socket to our server
-        self.relaySocket = QtNetwork.QTcpSocket(self.parent)
-        self.relaySocket.connectToHost(INTERNET_REPLAY_SERVER_HOST, INTERNET_REPLAY_SERVER_PORT)
-        
+        # Relay to our server in the background
+        self.uploader = None
         if util.settings.value("fa.live_replay", DEFAULT_LIVE_REPLAY, type=bool):
-            if self.relaySocket.waitForConnected(1000): #Maybe make this asynchronous
-                self.__logger.debug("internet replay server " + self.relaySocket.peerName() + ":" + str(self.relaySocket.peerPort()))
-            else:
-                self.__logger.error("no connection to internet replay server")
+            self.uploader = ReplayUploader(INTERNET_REPLAY_SERVER_HOST, INTERNET_REPLAY_SERVER_PORT)
+            self.uploader.finished.connect(self.done)
 
         
-        
     def __del__(self):
         # Clean up our socket objects, in accordance to the hint from the Qt docs (recommended practice)
         self.__logger.debug("destructor entered")
         self.inputSocket.deleteLater()
-        self.relaySocket.deleteLater()
+        if self.uploader is not None:
+            self.uploader.deleteLater()
            
                  
     def readDatas(self):        
@@ -70,21 +70,21 @@ class ReplayRecorder(QtCore.QObject):
         data = QtCore.QByteArray(read)
         
         # Record locally
-        if self.replayData.isEmpty():
+        if self.replayWriter.size == 0:
             #This prefix means "P"osting replay in the livereplay protocol of FA, this needs to be stripped from the local file            
             if data.startsWith("P/"):
                 rest = data.indexOf("\x00") + 1
                 self.__logger.info("Stripping prefix '" + str(data.left(rest)) + "' from replay.")
-                self.replayData.append(data.right(data.size() - rest))
+                self.replayWriter.write(str(data.right(data.size() - rest)))
             else:
-                self.replayData.append(data)
+                self.replayWriter.write(str(data))
         else:
-            #Write to buffer
-            self.replayData.append(data)
+            #Write to the spool file
+            self.replayWriter.write(str(data))
 
         # Relay to faforever.com
-        if self.relaySocket.isOpen():
-            self.relaySocket.write(data)
+        if self.uploader is not None:
+            self.uploader.write(str(data))
         
 
 
@@ -102,24 +102,16 @@ class ReplayRecorder(QtCore.QObject):
             self.__logger.info("Relaying remaining bytes:" + str(self.inputSocket.bytesAvailable()))
             self.readDatas()
             
-        # Part of the hardening - ensure successful sending of the rest of the replay to the server
-        if self.relaySocket.bytesToWrite():
-            self.__logger.info("Waiting for replay transmission to finish: " + str(self.relaySocket.bytesToWrite()) + " bytes")
-
-            progress = QtGui.QProgressDialog("Finishing Replay Transmission", "Cancel", 0, 0)
-            progress.show()
-
-            while self.relaySocket.bytesToWrite() and progress.isVisible():
-                QtGui.QApplication.processEvents()
-
-            progress.close()
-
-        self.relaySocket.disconnectFromHost()
-        
-        if settings.value("fa.record_replay", DEFAULT_RECORD_REPLAY, type=bool):
+        if util.settings.value("fa.record_replay", DEFAULT_RECORD_REPLAY, type=bool):
             self.writeReplayFile()
-        
-        self.done()
+        else:
+            self.replayWriter.discard()
+
+        # Part of the hardening - the rest of the replay is sent to the server before we're done
+        if self.uploader is not None:
+            self.uploader.finish()
+        else:
+            self.done()
 
 
     def writeReplayFile(self):
@@ -135,14 +127,12 @@ class ReplayRecorder(QtCore.QObject):
         self.replayInfo['game_end'] = time.time()
         
         filename = os.path.join(util.REPLAY_DIR, str(self.replayInfo['uid']) + "-" + self.replayInfo['recorder'] + ".fafreplay")
-        self.__logger.info("Writing local replay as " + filename + ", containing " + str(self.replayData.size()) + " bytes of replay data.")
-               
-        replay  = QtCore.QFile(filename)
-        replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Text)
-        replay.write(json.dumps(self.replayInfo))
-        replay.write('\n')
-        replay.write(QtCore.qCompress(self.replayData).toBase64())
-        replay.close()
+        self.__logger.info("Writing local replay as " + filename + ", containing " + str(self.replayWriter.size) + " bytes of replay data.")
+
+        try:
+            self.replayWriter.finish(filename, self.replayInfo)
+        except (IOError, OSError), e:
+            self.__logger.error("Couldn't write local replay " + filename + ": " + str(e))
         
 
 class ReplayServer(QtNetwork.QTcpServer):
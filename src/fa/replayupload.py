@@ -0,0 +1,178 @@
+"""
+Uploads a game's replay data to the live replay server while it's recorded.
+
+Nothing here waits on the network: the connection is made in the background
+and retried with a growing delay when it fails or drops. Replay data waits in
+a bounded buffer until the socket can take it, and only a little of it at a
+time is handed to the socket so that the buffer, not Qt's, is what fills up
+while the server is slow. When the buffer is full the oldest data is dropped
+and counted.
+
+FA starts the stream with a "P/<game>/<name>" posting header ending in a 0
+byte. It's kept aside and sent first on every connection, so the server knows
+what a resumed stream belongs to.
+"""
+import collections
+import logging
+
+from PyQt4 import QtCore, QtNetwork
+
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+# Replay data kept while the server can't take it
+BUFFER_SIZE = int(Settings.get('BUFFER_SIZE', 'ONLINE_REPLAY_SERVER'))
+
+# Most replay data handed to the socket before it's been written out
+SOCKET_HIGH_WATER = 256 * 1024
+
+# Milliseconds before the first reconnect, doubled after every failure up to RETRY_MAX_DELAY
+RETRY_DELAY = 1000
+RETRY_MAX_DELAY = 30000
+
+# Milliseconds finish waits for the rest of the replay to be sent
+FLUSH_TIMEOUT = int(Settings.get('FLUSH_TIMEOUT', 'ONLINE_REPLAY_SERVER'))
+
+
+class ReplayUploader(QtCore.QObject):
+    """
+    Sends what's written to it to the live replay server at host:port. Call
+    finish at the end of the game and wait for finished.
+    """
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, host, port, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.host = host
+        self.port = port
+
+        self.header = None
+        self.buffer = collections.deque()
+        self.buffered = 0
+        # Bytes handed to the socket, and dropped from the buffer or lost with a connection
+        self.sent = 0
+        self.dropped = 0
+
+        self.closing = False
+        self.done = False
+        self.headerSent = False
+        self.delay = RETRY_DELAY
+
+        self.socket = QtNetwork.QTcpSocket(self)
+        self.socket.connected.connect(self._connected)
+        self.socket.disconnected.connect(self._lost)
+        self.socket.error.connect(self._lost)
+        self.socket.bytesWritten.connect(self._pump)
+
+        self.retryTimer = QtCore.QTimer(self)
+        self.retryTimer.setSingleShot(True)
+        self.retryTimer.timeout.connect(self._connect)
+        self.flushTimer = QtCore.QTimer(self)
+        self.flushTimer.setSingleShot(True)
+        self.flushTimer.timeout.connect(self._giveUp)
+
+        self._connect()
+
+    def isConnected(self):
+        return self.socket.state() == QtNetwork.QAbstractSocket.ConnectedState
+
+    def write(self, data):
+        if self.done or not data:
+            return
+        if self.header is None:
+            if data.startswith("P/") and "\0" in data:
+                end = data.index("\0") + 1
+                self.header, data = data[:end], data[end:]
+            else:
+                self.header = ""
+        if not data:
+            return
+
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered > BUFFER_SIZE:
+            dropped = 0
+            while self.buffered > BUFFER_SIZE:
+                old = self.buffer.popleft()
+                self.buffered -= len(old)
+                dropped += len(old)
+            if not self.dropped:
+                logger.warn("Live replay buffer full, dropping the oldest replay data")
+            self.dropped += dropped
+        self._pump()
+
+    def finish(self):
+        '''
+        Sends the rest of the replay data and closes the connection. finished
+        is emitted once that's done, or after FLUSH_TIMEOUT.
+        '''
+        if self.closing or self.done:
+            return
+        self.closing = True
+        self.flushTimer.start(FLUSH_TIMEOUT)
+        if not self.buffer and not self.isConnected():
+            self._end()
+        else:
+            self._pump()
+
+    @QtCore.pyqtSlot()
+    def _connect(self):
+        self.socket.abort()
+        self.headerSent = False
+        self.socket.connectToHost(self.host, self.port)
+
+    @QtCore.pyqtSlot()
+    def _connected(self):
+        logger.info("Connected to live replay server %s:%s", self.host, self.port)
+        self.delay = RETRY_DELAY
+        self._pump()
+
+    def _pump(self, *args):
+        if self.done or not self.isConnected():
+            return
+        if self.header and not self.headerSent:
+            self.socket.write(self.header)
+            self.headerSent = True
+        while self.buffer and self.socket.bytesToWrite() < SOCKET_HIGH_WATER:
+            data = self.buffer.popleft()
+            self.buffered -= len(data)
+            self.socket.write(data)
+            self.sent += len(data)
+        if self.closing and not self.buffer and not self.socket.bytesToWrite():
+            self._end()
+
+    def _lost(self, *args):
+        if self.done or self.retryTimer.isActive():
+            return
+        lost = self.socket.bytesToWrite()
+        self.dropped += lost
+        self.sent -= min(lost, self.sent)
+        if self.closing and not self.buffer and not lost:
+            self._end()
+            return
+        logger.warn("No connection to live replay server (%s), retrying in %i ms", self.socket.errorString(),
+                    self.delay)
+        self.retryTimer.start(self.delay)
+        self.delay = min(self.delay * 2, RETRY_MAX_DELAY)
+
+    @QtCore.pyqtSlot()
+    def _giveUp(self):
+        logger.warn("Live replay server didn't take the rest of the replay in time")
+        self.dropped += self.buffered + self.socket.bytesToWrite()
+        self.buffer.clear()
+        self.buffered = 0
+        self._end()
+
+    def _end(self):
+        self.done = True
+        self.retryTimer.stop()
+        self.flushTimer.stop()
+        if self.isConnected():
+            self.socket.disconnectFromHost()
+        else:
+            self.socket.abort()
+        if self.dropped:
+            logger.warn("%i bytes of replay data didn't make it to the live replay server", self.dropped)
+        logger.info("Uploaded %i bytes of replay data", self.sent)
+        self.finished.emit()
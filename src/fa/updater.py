@@ -12,18 +12,16 @@ patched, and all required files for a given mod are installed
 """
 import os
 import time
-import shutil
 from types import FloatType, IntType, ListType
 import logging
-import urllib2
-import sys
-import tempfile
 import json
 
 from PyQt4 import QtGui, QtCore, QtNetwork
 
 import util
 import modvault
+from config import Settings
+from fa.download import DownloadQueue
 
 
 logger = logging.getLogger(__name__)
@@ -94,7 +92,13 @@ class UpdaterTimeout(StandardError):
 class Updater(QtCore.QObject):
     """
     This is the class that does the actual installation work.
+
+    All file requests of a file group are sent at once, the server's answers are handled as they come in, and
+    the files it sends links to are downloaded by a DownloadQueue. The waits in between run an event loop that
+    wakes up whenever something changed.
     """
+    changed = QtCore.pyqtSignal()
+
     # Network configuration
     SOCKET  = 9001
     HOST    = "lobby.faforever.com"
@@ -116,7 +120,10 @@ class Updater(QtCore.QObject):
         """
         QtCore.QObject.__init__(self, *args, **kwargs)
 
-        self.filesToUpdate = []
+        # Files of the current group the server hasn't answered for or that are still downloading,
+        # None until it sent the list
+        self.filesToUpdate = None
+        self.filesTotal = 0
 
         self.lastData = time.time()
 
@@ -150,6 +157,12 @@ class Updater(QtCore.QObject):
 
         self.bytesToSend = 0
 
+        self.fetches = DownloadQueue(int(Settings.get('PARALLEL', 'UPDATER')),
+                                     int(Settings.get('DOWNLOAD_SEGMENTS', 'UPDATER')), self)
+        self.fetches.fetched.connect(self.fileFetched)
+        self.fetches.failed.connect(self.fileFetchFailed)
+        self.fetches.progress.connect(self.fetchProgress)
+
 
     def run(self, *args, **kwargs):
         clearLog()
@@ -187,66 +200,6 @@ class Updater(QtCore.QObject):
         log("Update finished at " + timestamp())
         return self.result
 
-    def fetchFile(self, url, toFile):
-        try:
-            progress = QtGui.QProgressDialog()
-            progress.setCancelButtonText("Cancel")
-            progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
-            progress.setAutoClose(True)
-            progress.setAutoReset(False)
-
-            req = urllib2.Request(url, headers={'User-Agent': "FAF Client"})
-            downloadedfile = urllib2.urlopen(req)
-            meta = downloadedfile.info()
-
-            #Fix for #241, sometimes the server sends an error and no content-length.
-            file_size = int(meta.getheaders("Content-Length")[0])
-            progress.setMinimum(0)
-            progress.setMaximum(file_size)
-            progress.setModal(1)
-            progress.setWindowTitle("Downloading Update")
-            label = QtGui.QLabel()
-            label.setOpenExternalLinks(True)
-            progress.setLabel(label)
-            progress.setLabelText('Downloading FA file : <a href="' + url + '">' + url + '</a><br/>File size: ' + str(
-                int(file_size / 1024 / 1024)) + ' MiB')
-            progress.show()
-
-            #Download the file as a series of up to 4 KiB chunks, then uncompress it.
-
-            output = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
-
-            file_size_dl = 0
-            block_sz = 4096
-
-            while progress.isVisible():
-                QtGui.QApplication.processEvents()
-                read_buffer = downloadedfile.read(block_sz)
-                if not read_buffer:
-                    break
-                file_size_dl += len(read_buffer)
-                output.write(read_buffer)
-                progress.setValue(file_size_dl)
-
-            output.flush()
-            os.fsync(output.fileno())
-            output.close()
-
-            shutil.move(output.name, toFile)
-
-            if (progress.value() == file_size) or progress.value() == -1:
-                logger.debug("File downloaded successfully.")
-                return True
-            else:
-                QtGui.QMessageBox.information(None, "Aborted", "Download not complete.")
-                logger.warn("File download not complete.")
-                return False
-        except:
-            logger.error("Updater error: ", exc_info=sys.exc_info())
-            QtGui.QMessageBox.information(None, "Download Failed",
-                                          "The file wasn't properly sent by the server. <br/><b>Try again later.</b>")
-            return False
-
 
     def updateFiles(self, destination, filegroup):
         """
@@ -259,17 +212,17 @@ class Updater(QtCore.QObject):
         self.progress.setLabelText("Updating files: " + filegroup)
         self.destination = destination
 
+        self.filesToUpdate = None
         self.writeToServer("GET_FILES_TO_UPDATE", filegroup)
         self.waitForFileList()
-
-        #Ensure our list is unique
-        self.filesToUpdate = list(set(self.filesToUpdate))
+        self.filesTotal = len(self.filesToUpdate)
 
         targetdir = os.path.join(util.APPDATA_DIR, destination)
         if not os.path.exists(targetdir):
             os.makedirs(targetdir)
 
-        for fileToUpdate in self.filesToUpdate:
+        # Ask for every file right away, the answers are handled as they arrive
+        for fileToUpdate in sorted(self.filesToUpdate):
             md5File = util.md5(os.path.join(util.APPDATA_DIR, destination, fileToUpdate))
             if md5File == None:
                 if self.version:
@@ -295,9 +248,39 @@ class Updater(QtCore.QObject):
         self.waitUntilFilesAreUpdated()
 
 
+    def waitFor(self, done, what):
+        """
+        Runs an event loop until done() returns True. Raises if the operation fails, times out or is cancelled
+        in the meantime. The loop wakes up whenever the server or a download changed something, and every second
+        to check for the timeout.
+        """
+        loop = QtCore.QEventLoop()
+        timer = QtCore.QTimer()
+        timer.timeout.connect(loop.quit)
+        self.changed.connect(loop.quit)
+        self.progress.canceled.connect(loop.quit)
+        timer.start(1000)
+        try:
+            while not done():
+                if self.progress.wasCanceled():
+                    raise UpdaterCancellation("Operation aborted while waiting for %s." % what)
+
+                if self.result != self.RESULT_NONE:
+                    raise UpdaterFailure("Operation failed while waiting for %s." % what)
+
+                if time.time() - self.lastData > self.TIMEOUT:
+                    raise UpdaterTimeout("Operation timed out while waiting for %s." % what)
+
+                loop.exec_()
+        finally:
+            timer.stop()
+            self.changed.disconnect(loop.quit)
+            self.progress.canceled.disconnect(loop.quit)
+
+
     def waitForSimModPath(self):
         """
-        A simple loop that waits until the server has transmitted a sim mod path.
+        Waits until the server has transmitted a sim mod path.
         """
         self.lastData = time.time()
 
@@ -305,22 +288,12 @@ class Updater(QtCore.QObject):
         self.progress.setMinimum(0)
         self.progress.setMaximum(0)
 
-        while self.modpath == None:
-            if self.progress.wasCanceled():
-                raise UpdaterCancellation("Operation aborted while waiting for sim mod path.")
-
-            if self.result != self.RESULT_NONE:
-                raise UpdaterFailure("Operation failed while waiting for sim mod path.")
-
-            if time.time() - self.lastData > self.TIMEOUT:
-                raise UpdaterTimeout("Operation timed out while waiting for sim mod path.")
-
-            QtGui.QApplication.processEvents()
+        self.waitFor(lambda: self.modpath is not None, "sim mod path")
 
 
     def waitForFileList(self):
         """
-        A simple loop that waits until the server has transmitted a file list.
+        Waits until the server has transmitted a file list.
         """
         self.lastData = time.time()
 
@@ -328,44 +301,30 @@ class Updater(QtCore.QObject):
         self.progress.setMinimum(0)
         self.progress.setMaximum(0)
 
-        while len(self.filesToUpdate) == 0:
-            if self.progress.wasCanceled():
-                raise UpdaterCancellation("Operation aborted while waiting for file list.")
+        self.waitFor(lambda: self.filesToUpdate is not None, "file list")
 
-            if self.result != self.RESULT_NONE:
-                raise UpdaterFailure("Operation failed while waiting for file list.")
-
-            if time.time() - self.lastData > self.TIMEOUT:
-                raise UpdaterTimeout("Operation timed out while waiting for file list.")
-
-            QtGui.QApplication.processEvents()
-
-        log("Files to update: [" + ', '.join(self.filesToUpdate) + "]")
+        log("Files to update: [" + ', '.join(sorted(self.filesToUpdate)) + "]")
 
 
     def waitUntilFilesAreUpdated(self):
         """
-        A simple loop that updates the progress bar while the server sends actual file data
+        Waits until the server has answered for every file and all downloads are done
         """
         self.lastData = time.time()
+        self.showProgress()
 
-        self.progress.setValue(0)
-        self.progress.setMinimum(0)
-        self.progress.setMaximum(0)
+        self.waitFor(lambda: not self.filesToUpdate, "data")
 
-        while len(self.filesToUpdate) > 0:
-            if self.progress.wasCanceled():
-                raise UpdaterCancellation("Operation aborted while waiting for data.")
-
-            if (self.result != self.RESULT_NONE):
-                raise UpdaterFailure("Operation failed while waiting for data.")
-
-            if (time.time() - self.lastData > self.TIMEOUT):
-                raise UpdaterTimeout("Connection timed out while waiting for data.")
+        log("Updates applied successfully.")
 
-            QtGui.QApplication.processEvents()
 
-        log("Updates applied successfully.")
+    def showProgress(self):
+        """
+        Shows how many files of the current group are done.
+        """
+        self.progress.setMinimum(0)
+        self.progress.setMaximum(self.filesTotal)
+        self.progress.setValue(self.filesTotal - len(self.filesToUpdate or ()))
 
 
     def doUpdate(self):
@@ -405,6 +364,7 @@ class Updater(QtCore.QObject):
         else:
             self.result = self.RESULT_SUCCESS
         finally:
+            self.fetches.abort()
             self.updateSocket.close()
 
         #Hide progress dialog if it's still showing.
@@ -443,6 +403,7 @@ class Updater(QtCore.QObject):
             log("The following error occurred: %s." % self.updateSocket.errorString())
 
         self.result = self.RESULT_FAILURE
+        self.changed.emit()
 
 
 
@@ -465,9 +426,7 @@ class Updater(QtCore.QObject):
             return
 
         elif action == "LIST_FILES_TO_UP":
-            self.filesToUpdate = eval(str(stream.readQString()))
-            if (self.filesToUpdate == None):
-                self.filesToUpdate = []
+            self.filesToUpdate = set(eval(str(stream.readQString())) or [])
             return
 
         elif action == "UNKNOWN_APP":
@@ -503,13 +462,13 @@ class Updater(QtCore.QObject):
             response = stream.readQString()
             log("file : " + response)
             log("%s is up to date." % response)
-            self.filesToUpdate.remove(str(response))
+            self.filesToUpdate.discard(str(response))
             return
 
         elif action == "ERROR_FILE":
             response = stream.readQString()
             log("ERROR: File not found on server : %s." % response)
-            self.filesToUpdate.remove(str(response))
+            self.filesToUpdate.discard(str(response))
             self.result = self.RESULT_FAILURE
             return
 
@@ -522,8 +481,12 @@ class Updater(QtCore.QObject):
             path = util.LUA_DIR if path == "bin" else path
 
             toFile = os.path.join(util.APPDATA_DIR, str(path), str(fileToCopy))
-            self.fetchFile(url, toFile)
-            self.filesToUpdate.remove(str(fileToCopy))
+            if not os.path.exists(os.path.dirname(toFile)):
+                os.makedirs(os.path.dirname(toFile))
+
+            # Done once the download is, the other answers keep being handled meanwhile
+            log("Downloading %s from %s" % (fileToCopy, url))
+            self.fetches.add(str(fileToCopy), str(url), toFile)
 
         elif action == "SEND_FILE":
             path = stream.readQString()
@@ -547,7 +510,7 @@ class Updater(QtCore.QObject):
                 fileToCopy, path))  #This may or may not be desirable behavior
 
             log("%s is copied in %s." % (fileToCopy, path))
-            self.filesToUpdate.remove(str(fileToCopy))
+            self.filesToUpdate.discard(str(fileToCopy))
         else:
             log("Unexpected server command received: " + action)
             self.result = self.RESULT_FAILURE
@@ -565,8 +528,6 @@ class Updater(QtCore.QObject):
 
             # Nothing was read yet, commence a new block.
             if self.blockSize == 0:
-                self.progress.reset()
-
                 #wait for enough bytes to piece together block size information
                 if self.updateSocket.bytesAvailable() < 4:
                     return
@@ -577,26 +538,12 @@ class Updater(QtCore.QObject):
                     self.progress.setLabelText("Downloading...")
                     self.progress.setValue(0)
                     self.progress.setMaximum(self.blockSize)
-                else:
-                    self.progress.setValue(0)
-                    self.progress.setMinimum(0)
-                    self.progress.setMaximum(0)
-
-            # Update our Gui at least once before proceeding (we might be receiving a huge file and this is not the first time we get here)   
-            self.lastData = time.time()
-            QtGui.QApplication.processEvents()
 
-            #We have an incoming block, wait for enough bytes to accumulate                    
+            #We have an incoming block, wait for enough bytes to accumulate
             if self.updateSocket.bytesAvailable() < self.blockSize:
-                self.progress.setValue(self.updateSocket.bytesAvailable())
-                return  #until later, this slot is reentrant
-
-            #Enough bytes accumulated. Carry on.
-            self.progress.setValue(self.blockSize)
-
-            # Update our Gui at least once before proceeding (we might have to write a big file)
-            self.lastData = time.time()
-            QtGui.QApplication.processEvents()
+                if (self.blockSize > 65536):
+                    self.progress.setValue(self.updateSocket.bytesAvailable())
+                return  #until the rest arrives
 
             # Find out what the server just sent us, and process it.
             action = ins.readQString()
@@ -605,9 +552,9 @@ class Updater(QtCore.QObject):
             # Prepare to read the next block
             self.blockSize = 0
 
-            self.progress.setValue(0)
-            self.progress.setMinimum(0)
-            self.progress.setMaximum(0)
+            if self.filesToUpdate is not None:
+                self.showProgress()
+            self.changed.emit()
 
 
     def writeToServer(self, action, *args, **kw):
@@ -651,6 +598,34 @@ class Updater(QtCore.QObject):
         #This isn't necessarily an error so we won't change self.result here.
         log("TCP Error " + self.updateSocket.errorString())
         self.result = self.RESULT_FAILURE
+        self.changed.emit()
+
+
+    @QtCore.pyqtSlot(str)
+    def fileFetched(self, name):
+        log("%s is downloaded." % name)
+        self.lastData = time.time()
+        if self.filesToUpdate is not None:
+            self.filesToUpdate.discard(str(name))
+            self.showProgress()
+        self.changed.emit()
+
+
+    @QtCore.pyqtSlot(str, str)
+    def fileFetchFailed(self, name, error):
+        log("ERROR: Download of %s failed: %s" % (name, error))
+        if self.filesToUpdate is not None:
+            self.filesToUpdate.discard(str(name))
+        # Downloads aborted after the update ended report in late
+        if self.result == self.RESULT_NONE:
+            self.result = self.RESULT_FAILURE
+        self.changed.emit()
+
+
+    @QtCore.pyqtSlot(int, int)
+    def fetchProgress(self, done, total):
+        # Downloads count as data from the server, a big file mustn't time the update out
+        self.lastData = time.time()
 
 
 def timestamp():
@@ -57,6 +57,9 @@ class GamesWidget(FormClass, BaseClass):
 
         self.gameList.setItemDelegate(GameItemDelegate(self))
         self.gameList.itemDoubleClicked.connect(self.gameDoubleClicked)
+        self.gameList.currentItemChanged.connect(self.gameFocused)
+        self.gameList.itemEntered.connect(self.gameFocused)
+        self.gameList.setMouseTracking(True)
         self.gameList.sortBy = 0 # Default Sorting is By Players count
 
         self.sortGamesComboBox.addItems(['By Players', 'By Game Quality', 'By avg. Player Rating'])
@@ -205,6 +208,14 @@ class GamesWidget(FormClass, BaseClass):
         else:
             self.stopSearchRanked()
 
+    @QtCore.pyqtSlot(QtGui.QListWidgetItem)
+    def gameFocused(self, item):
+        '''
+        Slot that makes the map of a hovered or selected game the next one to be prefetched
+        '''
+        if item and item.state == "open":
+            fa.maps.prefetcher().focus(item.mapname)
+
     @QtCore.pyqtSlot(QtGui.QListWidgetItem)
     def gameDoubleClicked(self, item):
         '''
@@ -8,6 +8,7 @@ from games.moditem import mod_invisible, mods
 
 import client
 import copy
+import functools
 
 class GameItemDelegate(QtGui.QStyledItemDelegate):
     
@@ -160,6 +161,10 @@ class GameItem(QtGui.QListWidgetItem):
         else:
             self.client.forwardLocalBroadcast(self.host, 'is hosting ' + self.moddisplayname + ' <a style="color:' + self.client.getColor("url") + '" href="' + url.toString() + '">' + self.title + '</a> (on "' + self.mapdisplayname + '")')
 
+    def previewReady(self, mapname, icon):
+        if icon and mapname == self.mapname and not self.password_protected:
+            self.setIcon(icon)
+
     def update(self, message, client):
         '''
         Updates this item from the message dictionary supplied
@@ -195,6 +200,8 @@ class GameItem(QtGui.QListWidgetItem):
 
         # Just jump out if we've left the game, but tell the client that all players need their states updated
         if self.state == "closed":
+            if self.mapname:
+                maps.prefetcher().cancel(self.mapname, self.uid)
             client.usersUpdated.emit(self.players)
             return
 
@@ -223,6 +230,8 @@ class GameItem(QtGui.QListWidgetItem):
 
         # Map preview code
         if self.mapname != message['mapname']:
+            if self.mapname:
+                maps.prefetcher().cancel(self.mapname, self.uid)
             self.mapname = message['mapname']
             self.mapdisplayname = maps.getDisplayName(self.mapname)
             refresh_icon = True
@@ -234,13 +243,17 @@ class GameItem(QtGui.QListWidgetItem):
             if self.password_protected:
                 icon = util.icon("games/private_game.png")
             else:            
-                icon = maps.preview(self.mapname)
-                if not icon:
-                    self.client.downloader.downloadMap(self.mapname, self)
-                    icon = util.icon("games/unknown_map.png")
+                icon = maps.previewService().request(self.mapname, functools.partial(self.previewReady, self.mapname), force=True)
                              
             self.setIcon(icon)
 
+        # Get the map before anyone tries to join
+        if self.state == "open":
+            priority = maps.PRIORITY_FRIEND if client.isFriend(self.host) else maps.PRIORITY_NORMAL
+            maps.prefetcher().request(self.mapname, self.uid, priority)
+        else:
+            maps.prefetcher().cancel(self.mapname, self.uid)
+
         # Used to differentiate between newly added / removed and previously present players            
         oldplayers = set(self.players)
 
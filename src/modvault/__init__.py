@@ -100,7 +100,16 @@ class ModVault(FormClass, BaseClass):
         self.searchString = ""
 
         self.mods = {}
-        self.uids = [mod.uid for mod in getInstalledMods()]
+        self.uids = modIndex # supports 'uid in self.uids', mods known from the last run are in right away
+        self.scanner = ModScanner(self)
+        self.scanner.modFound.connect(self.modInstalled)
+        self.scanner.finished.connect(self.updateVisibilities)
+        self.scanner.scan()
+
+    @QtCore.pyqtSlot(object)
+    def modInstalled(self, mod): #called by the scanner for every installed mod
+        if mod.uid in self.mods:
+            self.mods[mod.uid].updateVisibility()
 
     @QtCore.pyqtSlot(dict)
     def modInfo(self, message): #this is called when the database has send a mod to us
@@ -212,14 +221,13 @@ class ModVault(FormClass, BaseClass):
     def downloadMod(self, mod):
         if downloadMod(mod):
             self.client.send(dict(command="modvault",type="download", uid=mod.uid))
-            self.uids = [mod.uid for mod in getInstalledMods()]
+            modIndex.refresh()
             self.updateVisibilities()
             return True
         else: return False
 
     def removeMod(self, mod):
         if removeMod(mod):
-            self.uids = [m.uid for m in installedMods]
             mod.updateVisibility()
     
         
@@ -333,7 +341,7 @@ class ModItem(QtGui.QListWidgetItem):
         else:
             img = getIcon(os.path.basename(urllib2.unquote(self.thumbstr)))
             if img:
-                self.setIcon(util.icon(img, False))
+                self.setIcon(util.cachedIcon(img))
             else:
                 self.parent.client.downloader.downloadModPreview(self.thumbstr, self)
         self.updateVisibility()
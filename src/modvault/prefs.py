@@ -0,0 +1,113 @@
+"""
+Editing single tables of game.prefs, like active_mods, without parsing it.
+
+game.prefs is a few hundred KB of lua written by the game. Only the span of
+the table being edited is scanned, and the file is replaced atomically so the
+game never sees it half written.
+"""
+import os
+import re
+import shutil
+import tempfile
+
+from util import replaceFile
+
+# What a table scan has to step over: comments and strings may hold braces
+_SCAN = re.compile(r"""
+      --\[(?P<ceq>=*)\[.*?\](?P=ceq)\]
+    | --[^\n]*
+    | "(?:[^"\\\n]|\\.)*"
+    | '(?:[^'\\\n]|\\.)*'
+    | \[(?P<leq>=*)\[.*?\](?P=leq)\]
+    | (?P<brace>[{}])
+""", re.S | re.X)
+
+_ENABLED = re.compile(r"""\[\s*(["'])(.*?)\1\s*\]\s*=\s*true\b""")
+
+
+def findTable(data, name):
+    '''
+    Returns the (start, end) span of the first "name = { ... }" starting a
+    line of the lua source data, or None. Only the table itself is scanned
+    for its end.
+    '''
+    match = re.search(r"^[ \t]*(%s\s*=\s*\{)" % re.escape(name), data, re.M)
+    if match is None:
+        return None
+    depth = 1
+    for token in _SCAN.finditer(data, match.end()):
+        brace = token.group("brace")
+        if brace == "{":
+            depth += 1
+        elif brace == "}":
+            depth -= 1
+            if depth == 0:
+                return match.start(1), token.end()
+    return None
+
+
+def enabledKeys(table):
+    '''
+    Returns the keys set to true in the source of a table like active_mods,
+    in order.
+    '''
+    return [key for _, key in _ENABLED.findall(table)]
+
+
+def readEnabledKeys(filename, name):
+    '''
+    Returns the keys set to true in the table name of the lua file filename.
+    '''
+    with open(filename, "rb") as f:
+        data = f.read()
+    span = findTable(data, name)
+    if span is None:
+        return []
+    return enabledKeys(data[span[0]:span[1]])
+
+
+def formatTable(name, keys, newline="\n"):
+    '''
+    Returns the source of a table setting the given keys to true.
+    '''
+    return name + " = {" + newline + "".join("['%s'] = true,%s" % (key, newline) for key in keys) + "}"
+
+
+def writeAtomically(filename, data):
+    '''
+    Writes data to filename through a temporary file next to it, so that
+    readers see either the old or the new contents.
+    '''
+    folder = os.path.dirname(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(filename) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp)
+        replaceFile(temp, filename)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def setEnabledKeys(filename, name, keys):
+    '''
+    Makes the table name in the lua file filename set exactly the given keys
+    to true, replacing just that table or appending it. Returns False if the
+    file already did, without writing it.
+    '''
+    with open(filename, "rb") as f:
+        data = f.read()
+    span = findTable(data, name)
+    if span is not None and set(enabledKeys(data[span[0]:span[1]])) == set(keys):
+        return False
+    newline = "\r\n" if "\r\n" in data else "\n"
+    table = formatTable(name, keys, newline)
+    if span is None:
+        data = data + newline + table
+    else:
+        data = data[:span[0]] + table + data[span[1]:]
+    writeAtomically(filename, data)
+    return True
@@ -3,14 +3,19 @@ import sys
 import urllib2
 import re
 import shutil
+import threading
+import cPickle
+from multiprocessing.pool import ThreadPool
 
 from PyQt4 import QtCore, QtGui
 
+from config import Settings
 from util import strtodate, datetostr, now, PREFSFILENAME
 import util
 import logging
 from vault import luaparser
 import warnings
+import prefs
 
 import cStringIO
 import zipfile
@@ -60,24 +65,213 @@ def getAllModFolders(): #returns a list of names of installed mods
             mods = os.listdir(MODFOLDER)
         return mods
     
-def getInstalledMods():
-    installedMods[:] = []
-    for f in getAllModFolders():
-        m = None
+def _readMod(f):
+    '''
+    Returns f and the ModInfo of the mod folder or zip f in MODFOLDER, or None.
+    '''
+    try:
         if os.path.isdir(os.path.join(MODFOLDER,f)):
+            return f, getModInfoFromFolder(f)
+        return f, getModInfoFromZip(f)
+    except Exception, e:
+        logger.debug("Couldn't read mod %s: %s" % (f, e))
+        return f, None
+
+def _readMods(folders, parallel=None):
+    '''
+    Yields (folder, ModInfo or None) for the given mod folders and zips as
+    soon as each is read, in no particular order. Up to parallel are read at
+    a time.
+    '''
+    if not folders:
+        return
+    if parallel is None:
+        parallel = int(Settings.get('PARALLEL', 'MOD_SCAN'))
+    pool = ThreadPool(max(1, min(parallel, len(folders))))
+    try:
+        for r in pool.imap_unordered(_readMod, folders):
+            yield r
+    finally:
+        pool.terminate()
+        util.luaCache.save()
+
+def _modStamp(f):
+    '''
+    Returns the size and mtime of the mod_info.lua of the mod folder f, or of
+    the mod zip f. None if there's no such file.
+    '''
+    path = os.path.join(MODFOLDER, f)
+    if os.path.isdir(path):
+        path = os.path.join(path, "mod_info.lua")
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime
+
+class ModIndex(object):
+    '''
+    The installed mods by uid, kept in a file across runs so they're known
+    right away at startup.
+
+    scan reconciles it with MODFOLDER. It only reads the mods whose folder or
+    zip is new, or whose mod_info.lua or zip changed size or mtime, and it
+    drops the mods that are gone. Folders and zips that aren't valid mods are
+    remembered as such until they change.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self._entries = None # folder or zip -> (stamp, ModInfo or None)
+        self._byUid = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._entries is not None:
+                return
+            entries = {}
+            if os.path.exists(self.filename):
+                try:
+                    with open(self.filename, "rb") as f:
+                        for folder, (stamp, info) in cPickle.load(f).iteritems():
+                            m = None
+                            if info is not None:
+                                m = ModInfo(**info)
+                                m.setFolder(folder)
+                                m.update()
+                            entries[folder] = stamp, m
+                except Exception, e:
+                    logger.warn("Couldn't load the mod index from %s: %s" % (self.filename, e))
+                    entries = {}
+            self._entries = entries
+            self._reindex()
+
+    def _reindex(self):
+        self._byUid = dict((m.uid, m) for _, m in self._entries.itervalues() if m)
+
+    def scan(self, parallel=None):
+        '''
+        Reconciles the index with MODFOLDER, yielding the ModInfo of every
+        installed mod: the unchanged ones right away, the others as soon as
+        they're read.
+        '''
+        self._load()
+        stamps = dict((f, _modStamp(f)) for f in getAllModFolders())
+        with self._lock:
+            for f in self._entries.keys():
+                if stamps.get(f) is None:
+                    del self._entries[f]
+                    self._dirty = True
+            self._reindex()
+            # A scan running alongside may have added folders this one didn't list
+            unchanged = [m for f, (stamp, m) in self._entries.iteritems() if stamp == stamps.get(f)]
+            changed = [f for f, stamp in stamps.iteritems() if stamp is not None
+                       and (f not in self._entries or self._entries[f][0] != stamp)]
+        for m in unchanged:
+            if m:
+                yield m
+        for f, m in _readMods(changed, parallel):
+            with self._lock:
+                self._entries[f] = stamps[f], m
+                self._dirty = True
+                self._reindex()
+            if m:
+                yield m
+        self.save()
+
+    def refresh(self, parallel=None):
+        for _ in self.scan(parallel):
+            pass
+
+    def forget(self, folder):
+        self._load()
+        with self._lock:
+            if self._entries.pop(folder, None) is not None:
+                self._dirty = True
+                self._reindex()
+
+    def is_installed(self, uid):
+        if self._entries is None:
+            self._load()
+        return uid in self._byUid
+
+    __contains__ = is_installed
+
+    def get(self, uid):
+        if self._entries is None:
+            self._load()
+        return self._byUid.get(uid)
+
+    def mods(self):
+        if self._entries is None:
+            self._load()
+        return self._byUid.values()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict((f, (stamp, m.to_dict() if m else None)) for f, (stamp, m) in self._entries.iteritems())
+            temp = self.filename + ".tmp"
             try:
-                m = getModInfoFromFolder(f)
-            except:
-                continue
-        else:
-            try:
-                m = getModInfoFromZip(f)
-            except:
-                continue
-        if m:
-            installedMods.append(m)
+                with open(temp, "wb") as f:
+                    cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(temp, self.filename)
+                self._dirty = False
+            except (IOError, OSError), e:
+                logger.warn("Couldn't save the mod index to %s: %s" % (self.filename, e))
+
+modIndex = ModIndex(os.path.join(util.CACHE_DIR, "mod_index"))
+
+def iterInstalledMods(parallel=None):
+    '''
+    Yields the ModInfo of every installed mod as soon as it's known, in no
+    particular order. See ModIndex.scan.
+    '''
+    return modIndex.scan(parallel)
+
+def _setInstalledMods(mods):
+    mods.sort(key=lambda m: m.localfolder.lower())
+    installedMods[:] = mods
     logger.debug("getting installed mods. Count: %d" % len(installedMods))
+
+def getInstalledMods():
+    _setInstalledMods(list(iterInstalledMods()))
     return installedMods
+
+class ModScanner(QtCore.QObject):
+    '''
+    Reads the installed mods on a worker thread, so the UI can show them as
+    they come in. modFound is emitted for every mod as soon as it's read,
+    finished once installedMods is up to date.
+    '''
+    modFound = QtCore.pyqtSignal(object)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.thread = None
+
+    def isRunning(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def scan(self):
+        if self.isRunning():
+            return
+        self.thread = threading.Thread(target=self.run, name="ModScanner")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        mods = []
+        for m in iterInstalledMods():
+            mods.append(m)
+            self.modFound.emit(m)
+        _setInstalledMods(mods)
+        self.finished.emit()
         
 def modToFilename(mod):
     return mod.absfolder
@@ -101,8 +295,8 @@ def fullPathToIcon(path):
     return p[len(MODFOLDER)-5:].replace('\\','/')
 
 def getIcon(name):
-    img = os.path.join(util.CACHE_DIR, name)
-    if os.path.isfile(img):
+    img = util.previewCache.file(name)
+    if img:
         logger.debug("Using cached preview image for: " + name)
         return img
     return None
@@ -130,29 +324,20 @@ def getModInfo(modinfofile):
 def parseModInfo(folder):
     if not isModFolderValid(folder):
         return None
-    modinfofile = luaparser.luaParser(os.path.join(folder,"mod_info.lua"))
+    modinfofile = luaparser.luaParser(os.path.join(folder,"mod_info.lua"), cache=util.luaCache)
     return getModInfo(modinfofile)
 
-modCache = {}
-
 def getModInfoFromZip(zfile):
     '''get the mod info from a zip file'''
-    if zfile in modCache:
-        return modCache[zfile]
-    
     r = None
     if zipfile.is_zipfile(os.path.join(MODFOLDER,zfile)) :
-        zip = zipfile.ZipFile(os.path.join(MODFOLDER,zfile), "r", zipfile.ZIP_DEFLATED)
-        if zip.testzip() == None :
-            for member in zip.namelist() :
-                filename = os.path.basename(member)
-                if not filename:
-                    continue
-                if filename == "mod_info.lua":
-                    modinfofile = luaparser.luaParser("mod_info.lua")
-                    modinfofile.iszip = True
-                    modinfofile.zip = zip
-                    r = getModInfo(modinfofile)
+        # Only mod_info.lua is read, so only its CRC is checked
+        with zipfile.ZipFile(os.path.join(MODFOLDER,zfile), "r") as zip:
+            if any(os.path.basename(member) == "mod_info.lua" for member in zip.namelist()):
+                modinfofile = luaparser.luaParser("mod_info.lua", cache=util.luaCache)
+                modinfofile.iszip = True
+                modinfofile.zip = zip
+                r = getModInfo(modinfofile)
     if r == None:
         logger.debug("mod_info.lua not found in zip file %s" % zfile)
         return None
@@ -161,16 +346,11 @@ def getModInfoFromZip(zfile):
         logger.debug("Error in parsing mod_info.lua in %s" % zfile)
         return None
     m = ModInfo(**info)
-    print zfile
     m.setFolder(zfile)
     m.update()
-    modCache[zfile] = m
     return m
 
 def getModInfoFromFolder(modfolder): # modfolder must be local to MODFOLDER
-    if modfolder in modCache:
-        return modCache[modfolder]
-
     r = parseModInfo(os.path.join(MODFOLDER,modfolder))
     if r == None:
         logger.debug("mod_info.lua not found in %s folder" % modfolder)
@@ -182,7 +362,6 @@ def getModInfoFromFolder(modfolder): # modfolder must be local to MODFOLDER
     m = ModInfo(**info)
     m.setFolder(modfolder)
     m.update()
-    modCache[modfolder] = m
     return m
 
 def getActiveMods(uimods=None): # returns a list of ModInfo's containing information of the mods
@@ -197,21 +376,14 @@ def getActiveMods(uimods=None): # returns a list of ModInfo's containing informa
             logger.info("No game.prefs file found")
             return []
         
-        l = luaparser.luaParser(PREFSFILENAME)
-        l.loweringKeys = False
-        modlist = l.parse({"active_mods":"active_mods"},{"active_mods":{}})["active_mods"]
-        if l.error:
-            logger.info("Error in reading the game.prefs file")
-            return []
-        uids = [uid for uid,b in modlist.items() if b == 'true']
+        uids = prefs.readEnabledKeys(PREFSFILENAME, "active_mods")
         #logger.debug("Active mods detected: %s" % str(uids))
         
-        allmods = []
-        for m in installedMods:
-            if ((uimods == True and m.ui_only) or (uimods == False and not m.ui_only) or uimods == None):
-                allmods.append(m)
-        active_mods = [m for m in allmods if m.uid in uids]
-        #logger.debug("Allmods uids: %s\n\nActive mods uids: %s\n" % (", ".join([mod.uid for mod in allmods]), ", ".join([mod.uid for mod in allmods])))
+        modIndex.refresh()
+        for uid in uids:
+            m = modIndex.get(uid)
+            if m and ((uimods == True and m.ui_only) or (uimods == False and not m.ui_only) or uimods == None):
+                active_mods.append(m)
         return active_mods
     except:
         return []
@@ -225,38 +397,19 @@ def setActiveMods(mods, keepuimods=True): #uimods works the same as in getActive
         False: Keep only the non-UI mods that were activated activated
         So set it True if you want to set gameplay mods, and False if you want to set UI mods.
     """
-    if keepuimods != None:
-        keepTheseMods = getActiveMods(keepuimods) # returns the active UI mods if True, the active non-ui mods if False
-    else:
-        keepTheseMods = []
-    allmods = keepTheseMods + mods
-    s = "active_mods = {\n"
-    for mod in allmods:
-        s += "['%s'] = true,\n" % str(mod.uid)
-    s += "}"
-
     try:
-        f = open(PREFSFILENAME, 'r')
-        data = f.read()
-    except:
-        logger.info("Couldn't read the game.prefs file")
+        uids = []
+        if keepuimods != None:
+            # the active UI mods if True, the active non-ui mods if False
+            uids = [mod.uid for mod in getActiveMods(keepuimods)]
+        for mod in mods:
+            if str(mod.uid) not in uids:
+                uids.append(str(mod.uid))
+        if not prefs.setEnabledKeys(PREFSFILENAME, "active_mods", uids):
+            logger.debug("Active mods in game.prefs are up to date")
+    except (IOError, OSError), e:
+        logger.info("Couldn't update the game.prefs file: %s" % e)
         return False
-    else:
-        f.close()
-
-    if re.search("active_mods\s*=\s*{.*?}", data, re.S):
-        data = re.sub("active_mods\s*=\s*{.*?}",s,data,1,re.S)
-    else:
-        data += "\n" + s
-
-    try:
-        f = open(PREFSFILENAME, 'w')
-        f.write(data)
-    except:
-        logger.info("Cound't write to the game.prefs file")
-        return False
-    else:
-        f.close()
 
     return True
 
@@ -400,18 +553,14 @@ def downloadMod(item): #most of this function is stolen from fa.maps.downloadMap
 
 def removeMod(mod):
     logger.debug("removing mod %s" % mod.name)
-    real = None
-    for m in getInstalledMods():
-        if m.uid == mod.uid:
-            real = m
-            break
-    else:
+    modIndex.refresh()
+    real = modIndex.get(mod.uid)
+    if real is None:
         logger.debug("Can't remove mod. Mod not found.")
         return False
     shutil.rmtree(real.absfolder)
-    if real.localfolder in modCache:
-        del modCache[real.localfolder]
-    installedMods.remove(real)
+    modIndex.forget(real.localfolder)
+    installedMods[:] = [m for m in installedMods if m.uid != real.uid]
     return True
     #we don't update the installed mods, because the operating system takes
     #some time registering the deleted folder.
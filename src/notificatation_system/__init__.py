@@ -76,9 +76,7 @@ class NotificationSystem():
                 self.dialogClosed()
                 return
 
-            preview = maps.preview(data['mapname'], pixmap=True)
-            if preview:
-                pixmap = preview.scaled(80, 80)
+            pixmap = maps.previewService().request(data['mapname'], force=True, pixmap=True).scaled(80, 80)
 
             #TODO: outsource as function?
             mod = None if 'featured_mod' not in data else data['featured_mod']
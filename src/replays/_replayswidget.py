@@ -5,12 +5,15 @@
 from PyQt4 import QtCore, QtGui, QtNetwork
 from PyQt4.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 from fa.replay import replay
+from fa.replayfile import ReplayFile
+from fa.replayheader import read_header
 import util
 import os
 import fa
 import time
 import client
 import json
+import functools
 
 import logging
 logger = logging.getLogger(__name__)
@@ -213,6 +216,10 @@ class ReplaysWidget(BaseClass, FormClass):
             for filename, metadata in cache_add.iteritems():
                 fh.write(filename + ":" + metadata)
 
+    def previewReady(self, item, icon):
+        if icon:
+            item.setIcon(0, icon)
+
     def updatemyTree(self):
         self.myTree.clear()
         
@@ -232,6 +239,16 @@ class ReplaysWidget(BaseClass, FormClass):
                 item.filename = os.path.join(util.REPLAY_DIR, infile)
                 item.setIcon(0, util.icon("replays/replay.png"))
                 item.setTextColor(0, QtGui.QColor(client.instance.getColor("default")))
+
+                # Old replays have no metadata, but their game header tells who played where
+                try:
+                    header = read_header(item.filename)
+                    mapname = os.path.basename(os.path.dirname(header.map_path))
+                    item.setToolTip(0, fa.maps.getDisplayName(mapname))
+                    item.setText(2, ", ".join(header.player_names))
+                    item.setToolTip(2, header.version)
+                except (IOError, ValueError), e:
+                    logger.warn("Couldn't read the header of replay %s: %s", infile, e)
                                 
                 bucket.append(item)
                 
@@ -244,8 +261,8 @@ class ReplaysWidget(BaseClass, FormClass):
                         oneline = cache[basename]
                         cache_hit[basename] = oneline
                     else:
-                        with open(item.filename, "rt") as fh:
-                            oneline = fh.readline()
+                        with ReplayFile(item.filename) as fh:
+                            oneline = fh.header + "\n"
                             cache_add[basename] = oneline
 
                     item.info = json.loads(oneline)
@@ -257,12 +274,8 @@ class ReplaysWidget(BaseClass, FormClass):
                         
                         bucket = buckets.setdefault(game_date, [])                    
                         
-                        icon = fa.maps.preview(item.info['mapname'])
-                        if icon:
-                            item.setIcon(0, icon)
-                        else:
-                            self.client.downloader.downloadMap(item.info['mapname'], item, True)
-                            item.setIcon(0,util.icon("games/unknown_map.png"))                                                      
+                        icon = fa.maps.previewService().request(item.info['mapname'], functools.partial(self.previewReady, item), force=True)
+                        item.setIcon(0, icon)
                         item.setToolTip(0, fa.maps.getDisplayName(item.info['mapname']))
                         item.setText(0, game_hour)
                         item.setTextColor(0, QtGui.QColor(client.instance.getColor("default")))
@@ -366,11 +379,8 @@ class ReplaysWidget(BaseClass, FormClass):
                              
             item.setToolTip(1, tip)
             
-            icon = fa.maps.preview(info['mapname'])
+            icon = fa.maps.previewService().request(info['mapname'], functools.partial(self.previewReady, item), force=True)
             item.setToolTip(0, fa.maps.getDisplayName(info['mapname']))
-            if not icon:           
-                self.client.downloader.downloadMap(item.info['mapname'], item, True)
-                icon = util.icon("games/unknown_map.png")
 
             item.setText(0,time.strftime("%H:%M", time.localtime(item.info['game_time'])))
             item.setTextColor(0, QtGui.QColor(client.instance.getColor("default")))
@@ -6,6 +6,7 @@ from PyQt4 import QtCore, QtGui
 from fa import maps
 import util
 import os, time
+import functools
 from games.moditem import mods
 
 import client
@@ -106,6 +107,11 @@ class ReplayItem(QtGui.QTreeWidgetItem):
         self.setHidden(True)
 
     
+    def previewReady(self, mapname, icon):
+        if icon and mapname == self.mapname:
+            self.icon = icon
+            self.setIcon(0, icon)
+
     def update(self, message, client):
         '''
         Updates this item from the message dictionary supplied
@@ -124,10 +130,7 @@ class ReplayItem(QtGui.QTreeWidgetItem):
         # Map preview code
         self.mapdisplayname = maps.getDisplayName(self.mapname)
       
-        self.icon = maps.preview(self.mapname)
-        if not self.icon:
-            self.client.downloader.downloadMap(self.mapname, self, True)
-            self.icon = util.icon("games/unknown_map.png")        
+        self.icon = maps.previewService().request(self.mapname, functools.partial(self.previewReady, self.mapname), force=True)
         #self.setIcon(0, self.icon)
         
         self.moddisplayname = self.mod
@@ -5,6 +5,7 @@
 from PyQt4 import QtCore, QtGui
 from fa import maps
 import util
+import functools
 
 class TutorialItemDelegate(QtGui.QStyledItemDelegate):
     
@@ -81,6 +82,10 @@ class TutorialItem(QtGui.QListWidgetItem):
         self.client = None
         self.title  = None
    
+    def previewReady(self, mapname, icon):
+        if icon and mapname == self.mapname:
+            self.setIcon(icon)
+
     def update(self, message, client):
         '''
         Updates this item from the message dictionary supplied
@@ -97,10 +102,7 @@ class TutorialItem(QtGui.QListWidgetItem):
             self.mapname = message['mapname']
             self.mapdisplayname = maps.getDisplayName(self.mapname)
 
-            icon = maps.preview(self.mapname)
-            if not icon:
-                icon = util.icon("games/unknown_map.png")
-                self.client.downloader.downloadMap(self.mapname, self)
+            icon = maps.previewService().request(self.mapname, functools.partial(self.previewReady, self.mapname), force=True)
                                         
             self.setIcon(icon)
 
@@ -1,4 +1,4 @@
-
+import atexit
 import sys
 import os
 import urllib2
@@ -181,6 +181,28 @@ __pixmapcache = {}
 __theme = None
 __themedir = None
 
+# Downloaded and generated previews in CACHE_DIR, see cachedIcon
+from config import Settings
+from cache import CacheManager, ResultCache
+
+previewCache = CacheManager(CACHE_DIR,
+                            int(Settings.get('MAX_DISK_SIZE', 'CACHE')),
+                            int(Settings.get('MAX_MEMORY_SIZE', 'CACHE')),
+                            QtGui.QPixmap,
+                            lambda pix: pix.width() * pix.height() * max(pix.depth(), 8) / 8,
+                            extensions=(".png", ".jpg", ".jpeg"))
+
+# Results of parsing mod_info.lua, game.prefs etc. in CACHE_DIR, saved on exit
+luaCache = ResultCache(os.path.join(CACHE_DIR, "luaparser_results"),
+                       int(Settings.get('MAX_LUA_RESULTS', 'CACHE')))
+atexit.register(luaCache.save)
+
+# Checksums of the game files the updater and binary patcher check, saved on exit
+from checksums import ChecksumManifest
+
+checksums = ChecksumManifest(os.path.join(APPDATA_DIR, "checksums.json"))
+atexit.register(checksums.save)
+
 
 # Public settings object
 settings = QtCore.QSettings("ForgedAllianceForever", "FA Lobby")
@@ -429,20 +451,34 @@ def __downloadPreviewFromWeb(unitname):
         fp.flush()
         os.fsync(fp.fileno())  #probably works fine without the flush and fsync
         fp.close()
+    previewCache.added(unitname)
+    return img
 
 
 def iconUnit(unitname):
     # Try to load directly from cache
 
-    img = os.path.join(CACHE_DIR, unitname)
-    if os.path.isfile(img):
+    img = previewCache.file(unitname)
+    if img:
         logger.debug("Using cached preview image for: " + unitname)
-        return icon(img, False)
+        return cachedIcon(img)
     # Try to download from web
     img = __downloadPreviewFromWeb(unitname)
     if img and os.path.isfile(img):
         logger.debug("Using web preview image for: " + unitname)
-        return icon(img, False)
+        return cachedIcon(img)
+
+
+def cachedIcon(filename, pix=False):
+    '''
+    Like icon(filename, False, pix) for previews in CACHE_DIR, whose pixmaps are kept in the size bounded previewCache
+    '''
+    pixmap = previewCache.load(filename)
+    if pix:
+        return pixmap
+    icon = QtGui.QIcon()
+    icon.addPixmap(pixmap, QtGui.QIcon.Normal)
+    return icon
 
 
 def icon(filename, themed=True, pix=False):
@@ -565,6 +601,22 @@ def irc_escape(text, a_style=""):
     return " ".join(result)
 
 
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+
+def replaceFile(source, destination):
+    """
+    Moves source over destination in one step, even on Windows.
+    """
+    if sys.platform == "win32":
+        if not windll.kernel32.MoveFileExW(unicode(source), unicode(destination),
+                                           MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+            raise WinError()
+    else:
+        os.rename(source, destination)
+
+
 def md5text(text):
     m = hashlib.md5()
     m.update(text)
@@ -573,19 +625,10 @@ def md5text(text):
 
 def md5(file_name):
     """
-    Compute md5 hash of the specified file.
+    Compute md5 hash of the specified file, or take it from the checksum manifest if the file didn't change.
     IOErrors raised here are handled in doUpdate.
     """
-    m = hashlib.md5()
-    if not os.path.isfile(file_name): return None
-
-    with open(file_name, "rb") as fd:
-        while True:
-            content = fd.read(1024 * 1024)
-            if not content: break
-            m.update(content)
-
-    return m.hexdigest()
+    return checksums.md5(file_name)
 
 
 def uniqueID(user, session):
@@ -0,0 +1,282 @@
+import collections
+import cPickle
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache(object):
+    """
+    A least recently used mapping, bounded by the total size of its values
+    as measured by sizeof(value).
+    """
+    def __init__(self, maxBytes, sizeof):
+        self.maxBytes = maxBytes
+        self.sizeof = sizeof
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, size = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._items[key] = value, size
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+            self._items[key] = value, size
+            self.bytes += size
+            while self.bytes > self.maxBytes and len(self._items) > 1:
+                _, (_, size) = self._items.popitem(last=False)
+                self.bytes -= size
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        bytes=self.bytes, entries=len(self._items))
+
+
+class DiskCache(object):
+    """
+    The files in a folder, bounded by their total size. When it's exceeded,
+    the least recently accessed files are deleted.
+
+    Access times are kept in the files' atime, set on every hit, so they
+    survive restarts whether or not the file system maintains atime itself.
+    Only files with one of the given extensions are managed, other files and
+    subfolders are left alone.
+    """
+    def __init__(self, folder, maxBytes, extensions=None):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.extensions = tuple(extensions) if extensions else None
+        self._files = None
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _scan(self):
+        self._files = {}
+        self.bytes = 0
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            self._record(name)
+
+    def _record(self, name):
+        if self.extensions and not name.lower().endswith(self.extensions):
+            return None
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            return None
+        if not os.path.isfile(os.path.join(self.folder, name)):
+            return None
+        if name in self._files:
+            self.bytes -= self._files[name][0]
+        self._files[name] = [st.st_size, st.st_atime]
+        self.bytes += st.st_size
+        return st
+
+    def path(self, name):
+        """
+        Returns the path of the cached file name and marks it as used,
+        or None if it isn't cached.
+        """
+        with self._lock:
+            if self._files is None:
+                self._scan()
+            if name not in self._files:
+                # It may have been written by something else
+                if self._record(name) is None:
+                    self.misses += 1
+                    return None
+            filename = os.path.join(self.folder, name)
+            now = time.time()
+            try:
+                os.utime(filename, (now, os.stat(filename).st_mtime))
+            except OSError:
+                self._forget(name)
+                self.misses += 1
+                return None
+            self._files[name][1] = now
+            self.hits += 1
+            return filename
+
+    def added(self, name):
+        """
+        Accounts for a file that was just written to the cache folder,
+        evicting others if that exceeds the budget.
+        """
+        with self._lock:
+            if self._files is None:
+                self._scan()
+            self._record(name)
+            self._trim()
+
+    def _forget(self, name):
+        size, _ = self._files.pop(name)
+        self.bytes -= size
+
+    def _trim(self):
+        if self.bytes <= self.maxBytes:
+            return
+        for name in sorted(self._files, key=lambda n: self._files[n][1]):
+            if self.bytes <= self.maxBytes:
+                break
+            filename = os.path.join(self.folder, name)
+            try:
+                os.remove(filename)
+            except OSError:
+                if os.path.exists(filename):
+                    logger.warn("Couldn't evict %s from the cache", name)
+                    continue
+            else:
+                self.evictions += 1
+            self._forget(name)
+
+    def stats(self):
+        with self._lock:
+            if self._files is None:
+                self._scan()
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        bytes=self.bytes, entries=len(self._files))
+
+
+class CacheManager(object):
+    """
+    Two tiered cache for downloaded or generated images: the files in a disk
+    cache folder, and the images loaded from them in a memory cache.
+
+    loader(path) loads an image and sizeof(image) tells its size in memory.
+    """
+    def __init__(self, folder, maxDiskBytes, maxMemoryBytes, loader, sizeof, extensions=None):
+        self.disk = DiskCache(folder, maxDiskBytes, extensions)
+        self.memory = MemoryCache(maxMemoryBytes, sizeof)
+        self.loader = loader
+
+    def file(self, name):
+        return self.disk.path(name)
+
+    def added(self, name):
+        """
+        Accounts for the file name that was just written, replacing any image
+        loaded from an earlier version of it.
+        """
+        self.disk.added(name)
+        self.memory.discard(os.path.join(self.disk.folder, name))
+
+    def load(self, path):
+        image = self.memory.get(path)
+        if image is None:
+            image = self.loader(path)
+            self.memory.put(path, image)
+        return image
+
+    def stats(self):
+        return dict(memory=self.memory.stats(), disk=self.disk.stats())
+
+
+class ResultCache(object):
+    """
+    Results computed from files, kept across runs in a single file. An entry
+    is used as long as the size and mtime of the file it was computed from
+    stay the same, spec tells apart different computations on the same file.
+
+    Results are stored pickled, so every hit gets its own copy. At most
+    maxEntries are kept, the least recently used are dropped first. Changes
+    are only written to disk by save.
+    """
+    def __init__(self, filename, maxEntries):
+        self.filename = filename
+        self.maxEntries = maxEntries
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        self._entries = collections.OrderedDict()
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "rb") as f:
+                self._entries.update(cPickle.load(f))
+        except Exception, e:
+            logger.warn("Couldn't load cached results from %s: %s", self.filename, e)
+
+    def fetch(self, path, spec, compute):
+        """
+        Returns the result of compute() for the file path, from the cache if
+        it was computed for the same spec and version of the file before.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return compute()
+        stamp = st.st_size, st.st_mtime
+        key = path, spec
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] == stamp:
+                self._entries[key] = entry
+                self.hits += 1
+                return cPickle.loads(entry[1])
+            self.misses += 1
+        result = compute()
+        data = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = stamp, data
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        return cPickle.loads(data)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            temp = self.filename + ".tmp"
+            try:
+                with open(temp, "wb") as f:
+                    cPickle.dump(self._entries.items(), f, cPickle.HIGHEST_PROTOCOL)
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(temp, self.filename)
+                self._dirty = False
+            except (IOError, OSError), e:
+                logger.warn("Couldn't save cached results to %s: %s", self.filename, e)
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        entries=len(self._entries) if self._entries is not None else 0)
@@ -0,0 +1,138 @@
+"""
+MD5 checksums of game files, kept across runs so that files which didn't
+change since they were last hashed aren't read again.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+
+# Files modified this recently might change again within the same mtime tick
+# without it showing, the checksums md5 computes for them are not kept
+RACY_SECONDS = 2
+
+
+def md5file(path):
+    '''
+    Returns the md5 hex digest of the file path, read a block at a time.
+    '''
+    m = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                break
+            m.update(block)
+    return m.hexdigest()
+
+
+def _stamp(st):
+    # st_ino is 0 where the platform doesn't provide it, which just never differs
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+class ChecksumManifest(object):
+    """
+    MD5 checksums of files by path, kept in a json file. A checksum is used
+    as long as the size, mtime and inode of its file stay the same.
+
+    With verify set, every file is hashed again the first time it's asked
+    for in this run. Changes are only written to disk by save.
+    """
+    def __init__(self, filename, verify=False):
+        self.filename = filename
+        self.verify = verify
+        self._entries = None
+        self._verified = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _load(self):
+        self._entries = {}
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "rb") as f:
+                self._entries.update(json.load(f))
+        except Exception, e:
+            logger.warn("Couldn't load checksums from %s: %s", self.filename, e)
+
+    def _store(self, key, st, checksum, racy=True):
+        if racy and time.time() - st.st_mtime < RACY_SECONDS:
+            self._entries.pop(key, None)
+        else:
+            self._entries[key] = _stamp(st) + [checksum]
+        self._verified.add(key)
+        self._dirty = True
+
+    def md5(self, path):
+        '''
+        Returns the md5 hex digest of the file path, or None if there's no
+        such file.
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        key = self._key(path)
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(key)
+            if entry is not None and entry[:3] == _stamp(st) and (not self.verify or key in self._verified):
+                self.hits += 1
+                return entry[3]
+            self.misses += 1
+        checksum = md5file(path)
+        with self._lock:
+            self._store(key, st, checksum)
+        return checksum
+
+    def record(self, path, checksum):
+        '''
+        Remembers checksum for the file path as it is now, for when the caller
+        just wrote it and knows what it hashes to. It's kept however recently
+        the file was modified; once its stamp changes it's hashed again.
+        '''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._store(self._key(path), st, checksum, racy=False)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            temp = self.filename + ".tmp"
+            try:
+                with open(temp, "wb") as f:
+                    json.dump(self._entries, f)
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(temp, self.filename)
+                self._dirty = False
+            except (IOError, OSError), e:
+                logger.warn("Couldn't save checksums to %s: %s", self.filename, e)
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        entries=len(self._entries) if self._entries is not None else 0)
@@ -0,0 +1,41 @@
+import logging
+
+
+class TrafficLog(object):
+    """
+    Logs the messages passing through a network connection.
+
+    Arguments are only formatted by the logging module, and only if the level
+    is enabled, so this costs next to nothing per message when it's off.
+    With a sample rate of N, just every Nth message is logged, together with
+    the number of messages and bytes seen so far. This makes it cheap enough to
+    leave traffic logging on in production.
+    """
+    def __init__(self, logger, level=logging.INFO, sample=1):
+        self.logger = logger
+        self.level = level
+        self.sample = max(1, int(sample))
+        self.messages = 0
+        self.bytes = 0
+
+    def isEnabled(self):
+        return self.logger.isEnabledFor(self.level)
+
+    def log(self, msg, *args, **kwargs):
+        """
+        Counts a message and logs it, if it's sampled.
+        Pass size= to count the bytes of the message.
+        """
+        self.messages += 1
+        self.bytes += kwargs.get("size", 0)
+
+        if self.messages % self.sample or not self.logger.isEnabledFor(self.level):
+            return
+        if self.sample > 1:
+            self.logger.log(self.level, msg + " (1 in %i: %i messages, %i bytes)",
+                            *(args + (self.sample, self.messages, self.bytes)))
+        else:
+            self.logger.log(self.level, msg, *args)
+
+    def stats(self):
+        return dict(messages=self.messages, bytes=self.bytes, sample=self.sample)
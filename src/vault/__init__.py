@@ -89,7 +89,7 @@ class MapVault(QtCore.QObject):
                 mapName = os.path.basename(mapDir)
                 zipName = mapName.lower()+".zip" 
                 
-                scenariolua = luaparser.luaParser(os.path.join(mapDir,maps.getScenarioFile(mapDir)))
+                scenariolua = luaparser.luaParser(os.path.join(mapDir,maps.getScenarioFile(mapDir)), cache=util.luaCache)
                 scenarioInfos = scenariolua.parse({'scenarioinfo>name':'name', 'size':'map_size', 'description':'description', 'count:armies':'max_players','map_version':'version','type':'map_type','teams>0>name':'battle_type'}, {'version':'1'})
                 
                 if scenariolua.error:
@@ -102,8 +102,8 @@ class MapVault(QtCore.QObject):
                     else:
                         uploadmap = QtGui.QMessageBox.Yes
                     if uploadmap == QtGui.QMessageBox.Yes:
-                        savelua = luaparser.luaParser(os.path.join(mapDir,maps.getSaveFile(mapDir)))
-                        saveInfos = savelua.parse({'markers>mass*>position':'mass:__parent__', 'markers>hydro*>position':'hydro:__parent__', 'markers>army*>position':'army:__parent__'})
+                        savelua = luaparser.luaParser(os.path.join(mapDir,maps.getSaveFile(mapDir)), cache=util.luaCache)
+                        saveInfos = savelua.query({'markers>mass*>position':'mass:__parent__', 'markers>hydro*>position':'hydro:__parent__', 'markers>army*>position':'army:__parent__'})
                         if savelua.error or savelua.warning:
                            logger.debug("There were " + str(scenariolua.errors) + " errors and " + str(scenariolua.warnings) + " warnings.")
                            logger.debug(scenariolua.errorMsg)
@@ -26,259 +26,519 @@ If there is default value for a search entry, error will not be generated. Defau
         special characters, like ' [ ] " are pulled down
     command - an instruction to the parser (only 1 supported command so far)
         count - counts all matched elements if they are strings, and size of lists or dicts otherwise
-        
+
     'destination:alias'
     alias - a name under which matched item will be returned
         you can use any of following patterns:
         __self__ - returns item name as it is in lua
         __parent__ - returns item parent
     destination - you can specify a dictionary for matched items in the resulting array
+
+Lua tables become dicts, items without a key are numbered from 0 in the order
+of all items of their table. Other values are returned as the lua source text,
+with the quotes of strings stripped, e.g. "VECTOR3( 1, 2, 3 )" or "true".
+
+The file is read in chunks, tokenized in a single pass and parsed by recursive
+descent. The search patterns are compiled once, and items are matched against
+them as soon as they are parsed. Use query instead of parse to only keep what
+matches, e.g. for the markers of large save files.
+
+Pass a util.cache.ResultCache as cache to reuse the results of earlier runs
+on the same version of a file.
 """
 import re
 import zipfile
 import os
 
+_STRING = r"""(?:"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')"""
+
+_CALL = r"""(?:[A-Za-z_][\w.]*\s*\((?:[^()'"\n]|%s)*\))""" % _STRING
+_NUMBER = r"""(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)"""
+
+# Every token takes the whitespace and comments in front of it along.
+# Keys with their '=' and calls with simple arguments, like VECTOR3( 1, 2, 3 )
+# in save files, are single tokens to keep the number of tokens down. So are
+# whole items with such a value and their separator, as long as one follows.
+_TOKENS = re.compile(r"""
+    (?P<space>\s*(?:(?:--\[(?P<ceq>=*)\[.*?\](?P=ceq)\](?:--)?|--[^\n]*|\#[^\n]*)\s*)*)
+    (?:
+      (?P<item>(?P<itemkey>\[\s*(?:%(string)s|[\w.]+)\s*\]|[A-Za-z_]\w*)\s*=(?!=)\s*
+               (?P<itemvalue>%(string)s|%(call)s|[A-Za-z_]\w*|-?%(number)s)\s*(?:[,;]|(?=})))
+    | (?P<key>\[\s*(?:%(string)s|[\w.]+)\s*\]\s*=(?!=))
+    | (?P<namekey>[A-Za-z_]\w*\s*=(?!=))
+    | (?P<call>%(call)s)
+    | (?P<long>\[(?P<leq>=*)\[.*?\](?P=leq)\])
+    | (?P<string>%(string)s)
+    | (?P<name>[A-Za-z_]\w*)
+    | (?P<number>%(number)s)
+    | (?P<op>\.\.\.|\.\.|==|~=|<=|>=|.)
+    | (?P<end>\Z)
+    )
+""" % dict(string=_STRING, call=_CALL, number=_NUMBER), re.S | re.X)
+
+_LONG_OPEN = re.compile(r"\[(=*)\[")
+
+_COMMENTS = re.compile(r"--\[(?P<ceq>=*)\[.*?\](?P=ceq)\](?:--)?|--[^\n]*|\#[^\n]*", re.S)
+
+_BINARY = frozenset(["+", "-", "*", "/", "%", "^", "..", "==", "~=", "<", "<=", ">", ">=", "and", "or"])
+_UNARY = frozenset(["-", "#", "not"])
+_OPEN = {"(": ")", "[": "]", "{": "}"}
+_OPERANDS = frozenset(["call", "name", "number", "string", "long"])
+_ENDS = frozenset([",", ";", "}"])
+
+_keyFilter = re.compile("[\[\],'\"]")
+
+CHUNK_SIZE = 64*1024
+
+
+def _token(match):
+    kind = match.lastgroup
+    space = match.group("space")
+    if "-" in space or "#" in space:
+        space = _COMMENTS.sub(" ", space)
+    if kind == "item":
+        return kind, match.group("itemkey", "itemvalue", "item"), space
+    return kind, match.group(kind), space
+
+
+def tokenize(text):
+    '''
+    Yields the (kind, text, space) tokens of lua source, where space is the
+    whitespace in front of the token. Comments count as whitespace.
+    The text of an item token is a (key, value, source) tuple.
+    '''
+    for match in _TOKENS.finditer(text):
+        if match.lastgroup == "end":
+            return
+        yield _token(match)
+
+
+def _limit(buf):
+    '''
+    Returns how far into buf tokens can reach without depending on what
+    follows it: not past the last non-space character with a line break after
+    it, and not into a long string or comment that isn't closed yet.
+    '''
+    limit = len(buf[:buf.rfind("\n") + 1].rstrip())
+    match = _LONG_OPEN.search(buf, 0, limit)
+    while match:
+        close = buf.find("]" + match.group(1) + "]", match.end())
+        if close == -1:
+            return match.start()
+        match = _LONG_OPEN.search(buf, close + len(match.group(0)), limit)
+    return limit
+
+
+def tokenizeFile(f, chunkSize=CHUNK_SIZE):
+    '''
+    Same as tokenize, for the lua source read from the file object f in
+    chunks. Only about a chunk of it is held in memory at a time.
+    '''
+    buf = ""
+    eof = False
+    while not eof:
+        data = f.read(chunkSize)
+        eof = not data
+        buf = buf + data
+        limit = len(buf) + 1 if eof else _limit(buf)
+        pos = 0
+        while True:
+            match = _TOKENS.match(buf, pos)
+            if match.end() >= limit or match.lastgroup == "end":
+                break
+            pos = match.end()
+            yield _token(match)
+        buf = buf[pos:]
+
+
+def _bracketKey(text):
+    key = text.strip()[1:-1].strip()
+    if key[:1] in "'\"":
+        key = key[1:-1]
+    if "'" in key or '"' in key or "[" in key or "]" in key or "," in key:
+        key = _keyFilter.sub("", key)
+    return key
+
+
+def _stringContent(kind, text):
+    if kind == "long":
+        level = text.index("[", 1) + 1
+        return text[level:-level]
+    return text[1:-1]
+
+
+class _Search(object):
+    '''
+    One entry of the search dictionary, compiled.
+    '''
+    def __init__(self, searchKey, resultKey):
+        self.key = searchKey
+        self.result = resultKey
+        parts = searchKey.split(":")
+        self.command = parts[0] if len(parts) == 2 else "none"
+        self.pattern = parts[-1].replace("*", ".*")
+        self.regex = re.compile(".*>(" + self.pattern + ")$")
+        self.multiple = len(parts) == 2 or searchKey.find("*") != -1
+
+
+class _Parser(object):
+    '''
+    Recursive descent parser building the tables of a lua file as dicts.
+    Every item is passed to found(parent, key, table) once its value is parsed.
+
+    If wanted is given, only the tables for which wanted(path) is true are
+    kept, along with everything in them. The items of other tables are
+    dropped right after being passed to found.
+    '''
+    _EOF = (None, "", "")
+
+    def __init__(self, tokens, found, loweringKeys=True, wanted=None):
+        self._next = iter(tokens).next
+        self._found = found
+        self._loweringKeys = loweringKeys
+        self._wanted = wanted
+        self._ahead = None
+        self._advance()
+
+    def _advance(self):
+        if self._ahead is not None:
+            self.kind, self.text, self.space = self._ahead
+            self._ahead = None
+        else:
+            try:
+                self.kind, self.text, self.space = self._next()
+            except StopIteration:
+                self.kind, self.text, self.space = self._EOF
+
+    def _peek(self):
+        if self._ahead is None:
+            try:
+                self._ahead = self._next()
+            except StopIteration:
+                self._ahead = self._EOF
+        return self._ahead
+
+    def chunk(self):
+        lua = dict()
+        self._items(lua, "", False, self._wanted is None)
+        return lua
+
+    def _table(self, parent, keep):
+        self._advance()
+        lua = dict()
+        self._items(lua, parent, True, keep)
+        if self.text == "}":
+            self._advance()
+        return lua
+
+    def _items(self, lua, parent, close, keep):
+        counter = 0
+        while self.kind is not None:
+            if self.kind == "op" and self.text in _ENDS:
+                if self.text == "}" and close:
+                    return
+                self._advance()
+            elif self._item(lua, parent, counter, keep):
+                counter = counter + 1
+            else:
+                # Not something that can start an item, skip it
+                self._advance()
+
+    def _item(self, lua, parent, counter, keep):
+        kind = self.kind
+        if kind == "item":
+            # The usual case, a key and a single literal or call
+            key, value, _ = self.text
+            key = _bracketKey(key) if key[0] == "[" else key
+            if self._loweringKeys:
+                key = key.lower()
+            key = key.strip()
+            if value[0] == "\"" or value[0] == "'":
+                value = value[1:-1]
+            self._advance()
+            lua[key] = value
+            self._found(parent, key, lua)
+            if not keep:
+                del lua[key]
+            return True
+        elif kind == "key":
+            key = _bracketKey(self.text[:-1])
+        elif kind == "namekey":
+            key = self.text[:-1]
+        elif kind == "op" and self.text == "[":
+            # A key that is an expression
+            self._advance()
+            key = self._expression()
+            if self.text == "]":
+                self._advance()
+            if self.text != "=":
+                return bool(key)
+            key = _keyFilter.sub("", key)
+            kind = "key"
+        else:
+            kind = None
+
+        if kind is None:
+            key = str(counter)
+        else:
+            self._advance()
+            if self._loweringKeys:
+                key = key.lower()
+            key = key.strip()
+
+        if self.kind == "op" and self.text == "{":
+            path = parent + ">" + key
+            value = self._table(path, keep or self._wanted(path))
+        else:
+            value = self._value()
+            if value is None:
+                if kind is None:
+                    return False
+                value = ""
+        lua[key] = value
+        self._found(parent, key, lua)
+        if not keep:
+            del lua[key]
+        return True
+
+    def _value(self):
+        kind, text = self.kind, self.text
+        if kind in _OPERANDS:
+            following = self._peek()
+            if following[0] != "op" or following[1] in _ENDS:
+                # The usual case, a single literal or call
+                self._advance()
+                if kind == "string" or kind == "long":
+                    return _stringContent(kind, text)
+                return text
+        value = self._expression()
+        if not value:
+            return None
+        if value[0] == "\"" or value[0] == "'":
+            value = value[1:]
+        if value and (value[-1] == "\"" or value[-1] == "'"):
+            value = value[:-1]
+        return value
+
+    def _expression(self):
+        '''
+        Returns the source text of the expression at the current token.
+        '''
+        pieces = []
+        operand = False
+        while self.kind is not None:
+            kind, text = self.kind, self.text
+            if operand:
+                if kind == "op" and text in ("(", "["):
+                    self._enclosed(pieces)
+                    continue
+                elif text in _BINARY and kind in ("op", "name") or kind == "op" and text in (".", ":"):
+                    operand = False
+                else:
+                    break
+            elif kind == "op" and text in _OPEN:
+                self._enclosed(pieces)
+                operand = True
+                continue
+            elif kind in _OPERANDS and text not in _UNARY:
+                operand = True
+            elif text not in _UNARY:
+                break
+            pieces.append(self.space + text if pieces else text)
+            self._advance()
+        return "".join(pieces)
+
+    def _enclosed(self, pieces):
+        '''
+        Appends the source text of everything up to the matching closing bracket.
+        '''
+        closing = [_OPEN[self.text]]
+        pieces.append(self.space + self.text if pieces else self.text)
+        self._advance()
+        while self.kind is not None and closing:
+            if self.kind == "op":
+                if self.text in _OPEN:
+                    closing.append(_OPEN[self.text])
+                elif self.text == closing[-1]:
+                    closing.pop()
+            pieces.append(self.space + (self.text[2] if self.kind == "item" else self.text))
+            self._advance()
+
+
+class _StopParsing(Exception):
+    pass
+
+
 class luaParser:
-    
-    def __init__(self, luaPath):
+
+    def __init__(self, luaPath, cache=None):
+        self.cache = cache
         self.iszip = False
         self.zip = None
         self.__path = luaPath
-        self.__keyFilter = re.compile("[\[\],'\"]")
-        self.__valFilter = re.compile("[\[\]]")
         self.__searchResult = dict()
         self.__searchPattern = dict()
+        self.__searches = []
+        self.__anySearch = None
         self.__foundItemsCount = dict()
-        self.__stream = list()
-        self.__lines = list()
-        self.__prevUnfinished = False
-        self.__inString = False
-        self.__stringChar = ""
         self.__parsedData = dict()
         self.__defaultValues = dict()
+        self.__pending = None
         self.errors = 0
         self.warnings = 0
         self.error = False
         self.warning = False
         self.errorMsg = ""
         self.loweringKeys = True
-    
-    def __checkUninterruptibleStr(self, char):
-        if char == "\"" or char == "'":
-            if not self.__inString:
-                self.__stringChar = char
-                self.__inString = True
-            elif char == self.__stringChar:
-                self.__inString = False
-        elif not self.__inString and char == "(":
-            self.__inString = True
-            self.__stringChar = ")"
-    
-    def __processLine(self, parent=""):
-        #initialize item counter
-        counter = 0
-        #initialize empty array
-        lua = dict()
-        #initialize value
-        value = ""
-        #start cycle
-        while len(self.__stream):
-            #get a line from the list or read next line from the file
-            if len(self.__lines) == 0:
-                line = self.__stream.pop(0)
-                #cut commentary section (either start whit '#' or is a '--[[  ]]--' section
-                comment = re.compile("((#.*))$|((--\[\[).*(\]\]--)$)")
-                line = comment.sub("", line)
-                #process line to see if it one command or a stack of them
-                newLine = 0
-                pos = 0
-                self.__inString = False
-                while len(line) > pos:
-                    char = line[pos]
-                    self.__checkUninterruptibleStr(char)
-                    if char == "{":
-                        pos = pos + 1
-                        char = line[pos]
-                        self.__checkUninterruptibleStr(char)
-                        self.__lines.append(line[newLine:pos])
-                        newLine = pos
-                    elif char == ","  and not self.__inString:
-                        self.__lines.append(line[newLine:pos])
-                        pos = pos + 1
-                        char = line[pos]
-                        self.__checkUninterruptibleStr(char)
-                        newLine = pos
-                    elif char == "}":
-                        self.__lines.append(line[newLine:pos])
-                        self.__lines.append("}")
-                        pos = pos + 1
-                        if pos <= len(line):
-                            self.__checkUninterruptibleStr(line[pos])
-                        newLine = pos
-                    pos = pos + 1
-                if len(self.__lines) > 0:
-                    line = self.__lines.pop(0)
-            else:
-                line = self.__lines.pop(0)
-            line = line.strip()
-            #if the string is not empty, proceed
-            if line != "":
-                #split it by '='
-                lineArray = line.split("=")
-                #if result is one element list
-                if len(lineArray) == 1:
-                    #this element is value
-                    value = lineArray[0].strip()
-                    #assign counter value to key
-                    key = str(counter)
+
+    def __compileSearches(self):
+        self.__searches = [_Search(key, self.__searchPattern[key]) for key in self.__foundItemsCount]
+        if self.__searches:
+            self.__anySearch = re.compile(".*>(" + "|".join(s.pattern for s in self.__searches) + ")$")
+        else:
+            self.__anySearch = None
+
+    def __found(self, parent, key, lua):
+        #checking item if it suits searchPattern, and adding if so
+        if self.__anySearch is None or not self.__anySearch.match(parent + ">" + key):
+            return
+        for search in self.__searches:
+            if search.regex.match(parent + ">" + key):
+                self.__record(search, parent, key, lua)
+                if self.__pending is not None:
+                    self.__pending.discard(search.key)
+        if self.__pending is not None and not self.__pending:
+            raise _StopParsing()
+
+    def __wanted(self, path):
+        return self.__anySearch is not None and self.__anySearch.match(path) is not None
+
+    def __record(self, search, parent, key, lua):
+        #add new value into the resulting array
+        resultKey = search.result
+        if search.command == "count":
+            if lua.has_key(key):
+                if isinstance(lua[key], str):
+                    count = 1
                 else:
-                    #first is key
-                    if self.loweringKeys:
-                        key = lineArray[0].lower()
-                    else:
-                        key = lineArray[0]
-                    #get rid of redundant chars in key
-                    key = self.__keyFilter.sub("", key).strip()
-                    #second is value
-                    value = lineArray[1].strip()
-                #if value is '}' - which is end of lua array, stop parsing
-                if value == "}":
-                    break
-                unfinished = False
-                if len(value) != 0:
-                    #remove finishing comma if there is one
-                    if value[-1] == ",":
-                        value = value[:-1]
-                    #get rid of redundant chars in value
-                    value = self.__valFilter.sub("", value)
-                if len(value) != 0:
-                    #parse value:
-                    #if the string starts with '{'
-                    if value[-1] == "{":
-                        #add new item into the array: recursive function call
-                        if self.__prevUnfinished:
-                            self.__prevUnfinished = False
-                            lua[prevkey] = self.__processLine(parent+">"+prevkey)
-                        else:
-                            lua[key] = self.__processLine(parent+">"+key)
-                    else:
-                        #add new item into the array: value itself
-                        if value[0] == "\"" or value[0] == "'":
-                            value = value[1:]
-                        if value[-1] == "\"" or value[-1] == "'":
-                            value = value[:-1]
-                        lua[key] = value
-                elif len(value) != 0:
-                    #add new item into the array: value itself
-                    lua[key] = value
-                elif len(key) != 0:
-                    self.__prevUnfinished = True
-                    prevkey = key
-            #checking line if it suits searchPattern, and adding if so
-                for searchKey in self.__searchPattern:
-                    #regkey = re.compile(".*("+searchKey.split(":")[-1].replace("*", ".*")+")$")
-                    #if regkey.match(parent+">"+key):
-                    if re.match(".*>("+searchKey.split(":")[-1].replace("*", ".*")+")$", parent+">"+key):
-                        #get command from key
-                        valcmd = searchKey.split(":")
-                        valcmd = valcmd[0] if len(valcmd) == 2 else "none"
-                        #add new value into the resulting array
-                        resultKey = self.__searchPattern[searchKey]
-                        if valcmd == "count":
-                            if lua.has_key(key):
-                                if isinstance(lua[key], str):
-                                    count = 1
-                                else:
-                                    count = len(lua[key])
-                            else:
-                                count = 0
-                            if self.__searchResult.has_key(resultKey):
-                                resultVal = self.__searchResult[resultKey] + count
-                            else:
-                                resultVal = count
-                        else:
-                            resultVal = lua[key]
-                        resultKey = resultKey.replace("__self__", key)
-                        resultKey = resultKey.replace("__parent__", parent.split(">")[-1])
-                        keycmd = resultKey.split(":")
-                        #unpack command from search key
-                        if len(keycmd) == 2:
-                            resultKey = keycmd[1]
-                            keydst = keycmd[0]
-                        else:
-                            keydst = "__nowhere__"
-                        #write result into the array
-                        if keydst == "__nowhere__":
-                            self.__searchResult[resultKey] = resultVal
-                        else:
-                            if self.__searchResult.has_key(keydst):
-                                if isinstance(self.__searchResult[keydst], dict):
-                                    self.__searchResult[keydst][resultKey] = resultVal
-                            else:
-                                self.__searchResult[keydst] = dict()
-                                self.__searchResult[keydst][resultKey] = resultVal
-                        if isinstance(resultVal, int):
-                            self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + resultVal
-                        else:
-                            self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + 1
-            #increase counter
-            counter = counter + 1
-        #return resulting array
-        return lua
-        
-    def __parseLua(self):
+                    count = len(lua[key])
+            else:
+                count = 0
+            if self.__searchResult.has_key(resultKey):
+                resultVal = self.__searchResult[resultKey] + count
+            else:
+                resultVal = count
+        else:
+            resultVal = lua[key]
+        resultKey = resultKey.replace("__self__", key)
+        resultKey = resultKey.replace("__parent__", parent.split(">")[-1])
+        keycmd = resultKey.split(":")
+        #unpack command from search key
+        if len(keycmd) == 2:
+            resultKey = keycmd[1]
+            keydst = keycmd[0]
+        else:
+            keydst = "__nowhere__"
+        #write result into the array
+        if keydst == "__nowhere__":
+            self.__searchResult[resultKey] = resultVal
+        else:
+            if self.__searchResult.has_key(keydst):
+                if isinstance(self.__searchResult[keydst], dict):
+                    self.__searchResult[keydst][resultKey] = resultVal
+            else:
+                self.__searchResult[keydst] = dict()
+                self.__searchResult[keydst][resultKey] = resultVal
+        if isinstance(resultVal, int):
+            self.__foundItemsCount[search.key] = self.__foundItemsCount[search.key] + resultVal
+        else:
+            self.__foundItemsCount[search.key] = self.__foundItemsCount[search.key] + 1
+
+    def __openLua(self):
         #open file
         if self.iszip == False:
-            f = open(self.__path, "r")
-        else:
-            if self.zip.testzip() == None :
-                for member in self.zip.namelist() :
-                    filename = os.path.basename(member)
-                    if not filename:
-                        continue
-                    if filename == self.__path:
-                        f = self.zip.open(member)
-                        break
-        if not f :
+            return open(self.__path, "r")
+        for member in self.zip.namelist() :
+            filename = os.path.basename(member)
+            if not filename:
+                continue
+            if filename == self.__path:
+                return self.zip.open(member)
+        return None
+
+    def __parseLua(self, keepAll):
+        f = self.__openLua()
+        if f is None:
             return
-            
-
-        self.__stream = f.readlines()
-        if self.__stream[-1][-1] != "\n": # file doesn't end in a newline
-                        self.__stream[-1] += "\n" # needed to prevent a bug happening when a file doesn't end with a newline.
-        f.close()
-        #call recursive function
-        result = self.__processLine()
-        return result
-    
+        with f:
+            parser = _Parser(tokenizeFile(f), self.__found, self.loweringKeys,
+                             None if keepAll else self.__wanted)
+            try:
+                return parser.chunk()
+            except _StopParsing:
+                return None
+
     def __checkErrors(self):
-        for key in self.__foundItemsCount:
-            resultKey = self.__searchPattern[key]
-            if len(key.split(":")) == 2 or key.find("*") != -1:
-                if self.__foundItemsCount[key] == 0:
-                    if self.__defaultValues.has_key(resultKey):
-                        self.__searchResult[resultKey] = self.__defaultValues[resultKey]
-                    else:
-                        self.error = True
-                        self.errors = self.errors + 1
-                        self.errorMsg = self.errorMsg + "Error: no matches for '" + key + "' were found\n"
-            else:
-                if self.__foundItemsCount[key] == 0:
-                    if self.__defaultValues.has_key(resultKey):
-                        self.__searchResult[resultKey] = self.__defaultValues[resultKey]
-                    else:
-                        self.error = True
-                        self.errors = self.errors + 1
-                        self.errorMsg = self.errorMsg + "Error: no matches for '" + key + "' were found\n"
-                elif self.__foundItemsCount[key] > 1:
-                    self.warning = True
-                    self.warnings = self.warnings + 1
-                    self.errorMsg = self.errorMsg + "Warning: there were duplicate occurrences for '" + key + "'\n"
-                    
-    def parse(self, luaSearch, defValues = dict()):
+        for search in self.__searches:
+            key = search.key
+            resultKey = search.result
+            if self.__foundItemsCount[key] == 0:
+                if self.__defaultValues.has_key(resultKey):
+                    self.__searchResult[resultKey] = self.__defaultValues[resultKey]
+                else:
+                    self.error = True
+                    self.errors = self.errors + 1
+                    self.errorMsg = self.errorMsg + "Error: no matches for '" + key + "' were found\n"
+            elif self.__foundItemsCount[key] > 1 and not search.multiple:
+                self.warning = True
+                self.warnings = self.warnings + 1
+                self.errorMsg = self.errorMsg + "Warning: there were duplicate occurrences for '" + key + "'\n"
+
+    def __prepare(self, luaSearch, defValues):
         self.__searchPattern.update(luaSearch)
         self.__defaultValues.update(defValues)
         self.__foundItemsCount = {}.fromkeys(self.__searchPattern.keys(), 0)
-        self.__parsedData = self.__parseLua()
+        self.__compileSearches()
+
+    def __state(self):
+        return self.__searchResult, self.errors, self.warnings, self.error, self.warning, self.errorMsg
+
+    def __run(self, keepAll):
+        self.__parsedData = self.__parseLua(keepAll)
         self.__checkErrors()
+        return self.__state()
+
+    def __cached(self, keepAll, stopEarly):
+        if self.cache is None:
+            self.__run(keepAll)
+            return
+        if self.iszip:
+            path = self.zip.filename
+            member = self.__path
+        else:
+            path = os.path.abspath(self.__path)
+            member = None
+        spec = repr((member, sorted(self.__searchPattern.items()), sorted(self.__defaultValues.items()),
+                     self.loweringKeys, keepAll, stopEarly))
+        state = self.cache.fetch(path, spec, lambda: self.__run(keepAll))
+        self.__searchResult, self.errors, self.warnings, self.error, self.warning, self.errorMsg = state
+
+    def parse(self, luaSearch, defValues = dict()):
+        self.__prepare(luaSearch, defValues)
+        self.__cached(True, False)
+        return self.__searchResult
+
+    def query(self, luaSearch, defValues = dict(), stopEarly = True):
+        '''
+        Same as parse, but streams through the file without building its
+        tables: only the matched values are kept, so memory use doesn't grow
+        with the file. With stopEarly, reading stops as soon as all searches
+        have matched, unless some of them can match more than once (patterns
+        with * and counts). Duplicates past the first match aren't seen then.
+        '''
+        self.__prepare(luaSearch, defValues)
+        if stopEarly and not any(search.multiple for search in self.__searches):
+            self.__pending = set(search.key for search in self.__searches)
+        self.__cached(False, stopEarly)
+        self.__pending = None
         return self.__searchResult
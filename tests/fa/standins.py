@@ -0,0 +1,107 @@
+"""
+Stand-ins for the servers and helpers the fa tests share.
+"""
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
+
+
+def wait_for(application, condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        application.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+
+class StandInVault(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves files from a dict by path with range support, like the map vault
+    and the update server do, taking delay seconds for each. Keeps track of
+    the requests, the ranges asked for and how many are served at once. Drops
+    the connection after cut bytes of a response if set.
+    """
+    daemon_threads = True
+
+    def __init__(self, files, delay=0, etag='"1"'):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StandInVaultHandler)
+        self.files = files
+        self.delay = delay
+        self.etag = etag
+        self.cut = None
+        self.requests = []
+        self.ranges = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def url(self, path):
+        return "http://127.0.0.1:%i%s" % (self.server_address[1], path)
+
+    @property
+    def root(self):
+        return self.url("/")
+
+
+class StandInVaultHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def send_file_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", self.server.etag)
+
+    def do_HEAD(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_file_headers()
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        requested = self.headers.getheader("Range")
+        with server.lock:
+            server.requests.append(self.path)
+            server.ranges.append(requested)
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+        try:
+            time.sleep(server.delay)
+            data = server.files.get(self.path)
+            if data is None:
+                self.send_error(404)
+                return
+            if requested:
+                start, end = requested.split("=")[1].split("-")
+                start, end = int(start), (int(end) if end else len(data) - 1)
+                if start >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Range", "bytes */%i" % len(data))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %i-%i/%i" % (start, end, len(data)))
+                body = data[start:end + 1]
+            else:
+                self.send_response(200)
+                body = data
+            self.send_file_headers()
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if server.cut is not None:
+                body = body[:server.cut]
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
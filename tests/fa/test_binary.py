@@ -0,0 +1,74 @@
+import hashlib
+import os
+import random
+
+import bsdiff4
+import pytest
+
+from fa import binary
+
+
+def make_files(tmpdir, size=300000, seed=1):
+    rng = random.Random(seed)
+    old = "".join(chr(rng.randrange(256)) for _ in range(size))
+    new = list(old)
+    # Change some bytes, insert a run and drop another, like a rebuilt executable
+    for i in range(0, size, 997):
+        new[i] = chr((ord(new[i]) + 3) % 256)
+    new = "".join(new[:size // 3]) + "inserted" * 5000 + "".join(new[size // 2:])
+    source = os.path.join(str(tmpdir), "source.dll")
+    patch = os.path.join(str(tmpdir), "patch")
+    with open(source, "wb") as f:
+        f.write(old)
+    with open(patch, "wb") as f:
+        f.write(bsdiff4.diff(old, new))
+    return source, patch, old, new
+
+
+def apply(source, patch, output):
+    with open(source, "rb") as source_file, open(output, "wb") as output_file:
+        return binary.patch_stream(source_file, patch, output_file)
+
+
+def test_patch_stream_matches_bsdiff4(tmpdir, monkeypatch):
+    monkeypatch.setattr(binary, "PATCH_BLOCK_SIZE", 4096)
+    monkeypatch.setattr(binary, "COMPRESSED_BLOCK_SIZE", 512)
+    source, patch, old, new = make_files(tmpdir)
+    output = os.path.join(str(tmpdir), "output.dll")
+
+    assert apply(source, patch, output) == hashlib.md5(new).hexdigest()
+    assert open(output, "rb").read() == bsdiff4.patch(old, open(patch, "rb").read()) == new
+
+
+def test_patch_stream_rejects_truncated_patch(tmpdir):
+    source, patch, _, _ = make_files(tmpdir)
+    data = open(patch, "rb").read()
+    with open(patch, "wb") as f:
+        f.write(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        apply(source, patch, os.path.join(str(tmpdir), "output.dll"))
+
+
+def test_patch_file_replaces_file_atomically(tmpdir, monkeypatch):
+    source, patch, old, new = make_files(tmpdir)
+    monkeypatch.setattr(binary, "BIN_DIR", str(tmpdir))
+    monkeypatch.setattr(binary, "PATCH_DIR", str(tmpdir))
+    updater = binary.Updater.__new__(binary.Updater)
+
+    assert updater.patch_file("source.dll", "patch") == hashlib.md5(new).hexdigest()
+    assert open(source, "rb").read() == new
+    assert sorted(os.listdir(str(tmpdir))) == ["patch", "source.dll"]
+
+
+def test_patch_file_keeps_original_if_patching_fails(tmpdir, monkeypatch):
+    source, patch, old, _ = make_files(tmpdir)
+    with open(patch, "r+b") as f:
+        f.truncate(100)
+    monkeypatch.setattr(binary, "BIN_DIR", str(tmpdir))
+    monkeypatch.setattr(binary, "PATCH_DIR", str(tmpdir))
+    updater = binary.Updater.__new__(binary.Updater)
+
+    with pytest.raises(ValueError):
+        updater.patch_file("source.dll", "patch")
+    assert open(source, "rb").read() == old
+    assert sorted(os.listdir(str(tmpdir))) == ["patch", "source.dll"]
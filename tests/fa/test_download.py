@@ -0,0 +1,136 @@
+import os
+
+import pytest
+
+from fa import download
+from tests.fa.standins import StandInVault
+
+
+DATA = "".join(chr(i % 251) for i in range(1024 * 1024))
+
+
+@pytest.fixture
+def server(request):
+    server = StandInVault({"/patch.bin": DATA})
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    request.addfinalizer(stop)
+    return server
+
+
+def test_downloads_whole_file(server, tmpdir):
+    target = os.path.join(str(tmpdir), "patch.bin")
+    assert download.download(server.url("/patch.bin"), target) == len(DATA)
+    assert open(target, "rb").read() == DATA
+    assert server.ranges == [None]
+    assert os.listdir(str(tmpdir)) == ["patch.bin"]
+
+
+def test_resumes_interrupted_download(server, tmpdir):
+    target = os.path.join(str(tmpdir), "patch.bin")
+    server.cut = 300000
+    with pytest.raises(IOError):
+        download.download(server.url("/patch.bin"), target)
+    assert not os.path.exists(target)
+    assert os.path.getsize(target + ".part") == 300000
+
+    server.cut = None
+    download.download(server.url("/patch.bin"), target)
+    assert open(target, "rb").read() == DATA
+    assert server.ranges == [None, "bytes=300000-"]
+    assert os.listdir(str(tmpdir)) == ["patch.bin"]
+
+
+def test_finishes_a_complete_part_that_was_not_renamed(server, tmpdir, monkeypatch):
+    target = os.path.join(str(tmpdir), "patch.bin")
+    rename = download.os.rename
+
+    def locked(source, destination):
+        raise OSError("locked")
+    monkeypatch.setattr(download.os, "rename", locked)
+    with pytest.raises(OSError):
+        download.download(server.url("/patch.bin"), target)
+    monkeypatch.setattr(download.os, "rename", rename)
+    assert os.path.getsize(target + ".part") == len(DATA)
+
+    server.ranges = []
+    assert download.download(server.url("/patch.bin"), target) == len(DATA)
+    assert open(target, "rb").read() == DATA
+    assert server.ranges == []
+    assert os.listdir(str(tmpdir)) == ["patch.bin"]
+
+
+def test_starts_over_when_file_changed_on_server(server, tmpdir):
+    target = os.path.join(str(tmpdir), "patch.bin")
+    server.cut = 300000
+    with pytest.raises(IOError):
+        download.download(server.url("/patch.bin"), target)
+
+    server.cut = None
+    server.etag = '"2"'
+    download.download(server.url("/patch.bin"), target)
+    assert open(target, "rb").read() == DATA
+    assert server.ranges[-1] is None
+
+
+def test_downloads_segments_in_parallel(server, tmpdir, monkeypatch):
+    monkeypatch.setattr(download, "SEGMENT_MIN_SIZE", 256 * 1024)
+    target = os.path.join(str(tmpdir), "patch.bin")
+    download.download(server.url("/patch.bin"), target, segments=3)
+    assert open(target, "rb").read() == DATA
+    assert sorted(server.ranges) == ["bytes=0-349524", "bytes=349525-699049", "bytes=699050-1048575"]
+    assert os.listdir(str(tmpdir)) == ["patch.bin"]
+
+
+def test_resumes_interrupted_segments(server, tmpdir, monkeypatch):
+    monkeypatch.setattr(download, "SEGMENT_MIN_SIZE", 256 * 1024)
+    target = os.path.join(str(tmpdir), "patch.bin")
+    server.cut = 100000
+    with pytest.raises(IOError):
+        download.download(server.url("/patch.bin"), target, segments=2)
+
+    server.cut = None
+    server.ranges = []
+    download.download(server.url("/patch.bin"), target, segments=2)
+    assert open(target, "rb").read() == DATA
+    assert sorted(server.ranges) == ["bytes=100000-524287", "bytes=624288-1048575"]
+
+
+def test_cancelling_keeps_part_for_later(server, tmpdir):
+    target = os.path.join(str(tmpdir), "patch.bin")
+    with pytest.raises(download.DownloadCancelled):
+        download.download(server.url("/patch.bin"), target, cancelled=lambda: True)
+    assert not os.path.exists(target)
+    assert os.path.exists(target + ".part")
+
+
+def test_reports_progress_a_few_times_a_second(server, tmpdir, monkeypatch):
+    monkeypatch.setattr(download, "CHUNK_SIZE", 1024)
+    reports = []
+    download.download(server.url("/patch.bin"), os.path.join(str(tmpdir), "patch.bin"),
+                      progress=lambda done, total: reports.append((done, total)))
+    assert reports[0] == (0, len(DATA))
+    assert reports[-1] == (len(DATA), len(DATA))
+    assert len(reports) < 1024 / 4
+
+
+def test_missing_file_raises(server, tmpdir):
+    with pytest.raises(IOError):
+        download.download(server.url("/missing.bin"), os.path.join(str(tmpdir), "missing.bin"))
+
+
+def test_download_object_finishes_on_its_thread(application, server, tmpdir):
+    target = os.path.join(str(tmpdir), "patch.bin")
+    finished = []
+    task = download.Download(server.url("/patch.bin"), target)
+    task.finished.connect(lambda: finished.append(True))
+    task.start()
+    while task.isRunning():
+        application.processEvents()
+        task.thread.join(0.01)
+    application.processEvents()
+    assert finished == [True]
+    assert task.error is None
+    assert open(target, "rb").read() == DATA
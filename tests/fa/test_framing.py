@@ -0,0 +1,40 @@
+import json
+import struct
+
+import pytest
+
+from fa import framing
+from fa.gpgnet import BlockReader
+
+MESSAGE = {"action": "GameState", "chunks": ["Lobby", 3]}
+
+FRAMINGS = sorted(framing.FRAMINGS.values(), key=lambda f: f.name)
+
+
+def test_legacy_framing_is_a_qstring_block():
+    block = framing.LEGACY.encode({"key": "ping", "commands": []})
+    payload = json.dumps({"key": "ping", "commands": []}).encode("utf-16-be")
+    assert block == struct.pack(">II", len(payload) + 4, len(payload)) + payload
+
+
+def test_json_framing_is_length_prefixed_utf8():
+    block = framing.FRAMINGS["json"].encode({"key": "ping"})
+    assert block == struct.pack(">I", 14) + '{"key":"ping"}'
+
+
+@pytest.mark.parametrize("codec", FRAMINGS)
+def test_framing_round_trips_through_block_reader(codec):
+    reader = BlockReader()
+    reader.feed(codec.encode(MESSAGE) + codec.encode({"key": "pong", "commands": []}))
+    assert [codec.decode(block) for block in reader.blocks()] == [MESSAGE, {"key": "pong", "commands": []}]
+
+
+def test_compact_framings_are_smaller_than_legacy():
+    legacy = len(framing.LEGACY.encode(MESSAGE))
+    for codec in FRAMINGS:
+        if codec is not framing.LEGACY:
+            assert len(codec.encode(MESSAGE)) < legacy
+
+
+def test_unknown_framing_falls_back_to_legacy():
+    assert framing.get_framing("carrier pigeon") is framing.LEGACY
@@ -0,0 +1,145 @@
+import struct
+
+import pytest
+
+from fa import gpgnet
+from fa.gpgnet import GPGNetDecoder, GPGNetError, BlockReader
+
+
+def pack_frame(action, chunks):
+    data = struct.pack("<I", len(action)) + action + struct.pack("<i", len(chunks))
+    for chunk in chunks:
+        if isinstance(chunk, int):
+            data += struct.pack("<bi", 0, chunk)
+        else:
+            chunk = chunk.replace("\t", "/t").replace("\n", "/n")
+            data += struct.pack("<bi", 1, len(chunk)) + chunk
+    return data
+
+
+def test_decoder_decodes_single_frame():
+    frame = pack_frame("GameState", ["Idle"])
+    assert GPGNetDecoder().decode(frame) == [("GameState", ["Idle"])]
+
+
+def test_decoder_decodes_numbers_and_strings():
+    frame = pack_frame("PlayerOption", [3, "Team", -1])
+    assert GPGNetDecoder().decode(frame) == [("PlayerOption", [3, "Team", -1])]
+
+
+def test_decoder_unescapes_tabs_and_newlines():
+    frame = pack_frame("Chat", ["a\tb\nc"])
+    assert GPGNetDecoder().decode(frame) == [("Chat", ["a\tb\nc"])]
+
+
+def test_decoder_decodes_several_frames_at_once():
+    data = pack_frame("GameState", ["Lobby"]) + pack_frame("GameOption", ["Victory", "sandbox"])
+    assert GPGNetDecoder().decode(data) == [("GameState", ["Lobby"]),
+                                            ("GameOption", ["Victory", "sandbox"])]
+
+
+def test_decoder_reassembles_frames_fed_byte_by_byte():
+    data = pack_frame("GameOption", ["Slots", 12]) + pack_frame("GameState", ["Launching"])
+    decoder = GPGNetDecoder()
+    frames = []
+    for i in range(len(data)):
+        frames.extend(decoder.decode(data[i:i+1]))
+    assert frames == [("GameOption", ["Slots", 12]), ("GameState", ["Launching"])]
+    assert len(decoder) == 0
+
+
+def test_decoder_keeps_partial_frame_buffered():
+    data = pack_frame("GameState", ["Idle"])
+    decoder = GPGNetDecoder()
+    assert decoder.decode(data[:-2]) == []
+    assert len(decoder) == len(data) - 2
+    assert decoder.decode(data[-2:]) == [("GameState", ["Idle"])]
+
+
+def test_decoder_raises_on_too_many_chunks():
+    data = struct.pack("<I", 4) + "Junk" + struct.pack("<i", 101)
+    with pytest.raises(GPGNetError):
+        GPGNetDecoder().decode(data)
+
+
+def test_decoder_recovers_after_clear():
+    decoder = GPGNetDecoder()
+    with pytest.raises(GPGNetError):
+        decoder.decode(struct.pack("<I", 4) + "Junk" + struct.pack("<i", 101))
+    decoder.clear()
+    assert decoder.decode(pack_frame("GameState", ["Idle"])) == [("GameState", ["Idle"])]
+
+
+def test_block_reader_splits_big_endian_blocks():
+    reader = BlockReader()
+    reader.feed(struct.pack(">I", 3) + "abc" + struct.pack(">I", 2) + "d")
+    assert list(reader.blocks()) == ["abc"]
+    reader.feed("e")
+    assert list(reader.blocks()) == ["de"]
+
+
+def legacy_pack(header, data):
+    """ Packet.Pack before fa.gpgnet.encode """
+    out = ""
+    headerSize = len(str(header))
+    headerField = str(header).replace("\t", "/t").replace("\n", "/n")
+    out += struct.pack("<i" + str(headerSize) + "si", headerSize, headerField, len(data))
+    for field in data:
+        if type(field) is int:
+            out += struct.pack("<bi", 0, field)
+        else:
+            fieldSize = len(field)
+            fieldStr = str(field).replace("\t", "/t").replace("\n", "/n")
+            out += struct.pack("<bi" + str(fieldSize) + "s", 1, fieldSize, fieldStr)
+    return out
+
+
+def legacy_pack_udp(header, data):
+    """ Packet.PackUdp before fa.gpgnet.encode_udp """
+    out = ""
+    headerSize = len(str(header))
+    headerField = str(header).replace("\t", "/t").replace("\n", "/n")
+    out += struct.pack("<i" + str(headerSize) + "si", headerSize, headerField, len(data))
+    i = 0
+    for field in data:
+        if type(field) is int:
+            out += struct.pack("<bi", 0, field)
+        else:
+            out = "\x08"
+            fieldSize = len(field) + len(out) if i == 1 else len(field)
+            fieldStr = str(field).replace("\t", "/t").replace("\n", "/n")
+            if i == 1:
+                out += struct.pack("<bi" + str(fieldSize) + "s", 2, fieldSize, out + fieldStr)
+            else:
+                out += struct.pack("<bi" + str(fieldSize) + "s", 1, fieldSize, fieldStr)
+        i = 1
+    return out
+
+
+PACK_SAMPLES = [
+    ("CreateLobby", [1, 6112, "Sheeo", 42, 1]),
+    ("HostGame", ["SCMP_007"]),
+    ("ConnectToPeer", ["127.0.0.1:12001", u"login", 7]),
+    ("GameOption", ["Title", "tabs\tand\nnewlines"]),
+    ("Ping", []),
+    ("Odd\tHeader", [-5, ""]),
+]
+
+
+@pytest.mark.parametrize("action,chunks", PACK_SAMPLES)
+def test_encode_matches_legacy_pack(action, chunks):
+    assert gpgnet.encode(action, chunks) == legacy_pack(action, chunks)
+
+
+@pytest.mark.parametrize("action,chunks", PACK_SAMPLES + [
+    ("SendNatPacket", ["1.2.3.4:6112", "/PLAYERID 42 Sheeo"]),
+    ("SendNatPacket", [u"1.2.3.4:6112", u"Hello\tthere"]),
+    ("SendNatPacket", [3, "message", 4]),
+])
+def test_encode_udp_matches_legacy_pack_udp(action, chunks):
+    assert gpgnet.encode_udp(action, chunks) == legacy_pack_udp(action, chunks)
+
+
+def test_encoded_frame_decodes_to_the_same_frame():
+    frame = gpgnet.encode("PlayerOption", [7, "Faction", 2, "Aeon"])
+    assert GPGNetDecoder().decode(frame) == [("PlayerOption", [7, "Faction", 2, "Aeon"])]
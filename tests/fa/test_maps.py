@@ -1,7 +1,11 @@
 __author__ = 'Thygrrr'
 
 import pytest
+import struct
+import zipfile
 from fa import maps
+from util.cache import CacheManager
+from tests.fa.standins import StandInVault, wait_for
 from PyQt4 import QtGui, QtNetwork, QtCore
 
 TESTMAP_NAME = "faf_test_map"
@@ -9,3 +13,361 @@ TESTMAP_NAME = "faf_test_map"
 def test_downloader_has_slot_abort(application):
     assert callable(maps.Downloader(TESTMAP_NAME, parent=application).abort)
 
+
+
+def write_dds(path, width, height, bgra):
+    header = bytearray(maps.DDS_HEADER_SIZE)
+    header[0:4] = "DDS "
+    header[12:20] = struct.pack("<II", height, width)
+    with open(path, "wb") as dds:
+        dds.write(header)
+        dds.write(bgra * (width * height))
+
+
+def test_gen_prev_from_dds_converts_bgra_pixels(application, tmpdir):
+    dds = str(tmpdir.join("test.dds"))
+    png = str(tmpdir.join("test.png"))
+    write_dds(dds, 16, 16, "\x10\x20\x30\xff")
+
+    maps.genPrevFromDDS(dds, png)
+
+    image = QtGui.QImage(png)
+    assert (image.width(), image.height()) == (16, 16)
+    assert QtGui.QColor(image.pixel(5, 5)).getRgb()[:3] == (0x30, 0x20, 0x10)
+
+
+def test_gen_prev_from_dds_scales_small_previews(application, tmpdir):
+    dds = str(tmpdir.join("test.dds"))
+    png = str(tmpdir.join("test.png"))
+    write_dds(dds, 256, 256, "\x00\x00\xff\x00")
+
+    maps.genPrevFromDDS(dds, png, small=True)
+
+    image = QtGui.QImage(png)
+    assert (image.width(), image.height()) == (100, 100)
+    assert QtGui.QColor(image.pixel(50, 50)).getRgb()[:3] == (0xff, 0, 0)
+
+
+def make_catalogue(tmpdir):
+    user = tmpdir.mkdir("user")
+    base = tmpdir.mkdir("base")
+    return maps.MapCatalogue(lambda: str(user), lambda: str(base)), user, base
+
+
+def test_catalogue_finds_user_maps_case_insensitively(tmpdir):
+    catalogue, user, base = make_catalogue(tmpdir)
+    user.mkdir("Some_Map.v0002")
+
+    assert catalogue.isAvailable("some_map.v0002")
+    assert catalogue.folderFor("SOME_MAP.V0002") == str(user.join("Some_Map.v0002"))
+    assert not catalogue.isAvailable("other_map")
+    assert catalogue.folderFor("other_map") is None
+
+
+def test_catalogue_knows_official_maps(tmpdir):
+    catalogue, user, base = make_catalogue(tmpdir)
+
+    assert catalogue.isAvailable("scmp_007")
+    assert catalogue.folderFor("scmp_007") == str(base.join("scmp_007"))
+
+
+def test_catalogue_lists_user_and_base_maps(tmpdir):
+    catalogue, user, base = make_catalogue(tmpdir)
+    user.mkdir("user_map")
+    base.mkdir("scmp_001")
+
+    assert catalogue.userMaps() == ["user_map"]
+    assert sorted(catalogue.allMaps()) == ["scmp_001", "user_map"]
+
+
+def test_catalogue_picks_up_changed_maps_folder(tmpdir):
+    catalogue, user, base = make_catalogue(tmpdir)
+    assert not catalogue.isAvailable("new_map")
+
+    user.mkdir("new_map")
+    user.setmtime(user.mtime() + 10)
+    assert catalogue.isAvailable("new_map")
+
+
+def test_catalogue_refreshes_after_invalidate(tmpdir):
+    catalogue, user, base = make_catalogue(tmpdir)
+    mtime = user.mtime()
+    assert not catalogue.isAvailable("new_map")
+
+    user.mkdir("new_map")
+    user.setmtime(mtime)
+    catalogue.invalidate()
+    assert catalogue.isAvailable("new_map")
+
+
+def temp_preview_cache(tmpdir):
+    return CacheManager(str(tmpdir), 1024 * 1024, 1024 * 1024, QtGui.QPixmap, lambda pix: 1)
+
+
+def test_preview_service_coalesces_requests_for_the_same_map(application, monkeypatch, tmpdir):
+    calls = []
+
+    def slow_preview_file(mapname, force=False):
+        calls.append(mapname)
+        QtCore.QThread.msleep(100)
+        return None
+
+    monkeypatch.setattr(maps.util, "CACHE_DIR", str(tmpdir))
+    monkeypatch.setattr(maps.util, "previewCache", temp_preview_cache(tmpdir))
+    monkeypatch.setattr(maps, "previewFile", slow_preview_file)
+    service = maps.PreviewService()
+    results = []
+
+    service.request("some_map", results.append)
+    service.request("SOME_MAP", results.append)
+    service.request("other_map", results.append)
+
+    while len(results) < 3:
+        application.processEvents()
+    assert sorted(calls) == ["other_map", "some_map"]
+    assert results == [None, None, None]
+
+
+def test_preview_service_returns_cached_previews_without_a_job(application, monkeypatch, tmpdir):
+    monkeypatch.setattr(maps.util, "CACHE_DIR", str(tmpdir))
+    monkeypatch.setattr(maps.util, "previewCache", temp_preview_cache(tmpdir))
+    monkeypatch.setattr(maps, "previewFile", lambda mapname, force=False: pytest.fail("started a job"))
+    image = QtGui.QImage(4, 4, QtGui.QImage.Format_RGB32)
+    image.save(str(tmpdir.join("cached_map.png")))
+
+    icon = maps.PreviewService().request("cached_map", pixmap=True)
+
+    assert icon.width() == 4
+
+
+def make_map_zip(path, mapname, sounds=True):
+    with zipfile.ZipFile(str(path), "w") as zfile:
+        zfile.writestr(mapname + "/", "")
+        zfile.writestr(mapname + "/" + mapname + ".scmap", "\x00" * 4096)
+        zfile.writestr(mapname + "/" + mapname + "_scenario.lua", "version = 3")
+        if sounds:
+            zfile.writestr(mapname + "/sounds/Voice/us/" + mapname + ".xwb", "voice")
+    return str(path)
+
+
+@pytest.fixture
+def maps_folders(tmpdir, monkeypatch):
+    user = tmpdir.mkdir("maps")
+    sounds = tmpdir.mkdir("sounds")
+    monkeypatch.setattr(maps, "getUserMapsFolder", lambda: str(user))
+    monkeypatch.setattr(maps, "catalogue", maps.MapCatalogue(lambda: str(user), lambda: str(tmpdir.join("base"))))
+    monkeypatch.setattr(maps.util, "SOUND_DIR", str(sounds))
+    return user, sounds
+
+
+def test_install_map_extracts_map_and_sounds(maps_folders, tmpdir):
+    user, sounds = maps_folders
+    maps.installMap(make_map_zip(tmpdir.join("some_map.zip"), "some_map"))
+
+    assert user.join("some_map", "some_map.scmap").size() == 4096
+    assert user.join("some_map", "some_map_scenario.lua").read() == "version = 3"
+    assert not user.join("some_map", "sounds").check()
+    assert sounds.join("Voice", "us", "some_map.xwb").read() == "voice"
+
+
+def test_install_map_skips_members_outside_the_maps_folder(maps_folders, tmpdir):
+    user, _ = maps_folders
+    zipname = str(tmpdir.join("evil.zip"))
+    with zipfile.ZipFile(zipname, "w") as zfile:
+        zfile.writestr("../evil.txt", "evil")
+        zfile.writestr("evil_map/evil_map.scmap", "map")
+    maps.installMap(zipname)
+
+    assert not tmpdir.join("evil.txt").check()
+    assert user.join("evil_map", "evil_map.scmap").check()
+
+
+def test_install_map_removes_the_map_when_cancelled(maps_folders, tmpdir):
+    user, _ = maps_folders
+    zipname = make_map_zip(tmpdir.join("some_map.zip"), "some_map")
+    checks = []
+
+    def cancelled():
+        checks.append(True)
+        return len(checks) > 2
+
+    with pytest.raises(maps.DownloadCancelled):
+        maps.installMap(zipname, cancelled)
+    assert not user.join("some_map").check()
+
+
+def test_downloader_streams_map_from_the_vault(application, maps_folders, tmpdir):
+    user, _ = maps_folders
+    data = open(make_map_zip(tmpdir.join("some_map.zip"), "some_map")).read()
+    vault = StandInVault({"/maps/some_map.zip": data})
+    downloader = maps.Downloader("some_map", download_root=vault.root, count=False)
+    progress = []
+    finished = []
+    downloader.progress_value.connect(progress.append)
+    downloader.finished.connect(lambda: finished.append(True))
+
+    downloader.run()
+
+    assert wait_for(application, lambda: finished)
+    assert progress[-1] == len(data)
+    assert user.join("some_map", "some_map.scmap").check()
+    vault.shutdown()
+
+
+def test_downloader_fails_for_maps_not_in_the_vault(application, maps_folders):
+    vault = StandInVault({})
+    downloader = maps.Downloader("no_map", download_root=vault.root, count=False)
+    failed = []
+    downloader.failed.connect(failed.append)
+
+    downloader.run()
+
+    assert wait_for(application, lambda: failed)
+    assert isinstance(downloader.error, maps.HTTPError)
+    vault.shutdown()
+
+
+def stand_in_vault_with_maps(tmpdir, names, delay=0):
+    files = {}
+    for name in names:
+        files["/maps/%s.zip" % name] = open(make_map_zip(tmpdir.join(name + ".zip"), name, sounds=False), "rb").read()
+    return StandInVault(files, delay)
+
+
+def test_prefetcher_downloads_each_map_once_with_bounded_concurrency(application, maps_folders, tmpdir):
+    names = ["map_%i" % i for i in range(5)]
+    vault = stand_in_vault_with_maps(tmpdir, names, delay=0.2)
+    prefetcher = maps.MapPrefetcher(parallel=2, download_root=vault.root)
+    ready = []
+    prefetcher.mapReady.connect(ready.append)
+
+    for uid, name in enumerate(names):
+        prefetcher.request(name, uid)
+    prefetcher.request("MAP_0", 42)
+
+    assert wait_for(application, lambda: len(ready) == len(names))
+    assert sorted(vault.requests) == sorted("/maps/%s.zip" % name for name in names)
+    assert vault.peak == 2
+    assert all(maps.isMapAvailable(name) for name in names)
+    assert not prefetcher.request("map_0", 43)
+    vault.shutdown()
+
+
+def test_prefetcher_fetches_maps_of_friends_and_focused_games_first(application, maps_folders, tmpdir):
+    vault = stand_in_vault_with_maps(tmpdir, ["first", "normal", "friend", "focused"], delay=0.1)
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    ready = []
+    prefetcher.mapReady.connect(ready.append)
+
+    prefetcher.request("first", 1)
+    prefetcher.request("normal", 2)
+    prefetcher.request("friend", 3, maps.PRIORITY_FRIEND)
+    prefetcher.request("focused", 4)
+    prefetcher.focus("focused")
+
+    assert wait_for(application, lambda: len(ready) == 4)
+    assert ready == ["first", "focused", "friend", "normal"]
+    vault.shutdown()
+
+
+def test_prefetcher_still_fetches_maps_whose_priority_was_lowered(application, maps_folders, tmpdir):
+    vault = stand_in_vault_with_maps(tmpdir, ["busy", "lowered"], delay=0.1)
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    ready = []
+    prefetcher.mapReady.connect(ready.append)
+
+    prefetcher.request("busy", 1)
+    prefetcher.request("lowered", 2, maps.PRIORITY_FRIEND)
+    prefetcher.request("lowered", 2, maps.PRIORITY_NORMAL)
+
+    assert wait_for(application, lambda: len(ready) == 2)
+    assert ready == ["busy", "lowered"]
+    assert prefetcher.wanted == {}
+    vault.shutdown()
+
+
+def test_prefetcher_drops_maps_of_closed_games(application, maps_folders, tmpdir):
+    vault = stand_in_vault_with_maps(tmpdir, ["first", "closed", "shared"], delay=0.1)
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    ready = []
+    prefetcher.mapReady.connect(ready.append)
+
+    prefetcher.request("first", 1)
+    prefetcher.request("closed", 2)
+    prefetcher.request("shared", 3)
+    prefetcher.request("shared", 4)
+    prefetcher.cancel("closed", 2)
+    prefetcher.cancel("shared", 3)
+
+    assert wait_for(application, lambda: len(ready) == 2)
+    assert ready == ["first", "shared"]
+    assert "/maps/closed.zip" not in vault.requests
+    vault.shutdown()
+
+
+def test_prefetcher_aborts_running_download_nobody_needs(application, maps_folders, tmpdir):
+    vault = stand_in_vault_with_maps(tmpdir, ["slow"], delay=0.5)
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    failed = []
+    prefetcher.mapFailed.connect(failed.append)
+
+    prefetcher.request("slow", 1)
+    prefetcher.cancel("slow", 1)
+
+    assert wait_for(application, lambda: failed)
+    assert not maps.isMapAvailable("slow")
+    assert prefetcher.request("slow", 2)
+    vault.shutdown()
+
+
+def test_download_takes_over_and_counts_a_running_prefetch(application, maps_folders, tmpdir, monkeypatch):
+    counted = []
+    monkeypatch.setattr(maps, "countDownload", counted.append)
+    vault = stand_in_vault_with_maps(tmpdir, ["slow"], delay=0.3)
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    ready = []
+    prefetcher.mapReady.connect(ready.append)
+
+    prefetcher.request("slow", 1)
+    prefetched = prefetcher.running["slow"]
+    assert prefetcher.download("slow") is prefetched
+
+    assert wait_for(application, lambda: ready)
+    assert counted == ["slow"]
+    assert vault.requests == ["/maps/slow.zip"]
+    vault.shutdown()
+
+
+def test_download_replaces_an_aborted_prefetch(application, maps_folders, tmpdir, monkeypatch):
+    monkeypatch.setattr(maps, "countDownload", lambda name: None)
+    vault = stand_in_vault_with_maps(tmpdir, ["slow"], delay=0.3)
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    ready = []
+    prefetcher.mapReady.connect(ready.append)
+
+    prefetcher.request("slow", 1)
+    aborted = prefetcher.running["slow"]
+    prefetcher.cancel("slow", 1)
+    downloader = prefetcher.download("slow")
+
+    assert downloader is not aborted
+    assert not downloader.cancelled
+    assert wait_for(application, lambda: ready and not downloader.isRunning() and not aborted.isRunning())
+    assert downloader.error is None
+    assert maps.isMapAvailable("slow")
+    assert prefetcher.running == {}
+    vault.shutdown()
+
+
+def test_prefetcher_does_not_retry_failed_maps(application, maps_folders, tmpdir):
+    vault = StandInVault({})
+    prefetcher = maps.MapPrefetcher(parallel=1, download_root=vault.root)
+    failed = []
+    prefetcher.mapFailed.connect(failed.append)
+
+    prefetcher.request("missing", 1)
+
+    assert wait_for(application, lambda: failed)
+    assert not prefetcher.request("missing", 2)
+    assert prefetcher.download("missing") is not None
+    vault.shutdown()
@@ -0,0 +1,92 @@
+import socket
+import threading
+
+import pytest
+
+from fa import framing, relayserver
+from fa.gpgnet import BlockReader
+from PyQt4 import QtNetwork
+from tests.fa.standins import wait_for
+
+
+class StandInRelayServer(threading.Thread):
+    """
+    Plays the FAF relay server for one Relayer: pings it after authentication
+    and after a framing switch, and records every message with the framing it
+    arrived in.
+    """
+    def __init__(self, supported_framings):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.supported = supported_framings
+        self.received = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def run(self):
+        conn, _ = self.listener.accept()
+        reader = BlockReader()
+        inbound = outbound = framing.LEGACY
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            reader.feed(data)
+            for block in reader.blocks():
+                message = inbound.decode(block)
+                self.received.append((inbound.name, message["action"]))
+                action, chunks = message["action"], message["chunks"]
+                if action == "SetFraming" and chunks[0] in self.supported:
+                    conn.sendall(outbound.encode(dict(key="Framing", commands=chunks)))
+                    outbound = framing.get_framing(chunks[0])
+                elif action == "Framing":
+                    inbound = framing.get_framing(chunks[0])
+                    conn.sendall(outbound.encode(dict(key="ping", commands=[])))
+                elif action == "Authenticate":
+                    conn.sendall(outbound.encode(dict(key="ping", commands=[])))
+        conn.close()
+
+
+class Client(object):
+    session = 1234
+    id = 42
+
+
+def relay_with(monkeypatch, server, framing_name):
+    monkeypatch.setattr(relayserver, "FAF_SERVER_HOST", "127.0.0.1")
+    monkeypatch.setattr(relayserver, "FAF_SERVER_PORT", server.port)
+    monkeypatch.setattr(relayserver, "FAF_SERVER_FRAMING", framing_name)
+    server.start()
+    return relayserver.Relayer(None, Client(), QtNetwork.QTcpSocket(), False)
+
+
+def test_relayer_stays_on_legacy_framing_with_legacy_server(application, monkeypatch):
+    server = StandInRelayServer(supported_framings=[])
+    relay = relay_with(monkeypatch, server, "json")
+
+    assert wait_for(application, lambda: ("qstring", "pong") in server.received)
+    assert relay.framing is framing.LEGACY
+    assert set(server.received) == {("qstring", "Authenticate"), ("qstring", "SetFraming"), ("qstring", "pong")}
+    relay.relaySocket.abort()
+
+
+def test_relayer_does_not_offer_legacy_framing(application, monkeypatch):
+    server = StandInRelayServer(supported_framings=["json"])
+    relay = relay_with(monkeypatch, server, "qstring")
+
+    assert wait_for(application, lambda: ("qstring", "pong") in server.received)
+    assert ("qstring", "SetFraming") not in server.received
+    relay.relaySocket.abort()
+
+
+@pytest.mark.parametrize("framing_name", sorted(set(framing.FRAMINGS) - {"qstring"}))
+def test_relayer_switches_to_negotiated_framing(application, monkeypatch, framing_name):
+    server = StandInRelayServer(supported_framings=[framing_name])
+    relay = relay_with(monkeypatch, server, framing_name)
+
+    assert wait_for(application, lambda: (framing_name, "pong") in server.received)
+    assert relay.framing.name == framing_name
+    assert server.received.index(("qstring", "Framing")) < server.received.index((framing_name, "pong"))
+    relay.relaySocket.abort()
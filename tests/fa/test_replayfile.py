@@ -0,0 +1,233 @@
+import base64
+import json
+import os
+import random
+import struct
+import zlib
+
+import pytest
+from PyQt4 import QtCore
+
+from fa import replayfile
+
+
+def replay_data(size, seed=1):
+    rng = random.Random(seed)
+    # Replays are mostly repetitive command streams
+    return "".join(rng.choice(["\x00\x01move", "\x0bfire", "\x02" * 40, chr(rng.randrange(256))])
+                   for _ in range(size // 8))
+
+
+def write_replay(folder, name, data, info, step=1000):
+    writer = replayfile.ReplayWriter(folder)
+    for start in range(0, len(data), step):
+        writer.write(data[start:start + step])
+    filename = os.path.join(folder, name)
+    writer.finish(filename, info)
+    return filename
+
+
+def write_v1_replay(folder, name, data, info):
+    # The way the client wrote replays before version 2, with QtCore.qCompress and toBase64
+    filename = os.path.join(folder, name)
+    with open(filename, "wt") as replay:
+        replay.write(json.dumps(info) + "\n")
+        replay.write(base64.b64encode(struct.pack(">I", len(data)) + zlib.compress(data)))
+    return filename
+
+
+def test_writes_header_and_chunk_index(tmpdir, monkeypatch):
+    monkeypatch.setattr(replayfile, "CHUNK_SIZE", 4096)
+    data = replay_data(10000)
+    filename = write_replay(str(tmpdir), "1-me.fafreplay", data, {"uid": 1, "recorder": "me"})
+
+    with open(filename, "rb") as replay:
+        magic, version = struct.unpack(">9sB", replay.read(10))
+        assert (magic, version) == ("FAFREPLAY", 2)
+        body = replay.read()
+    length, count = struct.unpack(">II", body[-8:])
+    index = body[-8 - count * 8:-8]
+    chunks = [struct.unpack(">II", index[i:i + 8]) for i in range(0, len(index), 8)]
+    assert [size for _, size in chunks] == [len(data[i:i + 4096]) for i in range(0, len(data), 4096)]
+    header = body[:-8 - count * 8][-length:]
+    assert json.loads(header) == {"uid": 1, "recorder": "me"}
+    offset = 0
+    pieces = []
+    for compressed, _ in chunks:
+        pieces.append(zlib.decompress(body[offset:offset + compressed]))
+        offset += compressed
+    assert offset == len(body) - 8 - count * 8 - length
+    assert "".join(pieces) == data
+    assert os.listdir(str(tmpdir)) == ["1-me.fafreplay"]
+
+
+def test_reads_any_part_of_the_replay(tmpdir, monkeypatch):
+    monkeypatch.setattr(replayfile, "CHUNK_SIZE", 1000)
+    data = replay_data(20000, seed=2)
+    rng = random.Random(3)
+    writer = replayfile.ReplayWriter(str(tmpdir))
+    start = 0
+    while start < len(data):
+        step = rng.choice([0, 1, 2, 3, 7, 500, 2500])
+        writer.write(data[start:start + step])
+        start += step
+    filename = os.path.join(str(tmpdir), "2-me.fafreplay")
+    writer.finish(filename, {"uid": 2})
+
+    with replayfile.ReplayFile(filename) as replay:
+        assert replay.version == 2
+        assert replay.info == {"uid": 2}
+        assert replay.size == len(data)
+        assert "".join(replay.blocks()) == data
+        for offset, count in [(0, 10), (999, 2), (1000, 1000), (4321, 5000), (len(data) - 5, 100)]:
+            assert replay.read(offset, count) == data[offset:offset + count]
+
+
+def test_reads_version_1_replays(tmpdir):
+    data = replay_data(20000, seed=4)
+    filename = write_v1_replay(str(tmpdir), "3-me.fafreplay", data, {"uid": 3})
+
+    with replayfile.ReplayFile(filename) as replay:
+        assert replay.version == 1
+        assert replay.info == {"uid": 3}
+        assert "".join(replay.blocks()) == data
+        assert replay.read(100, 50) == data[100:150]
+
+
+@pytest.mark.parametrize("size,base64_block,block", [
+    (0, 256 * 1024, 1024 * 1024),
+    (50000, 1, 1024 * 1024),
+    (50000, 7, 100),
+    (300000, 4096, 333),
+])
+def test_decodes_version_1_replays_as_a_stream(tmpdir, monkeypatch, size, base64_block, block):
+    monkeypatch.setattr(replayfile, "BASE64_BLOCK_SIZE", base64_block)
+    monkeypatch.setattr(replayfile, "BLOCK_SIZE", block)
+    data = replay_data(size, seed=size)
+    filename = write_v1_replay(str(tmpdir), "3-me.fafreplay", data, {"uid": 3})
+
+    with replayfile.ReplayFile(filename) as replay:
+        blocks = list(replay.blocks())
+    assert "".join(blocks) == data
+    assert max([0] + map(len, blocks)) <= block
+
+
+def test_extracts_what_qt_extracted(tmpdir):
+    data = replay_data(200000, seed=6)
+    filename = write_v1_replay(str(tmpdir), "3-me.fafreplay", data, {"uid": 3})
+    destination = os.path.join(str(tmpdir), "temp.scfareplay")
+
+    # How fa.replay extracted replays before
+    with open(filename, "rt") as replay:
+        replay.readline()
+        binary = QtCore.qUncompress(QtCore.QByteArray.fromBase64(replay.read()))
+
+    assert replayfile.extract(filename, destination) == ({"uid": 3}, binary.size())
+    assert open(destination, "rb").read() == str(binary)
+
+
+def test_extract_reports_progress_and_can_be_cancelled(tmpdir, monkeypatch):
+    monkeypatch.setattr(replayfile, "CHUNK_SIZE", 10000)
+    data = replay_data(100000, seed=7)
+    filename = write_replay(str(tmpdir), "8-me.fafreplay", data, {"uid": 8})
+    destination = os.path.join(str(tmpdir), "temp.scfareplay")
+
+    reports = []
+    assert replayfile.extract(filename, destination, lambda done, total: reports.append((done, total))) == \
+        ({"uid": 8}, len(data))
+    assert open(destination, "rb").read() == data
+    assert len(reports) == (len(data) + 9999) // 10000
+    assert reports[-1][0] == reports[-1][1]
+    assert reports == sorted(reports)
+
+    assert replayfile.extract(filename, destination, cancelled=lambda: True) is None
+
+
+def test_truncated_version_1_replay_raises_value_error(tmpdir):
+    data = replay_data(50000, seed=8)
+    filename = write_v1_replay(str(tmpdir), "9-me.fafreplay", data, {"uid": 9})
+    with open(filename, "r+b") as replay:
+        replay.truncate(os.path.getsize(filename) - 400)
+
+    with replayfile.ReplayFile(filename) as replay:
+        with pytest.raises(ValueError):
+            list(replay.blocks())
+
+
+def test_corrupt_chunk_raises_value_error(tmpdir):
+    filename = write_replay(str(tmpdir), "4-me.fafreplay", replay_data(5000), {"uid": 4})
+    with open(filename, "r+b") as replay:
+        replay.seek(20)
+        replay.write("\xff" * 10)
+
+    with replayfile.ReplayFile(filename) as replay:
+        with pytest.raises(ValueError):
+            list(replay.blocks())
+
+
+def test_converts_version_1_replays_in_folder(tmpdir):
+    folder = str(tmpdir)
+    data = replay_data(30000, seed=5)
+    old = write_v1_replay(folder, "5-me.fafreplay", data, {"uid": 5})
+    os.utime(old, (1000000000, 1000000000))
+    write_replay(folder, "6-me.fafreplay", data, {"uid": 6})
+    with open(os.path.join(folder, "7-me.fafreplay"), "wb") as broken:
+        broken.write('{"uid": 7}\nnot base64 at all')
+
+    assert replayfile.convertFolder(folder) == (1, 1)
+    with replayfile.ReplayFile(old) as replay:
+        assert replay.version == 2
+        assert replay.info == {"uid": 5}
+        assert "".join(replay.blocks()) == data
+    assert os.path.getmtime(old) == 1000000000
+    assert sorted(os.listdir(folder)) == ["5-me.fafreplay", "6-me.fafreplay", "7-me.fafreplay"]
+
+
+def test_finishing_renames_the_spool_file(tmpdir, monkeypatch):
+    writer = replayfile.ReplayWriter(str(tmpdir))
+    writer.write(replay_data(5000))
+    spoolname = writer.spoolname
+    spooled = os.path.getsize(spoolname)
+    filename = os.path.join(str(tmpdir), "10-me.fafreplay")
+
+    renamed = []
+    rename = os.rename
+    monkeypatch.setattr(replayfile.os, "rename", lambda source, destination: renamed.append(source) or
+                        rename(source, destination))
+    writer.finish(filename, {"uid": 10})
+    monkeypatch.setattr(replayfile.os, "rename", rename)
+
+    assert renamed == [spoolname]
+    assert os.path.getsize(filename) > spooled
+    assert os.listdir(str(tmpdir)) == ["10-me.fafreplay"]
+
+
+def test_failed_finish_leaves_nothing_behind(tmpdir, monkeypatch):
+    writer = replayfile.ReplayWriter(str(tmpdir))
+    writer.write(replay_data(5000))
+    rename = os.rename
+
+    def locked(source, destination):
+        raise OSError("locked")
+    monkeypatch.setattr(replayfile.os, "rename", locked)
+    with pytest.raises(OSError):
+        writer.finish(os.path.join(str(tmpdir), "11-me.fafreplay"), {"uid": 11})
+    monkeypatch.setattr(replayfile.os, "rename", rename)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_truncated_version_2_replay_raises_value_error(tmpdir):
+    filename = write_replay(str(tmpdir), "12-me.fafreplay", replay_data(5000), {"uid": 12})
+    with open(filename, "r+b") as replay:
+        replay.truncate(os.path.getsize(filename) - 3)
+
+    with pytest.raises(ValueError):
+        replayfile.ReplayFile(filename)
+
+
+def test_spools_to_disk_while_recording(tmpdir):
+    writer = replayfile.ReplayWriter(str(tmpdir))
+    writer.write(os.urandom(300000))
+    assert os.path.getsize(writer.spoolname) > 0
+    writer.discard()
+    assert os.listdir(str(tmpdir)) == []
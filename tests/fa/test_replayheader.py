@@ -0,0 +1,119 @@
+import os
+import struct
+
+import pytest
+
+from fa import replayfile, replayheader
+
+
+def lua(value):
+    if value is None:
+        return "\x02\x00"
+    if isinstance(value, bool):
+        return "\x03" + chr(value)
+    if isinstance(value, (int, float)):
+        return "\x00" + struct.pack("<f", value)
+    if isinstance(value, basestring):
+        return "\x01" + value.encode("utf-8") + "\0"
+    return "\x04" + "".join(lua(key) + lua(item) for key, item in sorted(value.items())) + "\x05"
+
+
+def sized_lua(value):
+    data = lua(value)
+    return struct.pack("<I", len(data)) + data
+
+
+MODS = {1: {"name": "Forged Alliance Forever", "uid": "faf-1"}, 2: {"name": "Kinds", "uid": "k-2", "ui_only": True}}
+SCENARIO = {"map": "/maps/scmp_009/scmp_009.scmap", "Options": {"Victory": "demoralization", "Timeouts": None}}
+ARMIES = [(0, {"PlayerName": u"Z\xe9ro", "Faction": 1, "Team": 2, "Human": True}),
+          (255, {"PlayerName": "civilian", "Human": False}),
+          (1, {"PlayerName": "Sheeo", "Faction": 3, "Team": 3, "Human": True})]
+
+
+def scfa_header(version="Supreme Commander v1.50.3599", seed=1234):
+    return "".join([
+        version + "\0", "\r\n\0",
+        "Replay v1.9\r\n/maps/scmp_009/scmp_009.scmap\0", "\r\n\x1a\0",
+        sized_lua(MODS),
+        sized_lua(SCENARIO),
+        "\x02", u"Z\xe9ro".encode("utf-8") + "\0", struct.pack("<I", 4711), "Sheeo\0", struct.pack("<I", 42),
+        "\x00",
+        chr(len(ARMIES)),
+        "".join(sized_lua(army) + chr(source) + ("" if source == 255 else "\x00") for source, army in ARMIES),
+        struct.pack("<I", seed),
+    ])
+
+
+class CountingFile(object):
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, count):
+        data = self.data[self.position:self.position + count]
+        self.position += len(data)
+        return data
+
+
+def test_parses_the_header():
+    header = replayheader.parse(CountingFile(scfa_header()))
+    assert header.version == "Supreme Commander v1.50.3599"
+    assert header.patch == "3599"
+    assert header.replay_version == "Replay v1.9"
+    assert header.map_path == "/maps/scmp_009/scmp_009.scmap"
+    assert [mod["uid"] for mod in header.mods] == ["faf-1", "k-2"]
+    assert header.scenario["Options"] == {"Victory": "demoralization", "Timeouts": None}
+    assert header.players == {u"Z\xe9ro": 4711, "Sheeo": 42}
+    assert header.cheats_enabled is False
+    assert header.armies[255]["Human"] is False
+    assert header.armies[1]["Faction"] == 3.0
+    assert header.player_names == [u"Z\xe9ro", "Sheeo"]
+    assert header.random_seed == 1234
+
+
+def test_reads_only_the_start_of_long_replays():
+    f = CountingFile(scfa_header() + "\xff" * (10 * 1024 * 1024))
+    replayheader.parse(f)
+    assert f.position <= replayheader.READ_SIZE
+
+
+def test_unknown_version_has_no_patch():
+    header = replayheader.parse(CountingFile(scfa_header(version="Supreme Commander v2.0")))
+    assert header.patch is None
+
+
+@pytest.mark.parametrize("data", [
+    "",
+    "not a replay\0" + "x" * 100,
+    scfa_header()[:200],
+    scfa_header()[:-1],
+])
+def test_broken_headers_raise_value_error(data):
+    with pytest.raises(ValueError):
+        replayheader.parse(CountingFile(data))
+
+
+def test_version_is_read_from_broken_headers(tmpdir):
+    broken = scfa_header()[:200]
+    assert replayheader.parse_version(CountingFile(broken)) == "Supreme Commander v1.50.3599"
+
+    scfareplay = os.path.join(str(tmpdir), "broken.scfareplay")
+    with open(scfareplay, "wb") as f:
+        f.write(broken)
+    assert replayheader.game_patch(replayheader.read_version(scfareplay)) == "3599"
+    with pytest.raises(ValueError):
+        replayheader.read_header(scfareplay)
+
+
+def test_reads_header_of_scfareplay_and_fafreplay(tmpdir):
+    data = scfa_header(seed=99) + os.urandom(100000)
+    scfareplay = os.path.join(str(tmpdir), "old.scfareplay")
+    with open(scfareplay, "wb") as f:
+        f.write(data)
+    writer = replayfile.ReplayWriter(str(tmpdir))
+    writer.write(data)
+    fafreplay = os.path.join(str(tmpdir), "1-me.fafreplay")
+    writer.finish(fafreplay, {"uid": 1})
+
+    assert replayheader.read_header(scfareplay).random_seed == 99
+    assert replayheader.read_header(fafreplay).random_seed == 99
@@ -0,0 +1,158 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from fa import replayupload
+from tests.fa.standins import wait_for
+
+HEADER = "P/1234/me.scfareplay\0"
+
+
+class StandInLiveReplayServer(threading.Thread):
+    """
+    Plays the live replay server: records what every connection sends. The
+    first connection is closed after cut bytes if set, reading waits for the
+    paused event to be cleared.
+    """
+    def __init__(self, listener=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.listener = listener or bound_socket()
+        self.listener.listen(5)
+        self.port = self.listener.getsockname()[1]
+        self.connections = []
+        self.cut = None
+        self.paused = threading.Event()
+
+    def run(self):
+        while True:
+            conn, _ = self.listener.accept()
+            received = []
+            self.connections.append(received)
+            while True:
+                while self.paused.is_set():
+                    time.sleep(0.01)
+                data = conn.recv(65536)
+                if not data:
+                    break
+                received.append(data)
+                if self.cut is not None and len(self.connections) == 1 and len("".join(received)) >= self.cut:
+                    break
+            conn.close()
+
+    def received(self, i):
+        return "".join(self.connections[i])
+
+
+def bound_socket():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("127.0.0.1", 0))
+    return s
+
+
+def replay_data(size):
+    return "".join(chr(i % 251) for i in range(size))
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(replayupload, "RETRY_DELAY", 50)
+    monkeypatch.setattr(replayupload, "RETRY_MAX_DELAY", 200)
+
+
+def upload(server_port, pieces):
+    uploader = replayupload.ReplayUploader("127.0.0.1", server_port)
+    finished = []
+    uploader.finished.connect(lambda: finished.append(True))
+    for piece in pieces:
+        uploader.write(piece)
+    return uploader, finished
+
+
+def test_uploads_everything_and_finishes(application):
+    server = StandInLiveReplayServer()
+    server.start()
+    data = replay_data(500000)
+    uploader, finished = upload(server.port,
+                                [HEADER + data[:1000]] + [data[i:i + 7000] for i in range(1000, len(data), 7000)])
+    uploader.finish()
+
+    assert wait_for(application, lambda: finished)
+    assert wait_for(application, lambda: len(server.received(0)) == len(HEADER + data))
+    assert server.received(0) == HEADER + data
+    assert uploader.dropped == 0
+    assert uploader.sent == len(data)
+
+
+def test_buffers_until_the_server_comes_up(application, fast_retries):
+    listener = bound_socket()
+    data = replay_data(100000)
+    uploader, finished = upload(listener.getsockname()[1], [HEADER, data])
+
+    # Connection refused a few times
+    time.sleep(0.2)
+    application.processEvents()
+    assert uploader.buffered == len(data)
+
+    server = StandInLiveReplayServer(listener)
+    server.start()
+    uploader.finish()
+    assert wait_for(application, lambda: finished)
+    assert wait_for(application, lambda: len(server.received(0)) == len(HEADER + data))
+    assert server.received(0) == HEADER + data
+
+
+def test_reconnects_with_the_header_after_losing_the_server(application, fast_retries):
+    server = StandInLiveReplayServer()
+    server.cut = 5000
+    server.start()
+    data = replay_data(20000)
+    uploader, finished = upload(server.port, [HEADER + data[:10000]])
+    assert wait_for(application, lambda: uploader.isConnected() and len(server.connections) == 2)
+    uploader.write(data[10000:])
+    uploader.finish()
+    assert wait_for(application, lambda: finished)
+    assert wait_for(application, lambda: server.received(1).endswith(data[10000:]))
+    assert server.received(0).startswith(HEADER)
+    assert server.received(1).startswith(HEADER)
+    assert uploader.delay == replayupload.RETRY_DELAY
+
+
+def test_drops_the_oldest_data_when_the_buffer_is_full(application, fast_retries, monkeypatch):
+    monkeypatch.setattr(replayupload, "BUFFER_SIZE", 1000)
+    monkeypatch.setattr(replayupload, "FLUSH_TIMEOUT", 300)
+    listener = bound_socket()
+    uploader, finished = upload(listener.getsockname()[1],
+                                [HEADER] + ["x" * 100 for _ in range(30)])
+    assert uploader.buffered == 1000
+    assert uploader.dropped == 2000
+
+    uploader.finish()
+    assert wait_for(application, lambda: finished)
+    assert uploader.dropped == 3000
+    listener.close()
+
+
+def test_keeps_data_out_of_the_socket_while_the_server_is_slow(application, monkeypatch):
+    monkeypatch.setattr(replayupload, "BUFFER_SIZE", 64 * 1024 * 1024)
+    server = StandInLiveReplayServer()
+    server.paused.set()
+    server.start()
+    # More than the kernel buffers on both ends take
+    data = replay_data(64 * 1024) * 512
+    uploader, finished = upload(server.port, [HEADER])
+    assert wait_for(application, uploader.isConnected)
+
+    for i in range(0, len(data), 64 * 1024):
+        uploader.write(data[i:i + 64 * 1024])
+        application.processEvents()
+        assert uploader.socket.bytesToWrite() <= replayupload.SOCKET_HIGH_WATER + 64 * 1024
+    assert uploader.buffered > 0
+
+    server.paused.clear()
+    uploader.finish()
+    assert wait_for(application, lambda: finished)
+    assert wait_for(application, lambda: len(server.received(0)) == len(HEADER + data))
+    assert server.received(0) == HEADER + data
@@ -1,8 +1,13 @@
 __author__ = 'Thygrrr'
 
+import SocketServer
+import hashlib
+import struct
+import threading
 from fa import updater
 from PyQt4 import QtGui, QtCore
 import pytest
+from tests.fa.standins import StandInVault
 
 class NoIsFinished(QtCore.QObject):
     finished = QtCore.pyqtSignal()
@@ -90,3 +95,121 @@ def test_updater_does_not_hide_and_accept_before_all_watches_are_finished(applic
     assert u.isVisible()
     assert not u.result() == QtGui.QDialog.Accepted
 
+
+def qstring(text):
+    data = unicode(text).encode("utf-16-be")
+    return struct.pack(">I", len(data)) + data
+
+
+def read_qstrings(data):
+    strings = []
+    while data:
+        length, = struct.unpack(">I", data[:4])
+        strings.append(data[4:4 + length].decode("utf-16-be"))
+        data = data[4 + length:]
+    return strings
+
+
+class FakeUpdateServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Speaks the update protocol for file groups given as {group: {file: (md5, url)}}. Files the client
+    has with a different md5 are sent as links to their url. Keeps the requests it got in order.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, groups):
+        SocketServer.TCPServer.__init__(self, ("127.0.0.1", 0), FakeUpdateHandler)
+        self.groups = groups
+        self.files = dict((name, entry) for files in groups.values() for name, entry in files.items())
+        self.requests = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class FakeUpdateHandler(SocketServer.BaseRequestHandler):
+    def read(self, count):
+        data = ""
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def send(self, *strings):
+        block = "".join(qstring(string) for string in strings)
+        self.request.sendall(struct.pack(">I", len(block)) + block)
+
+    def handle(self):
+        while True:
+            header = self.read(4)
+            if header is None:
+                return
+            message = read_qstrings(self.read(struct.unpack(">I", header)[0]))
+            self.server.requests.append(message)
+            action, args = message[0], message[1:]
+            if action == "GET_FILES_TO_UPDATE":
+                self.send("LIST_FILES_TO_UP", repr(sorted(str(name) for name in self.server.groups[args[0]])))
+            elif action in ("UPDATE", "REQUEST_PATH"):
+                destination, name = args[:2]
+                md5, url = self.server.files[name]
+                if action == "UPDATE" and args[2] == md5:
+                    self.send("UP_TO_DATE", name)
+                else:
+                    self.send("SEND_FILE_PATH", destination, name, url)
+
+
+@pytest.fixture
+def update_folders(tmpdir, monkeypatch):
+    monkeypatch.setattr(updater.util, "APPDATA_DIR", str(tmpdir))
+    monkeypatch.setattr(updater.util, "LUA_DIR", str(tmpdir.join("bin")))
+    return tmpdir
+
+
+def serve_update(request, monkeypatch, contents, delay=0):
+    vault = StandInVault(dict(("/" + name, data) for name, data in contents.items()), delay)
+    groups = {"mymod": {}, "mymodGamedata": {}}
+    for name, data in contents.items():
+        group = "mymodGamedata" if name.endswith(".nx2") else "mymod"
+        groups[group][name] = (hashlib.md5(data).hexdigest(), vault.root + name)
+    server = FakeUpdateServer(groups)
+
+    def stop():
+        for stand_in in (server, vault):
+            stand_in.shutdown()
+            stand_in.server_close()
+    request.addfinalizer(stop)
+
+    monkeypatch.setattr(updater.Updater, "HOST", "127.0.0.1")
+    monkeypatch.setattr(updater.Updater, "SOCKET", server.server_address[1])
+    return server, vault
+
+
+def test_updater_downloads_outdated_files(application, update_folders, request, monkeypatch):
+    contents = {"mymod.exe": "exe" * 1000, "mymod.dll": "dll", "mymod.nx2": "nx2" * 1000}
+    update_folders.mkdir("gamedata").join("mymod.nx2").write(contents["mymod.nx2"])
+    update_folders.join("bin").mkdir().join("mymod.dll").write("old dll")
+    server, vault = serve_update(request, monkeypatch, contents)
+
+    assert updater.Updater("mymod", silent=True).run() == updater.Updater.RESULT_SUCCESS
+
+    assert update_folders.join("bin", "mymod.exe").read() == contents["mymod.exe"]
+    assert update_folders.join("bin", "mymod.dll").read() == contents["mymod.dll"]
+    assert sorted(vault.requests) == ["/mymod.dll", "/mymod.exe"]
+
+
+def test_updater_pipelines_requests_and_downloads_in_parallel(application, update_folders, request, monkeypatch):
+    contents = dict(("file%i.dll" % i, "data %i" % i) for i in range(6))
+    server, vault = serve_update(request, monkeypatch, contents, delay=0.5)
+
+    u = updater.Updater("mymod", silent=True)
+    assert u.run() == updater.Updater.RESULT_SUCCESS
+
+    # Every file was asked for in one go, and as many downloads ran at once as allowed
+    actions = [message[0] for message in server.requests]
+    assert actions[:7] == ["GET_FILES_TO_UPDATE"] + ["REQUEST_PATH"] * 6
+    assert vault.peak == u.fetches.parallel
+    for name, data in contents.items():
+        assert update_folders.join("bin", name).read() == data
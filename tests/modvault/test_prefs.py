@@ -0,0 +1,59 @@
+import os
+
+from modvault import prefs
+
+PREFS = """profile = {
+    name = 'Player {1}',
+    -- active_mods = { ['commented'] = true }
+}
+active_mods = {
+    ['a1b2c3d4-0000-0000-0000-000000000001'] = true,
+    ['F3E2D1C0-0000-0000-0000-000000000002'] = false,
+    ["9e8ea941-c306-4751-b367-f00000000005"] = true,
+    nested = { '}' },
+}
+options = {
+    quick_exit = 'true',
+}
+"""
+
+
+def write_prefs(tmpdir, text=PREFS):
+    filename = os.path.join(str(tmpdir), "game.prefs")
+    with open(filename, "wb") as f:
+        f.write(text)
+    return filename
+
+
+def test_finds_table_past_braces_in_strings_and_comments():
+    start, end = prefs.findTable(PREFS, "active_mods")
+    assert PREFS[start:end].startswith("active_mods = {\n    ['a1b2")
+    assert PREFS[end:].startswith("\noptions = {")
+    assert prefs.findTable(PREFS, "missing") is None
+
+
+def test_reads_enabled_keys(tmpdir):
+    assert prefs.readEnabledKeys(write_prefs(tmpdir), "active_mods") == \
+        ["a1b2c3d4-0000-0000-0000-000000000001", "9e8ea941-c306-4751-b367-f00000000005"]
+
+
+def test_replaces_only_the_table(tmpdir):
+    filename = write_prefs(tmpdir)
+    assert prefs.setEnabledKeys(filename, "active_mods", ["uid-1", "uid-2"])
+    start, end = prefs.findTable(PREFS, "active_mods")
+    expected = PREFS[:start] + "active_mods = {\n['uid-1'] = true,\n['uid-2'] = true,\n}" + PREFS[end:]
+    assert open(filename, "rb").read() == expected
+    assert [name for name in os.listdir(str(tmpdir))] == ["game.prefs"]
+
+
+def test_appends_missing_table_in_the_files_line_endings(tmpdir):
+    filename = write_prefs(tmpdir, "options = {\r\n}\r\n")
+    assert prefs.setEnabledKeys(filename, "active_mods", ["uid-1"])
+    assert open(filename, "rb").read() == "options = {\r\n}\r\n\r\nactive_mods = {\r\n['uid-1'] = true,\r\n}"
+
+
+def test_skips_writing_when_nothing_changes(tmpdir, monkeypatch):
+    filename = write_prefs(tmpdir)
+    monkeypatch.setattr(prefs, "writeAtomically", lambda *args: 1 / 0)
+    assert not prefs.setEnabledKeys(filename, "active_mods", ["9e8ea941-c306-4751-b367-f00000000005",
+                                                              "a1b2c3d4-0000-0000-0000-000000000001"])
@@ -0,0 +1,117 @@
+import os
+import time
+import zipfile
+
+import pytest
+
+import util
+from util.cache import ResultCache
+from modvault import utils
+
+MOD_INFO = """name = "%(name)s"
+uid = "%(uid)s"
+version = 3
+author = "Someone"
+ui_only = %(ui_only)s
+"""
+
+
+def mod_info(name, uid, ui_only=False):
+    return MOD_INFO % dict(name=name, uid=uid, ui_only="true" if ui_only else "false")
+
+
+@pytest.fixture
+def mod_folder(tmpdir, monkeypatch):
+    mods = tmpdir.mkdir("mods")
+    monkeypatch.setattr(utils, "MODFOLDER", str(mods))
+    monkeypatch.setattr(utils, "modIndex", utils.ModIndex(str(tmpdir.join("mod_index"))))
+    monkeypatch.setattr(utils, "installedMods", [])
+    monkeypatch.setattr(util, "luaCache", ResultCache(str(tmpdir.join("results")), 100))
+
+    mods.mkdir("folder_mod").join("mod_info.lua").write(mod_info("Folder Mod", "uid-folder"))
+    with zipfile.ZipFile(str(mods.join("zipped_mod.zip")), "w") as zfile:
+        zfile.writestr("zipped_mod/mod_info.lua", mod_info("Zipped Mod", "uid-zip", ui_only=True))
+        zfile.writestr("zipped_mod/hook/big.lua", "x" * 100000)
+    mods.join("broken.zip").write("not a zip")
+    mods.mkdir("no_info")
+    return mods
+
+
+def test_reads_mods_from_folders_and_zips_without_testing_zips(mod_folder, monkeypatch):
+    def testzip(self):
+        raise AssertionError("testzip reads the whole archive")
+    monkeypatch.setattr(zipfile.ZipFile, "testzip", testzip)
+
+    mods = dict((m.uid, m) for m in utils.iterInstalledMods(parallel=3))
+    assert sorted(mods) == ["uid-folder", "uid-zip"]
+    assert mods["uid-folder"].name == "Folder Mod" and not mods["uid-folder"].ui_only
+    assert mods["uid-zip"].localfolder == "zipped_mod.zip" and mods["uid-zip"].ui_only
+    assert mods["uid-zip"].version == 3
+
+
+def test_get_installed_mods_keeps_the_global_list(mod_folder):
+    mods = utils.getInstalledMods()
+    assert mods is utils.installedMods
+    assert [m.uid for m in mods] == ["uid-folder", "uid-zip"]
+
+
+def test_scanner_reports_mods_as_they_are_read(application, mod_folder):
+    scanner = utils.ModScanner()
+    found = []
+    done = []
+    scanner.modFound.connect(lambda mod: found.append(mod.uid))
+    scanner.finished.connect(lambda: done.append(True))
+    scanner.scan()
+
+    deadline = time.time() + 10
+    while not done and time.time() < deadline:
+        application.processEvents()
+        time.sleep(0.01)
+    assert done
+    assert sorted(found) == ["uid-folder", "uid-zip"]
+    assert [m.uid for m in utils.installedMods] == ["uid-folder", "uid-zip"]
+
+
+def test_index_reads_only_new_and_changed_mods(mod_folder, monkeypatch):
+    utils.modIndex.refresh()
+    assert utils.modIndex.is_installed("uid-zip")
+    assert utils.modIndex.get("uid-folder").name == "Folder Mod"
+
+    read = []
+    readMod = utils._readMod
+    monkeypatch.setattr(utils, "_readMod", lambda f: read.append(f) or readMod(f))
+    mod_folder.join("folder_mod", "mod_info.lua").write(mod_info("Renamed Mod", "uid-folder"))
+    mod_folder.mkdir("new_mod").join("mod_info.lua").write(mod_info("New Mod", "uid-new"))
+    mod_folder.join("zipped_mod.zip").remove()
+    utils.modIndex.refresh()
+
+    assert sorted(read) == ["folder_mod", "new_mod"]
+    assert utils.modIndex.get("uid-folder").name == "Renamed Mod"
+    assert utils.modIndex.is_installed("uid-new")
+    assert not utils.modIndex.is_installed("uid-zip")
+
+
+def test_index_is_known_after_restart(mod_folder, tmpdir):
+    utils.modIndex.refresh()
+
+    index = utils.ModIndex(str(tmpdir.join("mod_index")))
+    assert index.get("uid-zip").absfolder == str(mod_folder.join("zipped_mod.zip"))
+    assert "uid-folder" in index
+    assert sorted(m.uid for m in index.mods()) == ["uid-folder", "uid-zip"]
+
+
+def test_set_active_mods_keeps_active_ui_mods(mod_folder, tmpdir, monkeypatch):
+    prefs = tmpdir.join("game.prefs")
+    prefs.write("options = {\n}\nactive_mods = {\n    ['uid-zip'] = true,\n    ['uid-gone'] = true,\n}\n")
+    monkeypatch.setattr(utils, "PREFSFILENAME", str(prefs))
+    folder_mod = utils.getModInfoFromFolder("folder_mod")
+
+    assert utils.setActiveMods([folder_mod], keepuimods=True)
+    assert prefs.read() == "options = {\n}\nactive_mods = {\n['uid-zip'] = true,\n['uid-folder'] = true,\n}\n"
+    assert [m.uid for m in utils.getActiveMods(uimods=False)] == ["uid-folder"]
+
+    # Whole seconds survive os.utime exactly
+    mtime = int(prefs.mtime()) - 100
+    prefs.setmtime(mtime)
+    assert utils.setActiveMods([folder_mod], keepuimods=True)
+    assert prefs.mtime() == mtime
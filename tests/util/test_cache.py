@@ -0,0 +1,172 @@
+import os
+import time
+
+from util.cache import MemoryCache, DiskCache, CacheManager, ResultCache
+
+
+def write(folder, name, size, age=0):
+    filename = os.path.join(folder, name)
+    with open(filename, "wb") as f:
+        f.write("x" * size)
+    if age:
+        then = time.time() - age
+        os.utime(filename, (then, then))
+    return filename
+
+
+def test_memory_cache_evicts_least_recently_used_past_budget():
+    cache = MemoryCache(10, len)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    assert cache.stats() == dict(hits=3, misses=1, evictions=1, bytes=8, entries=2)
+
+
+def test_memory_cache_keeps_single_oversized_value():
+    cache = MemoryCache(2, len)
+    cache.put("a", "aaaa")
+    assert cache.get("a") == "aaaa"
+
+
+def test_disk_cache_finds_existing_files(tmpdir):
+    folder = str(tmpdir)
+    write(folder, "map.png", 10)
+    cache = DiskCache(folder, 100)
+    assert cache.path("map.png") == os.path.join(folder, "map.png")
+    assert cache.path("other.png") is None
+    assert cache.stats() == dict(hits=1, misses=1, evictions=0, bytes=10, entries=1)
+
+
+def test_disk_cache_evicts_least_recently_accessed(tmpdir):
+    folder = str(tmpdir)
+    write(folder, "old.png", 40, age=300)
+    write(folder, "used.png", 40, age=200)
+    cache = DiskCache(folder, 100)
+    cache.path("used.png")
+    write(folder, "new.png", 40)
+    cache.added("new.png")
+    assert not os.path.exists(os.path.join(folder, "old.png"))
+    assert os.path.exists(os.path.join(folder, "used.png"))
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 80
+
+
+def test_disk_cache_access_order_survives_restart(tmpdir):
+    folder = str(tmpdir)
+    write(folder, "a.png", 40, age=300)
+    write(folder, "b.png", 40, age=200)
+    DiskCache(folder, 100).path("a.png")
+
+    cache = DiskCache(folder, 100)
+    write(folder, "c.png", 40)
+    cache.added("c.png")
+    assert os.path.exists(os.path.join(folder, "a.png"))
+    assert not os.path.exists(os.path.join(folder, "b.png"))
+
+
+def test_disk_cache_leaves_other_files_alone(tmpdir):
+    folder = str(tmpdir)
+    write(folder, "temp.fafreplay", 500, age=300)
+    os.mkdir(os.path.join(folder, "somemap"))
+    cache = DiskCache(folder, 100, extensions=(".png",))
+    write(folder, "map.png", 60)
+    cache.added("map.png")
+    assert os.path.exists(os.path.join(folder, "temp.fafreplay"))
+    assert cache.path("temp.fafreplay") is None
+    assert cache.stats()["bytes"] == 60
+
+
+def test_disk_cache_forgets_files_removed_behind_its_back(tmpdir):
+    folder = str(tmpdir)
+    gone = write(folder, "gone.png", 80, age=300)
+    cache = DiskCache(folder, 100)
+    assert cache.stats()["bytes"] == 80
+    os.remove(gone)
+    write(folder, "new.png", 40)
+    cache.added("new.png")
+    assert cache.stats()["bytes"] == 40
+    assert cache.path("gone.png") is None
+
+
+def test_cache_manager_loads_each_file_once(tmpdir):
+    folder = str(tmpdir)
+    write(folder, "map.png", 10)
+    loads = []
+
+    def loader(path):
+        loads.append(path)
+        return open(path).read()
+
+    cache = CacheManager(folder, 100, 100, loader, len)
+    img = cache.file("map.png")
+    assert cache.load(img) == "x" * 10
+    assert cache.load(img) == "x" * 10
+    assert loads == [img]
+    stats = cache.stats()
+    assert stats["memory"]["hits"] == 1
+    assert stats["disk"]["hits"] == 1
+
+
+def test_cache_manager_reloads_files_written_again(tmpdir):
+    folder = str(tmpdir)
+    write(folder, "map.png", 10)
+    cache = CacheManager(folder, 100, 100, lambda path: open(path).read(), len)
+    img = cache.file("map.png")
+    assert cache.load(img) == "x" * 10
+
+    write(folder, "map.png", 20)
+    cache.added("map.png")
+    assert cache.load(cache.file("map.png")) == "x" * 20
+    assert cache.stats()["memory"]["bytes"] == 20
+
+
+def test_result_cache_recomputes_when_file_changes(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "mod_info.lua", 10, age=100)
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return {"name": "x" * len(computed)}
+
+    cache = ResultCache(os.path.join(folder, "results"), 10)
+    assert cache.fetch(filename, "spec", compute) == {"name": "x"}
+    assert cache.fetch(filename, "spec", compute) == {"name": "x"}
+    assert cache.fetch(filename, "other spec", compute) == {"name": "xx"}
+    write(folder, "mod_info.lua", 20)
+    assert cache.fetch(filename, "spec", compute) == {"name": "xxx"}
+    assert cache.stats() == dict(hits=1, misses=3, entries=2)
+
+
+def test_result_cache_hands_out_copies(tmpdir):
+    filename = write(str(tmpdir), "game.prefs", 10)
+    cache = ResultCache(os.path.join(str(tmpdir), "results"), 10)
+    cache.fetch(filename, "spec", lambda: {"mods": {}})["mods"]["a"] = "true"
+    assert cache.fetch(filename, "spec", lambda: None) == {"mods": {}}
+
+
+def test_result_cache_survives_restart(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "mod_info.lua", 10)
+    cache = ResultCache(os.path.join(folder, "results"), 10)
+    cache.fetch(filename, "spec", lambda: "parsed")
+    cache.save()
+
+    cache = ResultCache(os.path.join(folder, "results"), 10)
+    assert cache.fetch(filename, "spec", lambda: "parsed again") == "parsed"
+
+
+def test_result_cache_drops_least_recently_used(tmpdir):
+    folder = str(tmpdir)
+    files = [write(folder, "%i.lua" % i, 10) for i in range(3)]
+    cache = ResultCache(os.path.join(folder, "results"), 2)
+    cache.fetch(files[0], "spec", lambda: 0)
+    cache.fetch(files[1], "spec", lambda: 1)
+    cache.fetch(files[0], "spec", lambda: None)
+    cache.fetch(files[2], "spec", lambda: 2)
+    assert cache.fetch(files[0], "spec", lambda: None) == 0
+    assert cache.fetch(files[1], "spec", lambda: "again") == "again"
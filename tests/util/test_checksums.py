@@ -0,0 +1,82 @@
+import hashlib
+import os
+import time
+
+from util.checksums import ChecksumManifest
+
+
+def write(folder, name, data, age=60):
+    filename = os.path.join(folder, name)
+    with open(filename, "wb") as f:
+        f.write(data)
+    then = time.time() - age
+    os.utime(filename, (then, then))
+    return filename
+
+
+def test_hashes_unchanged_files_once(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "ForgedAlliance.exe", "exe")
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    assert manifest.md5(filename) == hashlib.md5("exe").hexdigest()
+    assert manifest.md5(filename) == hashlib.md5("exe").hexdigest()
+    assert manifest.stats() == dict(hits=1, misses=1, entries=1)
+
+
+def test_rehashes_changed_files(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "gamedata.nx2", "old", age=120)
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    manifest.md5(filename)
+    write(folder, "gamedata.nx2", "new")
+    assert manifest.md5(filename) == hashlib.md5("new").hexdigest()
+
+
+def test_missing_files_have_no_checksum(tmpdir):
+    manifest = ChecksumManifest(os.path.join(str(tmpdir), "checksums.json"))
+    assert manifest.md5(os.path.join(str(tmpdir), "missing.dll")) is None
+    assert manifest.md5(str(tmpdir)) is None
+
+
+def test_survives_restart(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "gamedata.nx2", "data")
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    manifest.md5(filename)
+    manifest.save()
+
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    assert manifest.md5(filename) == hashlib.md5("data").hexdigest()
+    assert manifest.stats()["hits"] == 1
+
+
+def test_verify_hashes_every_file_again_once(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "gamedata.nx2", "data")
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    manifest.record(filename, "stale")
+    manifest.save()
+    assert ChecksumManifest(os.path.join(folder, "checksums.json")).md5(filename) == "stale"
+
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"), verify=True)
+    assert manifest.md5(filename) == hashlib.md5("data").hexdigest()
+    assert manifest.md5(filename) == hashlib.md5("data").hexdigest()
+    assert manifest.stats() == dict(hits=1, misses=1, entries=1)
+
+
+def test_does_not_keep_checksums_of_files_just_modified(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "gamedata.nx2", "data", age=0)
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    manifest.md5(filename)
+    manifest.md5(filename)
+    assert manifest.stats()["hits"] == 0
+
+
+def test_keeps_checksums_recorded_for_files_just_written(tmpdir):
+    folder = str(tmpdir)
+    filename = write(folder, "ForgedAlliance.exe", "patched", age=0)
+    manifest = ChecksumManifest(os.path.join(folder, "checksums.json"))
+    manifest.record(filename, hashlib.md5("patched").hexdigest())
+    assert manifest.md5(filename) == hashlib.md5("patched").hexdigest()
+    assert manifest.stats() == dict(hits=1, misses=0, entries=1)
@@ -0,0 +1,58 @@
+import logging
+
+from util.trafficlog import TrafficLog
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class Unformattable(object):
+    def __str__(self):
+        raise AssertionError("formatted a message that is not logged")
+
+
+def make_logger(name, level):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(level)
+    handler = RecordingHandler()
+    logger.handlers = [handler]
+    return logger, handler
+
+
+def test_traffic_log_logs_every_message_by_default():
+    logger, handler = make_logger("test_trafficlog.all", logging.INFO)
+    log = TrafficLog(logger)
+    for i in range(3):
+        log.log("message %i", i)
+    assert [r.getMessage() for r in handler.records] == ["message 0", "message 1", "message 2"]
+
+
+def test_traffic_log_does_not_format_disabled_messages():
+    logger, handler = make_logger("test_trafficlog.disabled", logging.WARNING)
+    log = TrafficLog(logger)
+    log.log("message %s", Unformattable(), size=10)
+    assert handler.records == []
+    assert log.stats() == dict(messages=1, bytes=10, sample=1)
+
+
+def test_traffic_log_samples_messages_with_counters():
+    logger, handler = make_logger("test_trafficlog.sampled", logging.INFO)
+    log = TrafficLog(logger, sample=4)
+    for i in range(10):
+        log.log("message %i", i, size=100)
+    assert [r.getMessage() for r in handler.records] == \
+        ["message 3 (1 in 4: 4 messages, 400 bytes)", "message 7 (1 in 4: 8 messages, 800 bytes)"]
+
+
+def test_traffic_log_skips_formatting_of_unsampled_messages():
+    logger, handler = make_logger("test_trafficlog.unsampled", logging.INFO)
+    log = TrafficLog(logger, sample=2)
+    log.log("message %s", Unformattable())
+    assert handler.records == []
@@ -0,0 +1,242 @@
+import os
+import StringIO
+import zipfile
+
+from util.cache import ResultCache
+from vault import luaparser
+
+SCENARIO = """version = 3
+ScenarioInfo = {
+    name = 'Seton\\'s Clutch',
+    description = 'Dozens of battles have been fought over the years.',
+    type = 'skirmish',
+    starts = true,
+    preview = '',
+    size = {1024, 1024},
+    map = '/maps/setons clutch/setons clutch.scmap',
+    map_version = 2,
+    save = '/maps/setons clutch/setons clutch_save.lua',
+    script = '/maps/setons clutch/setons clutch_script.lua',
+    norushradius = 40.000000,
+    Configurations = {
+        ['standard'] = {
+            teams = {
+                { name = 'FFA', armies = {'ARMY_1','ARMY_2','ARMY_3','ARMY_4',} },
+            },
+            customprops = {
+                ['ExtraArmies'] = STRING( 'ARMY_17 NEUTRAL_CIVILIAN' ),
+            },
+        },
+    }}
+"""
+
+SAVE = """Scenario = {
+    next_area_id = '1',
+    Props = {
+    },
+    Areas = {
+        ['AREA_1'] = {
+            ['rectangle'] = RECTANGLE( 0, 0, 512, 512 ),
+        },
+    },
+    MasterChain = {
+        ['_MASTERCHAIN_'] = {
+            Markers = {
+                ['Mass 01'] = {
+                    ['size'] = FLOAT( 1.000000 ),
+                    ['resource'] = BOOLEAN( true ),
+                    ['amount'] = FLOAT( 100.000000 ),
+                    ['color'] = STRING( 'ff808080' ),
+                    ['editorIcon'] = STRING( '/textures/editor/marker_mass.bmp' ),
+                    ['type'] = STRING( 'Mass' ),
+                    ['prop'] = STRING( '/env/common/props/markers/M_Mass_prop.bp' ),
+                    ['orientation'] = VECTOR3( 0, -0, 0 ),
+                    ['position'] = VECTOR3( 102.5, 25.1, 300.5 ),
+                },
+                ['Hydrocarbon 00'] = {
+                    ['type'] = STRING( 'Hydrocarbon' ),
+                    ['position'] = VECTOR3( 40, 10.2, 80 ),
+                },
+                ['ARMY_1'] = {
+                    ['color'] = STRING( 'ff800080' ),
+                    ['type'] = STRING( 'Blank Marker' ),
+                    ['prop'] = STRING( '/env/common/props/markers/M_Blank_prop.bp' ),
+                    ['orientation'] = VECTOR3( 0, -0, 0 ),
+                    ['position'] = VECTOR3( 256.5, 30, 100.5 ),
+                },
+            },
+        },
+    },
+    Chains = {
+    },
+    next_queue_id = '1',
+    Orders = {
+    },
+    next_platoon_id = '1',
+    Platoons = {
+    },
+    next_army_id = '1',
+    next_group_id = '0',
+    next_unit_id = '0',
+    Armies = {
+        ['ARMY_1'] =
+        {
+            personality = '',
+            plans = '',
+            color = 0,
+            faction = 0,
+            Economy = {
+                mass = 0,
+                energy = 0,
+            },
+        },
+    },
+}
+"""
+
+PREFS = """profile = {
+    current = 1,
+    profiles = {
+        {
+            Name = 'Sheeo',
+            active_mods = {
+                ['a1b2c3d4-0000-0000-0000-000000000001'] = true,
+                ['F3E2D1C0-0000-0000-0000-000000000002'] = false,
+            },
+        },
+    },
+}
+active_mods = {
+    ['a1b2c3d4-0000-0000-0000-000000000001'] = true,
+    ['F3E2D1C0-0000-0000-0000-000000000002'] = false,
+}
+options = {
+    quick_exit = 'true',
+    primary_adapter = 'windowed',
+    resolution = { 1920, 1080, 60 },
+}
+"""
+
+
+def parser_for(tmpdir, text, name="test.lua", cache=None):
+    filename = os.path.join(str(tmpdir), name)
+    with open(filename, "w") as f:
+        f.write(text)
+    return luaparser.luaParser(filename, cache=cache)
+
+
+def test_parses_scenario_infos_for_the_vault(tmpdir):
+    lua = parser_for(tmpdir, SCENARIO)
+    infos = lua.parse({'scenarioinfo>name': 'name', 'size': 'map_size', 'description': 'description',
+                       'count:armies': 'max_players', 'map_version': 'version', 'type': 'map_type',
+                       'teams>0>name': 'battle_type'}, {'version': '1'})
+    assert not lua.error and not lua.warning
+    assert infos == {'name': "Seton\\'s Clutch",
+                     'map_size': {'0': '1024', '1': '1024'},
+                     'description': 'Dozens of battles have been fought over the years.',
+                     'max_players': 4,
+                     'version': '2',
+                     'map_type': 'skirmish',
+                     'battle_type': 'FFA'}
+
+
+def test_parses_marker_positions_from_save_file(tmpdir):
+    lua = parser_for(tmpdir, SAVE)
+    markers = lua.parse({'markers>mass*>position': 'mass:__parent__',
+                         'markers>hydro*>position': 'hydro:__parent__',
+                         'markers>army*>position': 'army:__parent__'})
+    assert not lua.error
+    assert markers == {'mass': {'mass 01': 'VECTOR3( 102.5, 25.1, 300.5 )'},
+                       'hydro': {'hydrocarbon 00': 'VECTOR3( 40, 10.2, 80 )'},
+                       'army': {'army_1': 'VECTOR3( 256.5, 30, 100.5 )'}}
+
+
+def test_keeps_case_of_keys_if_asked(tmpdir):
+    lua = parser_for(tmpdir, PREFS)
+    lua.loweringKeys = False
+    mods = lua.parse({"active_mods": "active_mods"}, {"active_mods": {}})["active_mods"]
+    assert mods == {'a1b2c3d4-0000-0000-0000-000000000001': 'true',
+                    'F3E2D1C0-0000-0000-0000-000000000002': 'false'}
+
+
+def test_reports_missing_items_without_default(tmpdir):
+    lua = parser_for(tmpdir, "name = 'x'\n")
+    result = lua.parse({'name': 'name', 'uid': 'uid', 'icon': 'icon'}, {'icon': ''})
+    assert result == {'name': 'x', 'icon': ''}
+    assert lua.error and lua.errors == 1
+    assert lua.errorMsg == "Error: no matches for 'uid' were found\n"
+
+
+def test_warns_about_duplicate_items(tmpdir):
+    lua = parser_for(tmpdir, "a = { name = 'first' }\nb = { name = 'second' }\n")
+    assert lua.parse({'name': 'name'}) == {'name': 'second'}
+    assert lua.warning and lua.warnings == 1
+    assert not lua.error
+
+
+def test_skips_comments_but_not_hashes_in_strings(tmpdir):
+    lua = parser_for(tmpdir, "-- comment\n--[[ long\ncomment ]]--\nname = 'Mod #1' -- trailing\n")
+    assert lua.parse({'name': 'name', 'count:*': 'items'}) == {'name': 'Mod #1', 'items': 1}
+
+
+def test_parses_tables_on_one_line(tmpdir):
+    lua = parser_for(tmpdir, "t = { a = 1, 'x', { b = f(1, 2) }, [3] = \"y\" }\n")
+    assert lua.parse({'t': 't'}) == {'t': {'a': '1', '1': 'x', '2': {'b': 'f(1, 2)'}, '3': 'y'}}
+
+
+def test_parses_file_in_zip(tmpdir):
+    zipname = os.path.join(str(tmpdir), "mod.zip")
+    with zipfile.ZipFile(zipname, "w") as zfile:
+        zfile.writestr("mod/mod_info.lua", "name = 'Zipped'\nuid = 'abc'\n")
+    lua = luaparser.luaParser("mod_info.lua")
+    lua.iszip = True
+    lua.zip = zipfile.ZipFile(zipname)
+    assert lua.parse({'name': 'name', 'uid': 'uid'}) == {'name': 'Zipped', 'uid': 'abc'}
+
+
+def test_query_finds_the_same_markers_as_parse(tmpdir):
+    search = {'markers>mass*>position': 'mass:__parent__',
+              'markers>hydro*>position': 'hydro:__parent__',
+              'markers>army*>position': 'army:__parent__'}
+    lua = parser_for(tmpdir, SAVE)
+    assert lua.query(dict(search)) == parser_for(tmpdir, SAVE).parse(dict(search))
+    assert not lua.error
+
+
+def test_query_keeps_whole_matched_tables(tmpdir):
+    lua = parser_for(tmpdir, "t = { a = 1, { b = f(1, 2) } }\nother = { c = 3 }\n")
+    assert lua.query({'t': 't', 'count:other': 'n'}) == {'t': {'a': '1', '1': {'b': 'f(1, 2)'}}, 'n': 1}
+
+
+def test_query_stops_at_first_matches(tmpdir):
+    text = "name = 'first'\nuid = 'abc'\nname = 'second'\n"
+    lua = parser_for(tmpdir, text)
+    assert lua.query({'name': 'name', 'uid': 'uid'}) == {'name': 'first', 'uid': 'abc'}
+    assert not lua.warning
+
+    lua = parser_for(tmpdir, text)
+    assert lua.query({'name': 'name', 'uid': 'uid'}, stopEarly=False) == {'name': 'second', 'uid': 'abc'}
+    assert lua.warning
+
+
+def test_tokenizes_files_across_chunk_boundaries():
+    text = SCENARIO + SAVE + "s = [==[long\nstring]==] --[[ long\ncomment ]]\nx\n= 'a' -- [[ not long\n"
+    tokens = list(luaparser.tokenize(text))
+    for chunkSize in (1, 2, 7, 100):
+        assert list(luaparser.tokenizeFile(StringIO.StringIO(text), chunkSize)) == tokens
+
+
+def test_reuses_cached_results_and_errors(tmpdir):
+    cache = ResultCache(os.path.join(str(tmpdir), "results"), 10)
+    search = {'name': 'name', 'uid': 'uid'}
+    parser_for(tmpdir, "name = 'x'\n", cache=cache).parse(dict(search))
+    lua = luaparser.luaParser(os.path.join(str(tmpdir), "test.lua"), cache=cache)
+    assert lua.parse(dict(search)) == {'name': 'x'}
+    assert lua.error and lua.errorMsg == "Error: no matches for 'uid' were found\n"
+    assert cache.stats()["hits"] == 1
+
+    lua = parser_for(tmpdir, "name = 'y'\nuid = 'abc'\n", cache=cache)
+    assert lua.parse(dict(search)) == {'name': 'y', 'uid': 'abc'}
+    assert not lua.error
+    assert lua.query(dict(search)) == {'name': 'y', 'uid': 'abc'}
+    assert cache.stats()["hits"] == 1